@@ -0,0 +1,62 @@
+import threading
+
+
+class TestPriority:
+    HIGH = "high"
+    NORMAL = "normal"
+    LOW = "low"
+
+
+class AdmissionControl:
+    """
+    Bounds how many due tests may be in flight (queued in the executor or running) per engine type
+    and in total, so a hanging site cannot pile unbounded work in front of the ThreadPoolExecutor
+    """
+
+    def __init__(self, engine_slots, default_slots, max_in_flight, low_priority_limit=None):
+        self.__engine_slots = dict(engine_slots)
+        self.__default_slots = default_slots
+        self.__max_in_flight = max_in_flight
+        # low priority tests are shed first: they are only admitted below this total
+        self.__low_priority_limit = max_in_flight if low_priority_limit is None else low_priority_limit
+        self.__in_flight = {}
+        self.__running = {}
+        self.__lock = threading.Lock()
+
+    def slots(self, engine):
+        return self.__engine_slots.get(engine, self.__default_slots)
+
+    def try_acquire(self, engine, priority=TestPriority.NORMAL):
+        limit = self.__low_priority_limit if priority == TestPriority.LOW else self.__max_in_flight
+        with self.__lock:
+            in_flight = self.__in_flight.get(engine, 0)
+            if in_flight >= self.slots(engine) or sum(self.__in_flight.values()) >= limit:
+                return False
+            self.__in_flight[engine] = in_flight + 1
+            return True
+
+    def start(self, engine):
+        with self.__lock:
+            self.__running[engine] = self.__running.get(engine, 0) + 1
+
+    def release(self, engine, started=True):
+        with self.__lock:
+            self.__in_flight[engine] = max(0, self.__in_flight.get(engine, 0) - 1)
+            if started:
+                self.__running[engine] = max(0, self.__running.get(engine, 0) - 1)
+
+    # admitted tests still waiting for an executor worker
+    def queue_depth(self):
+        with self.__lock:
+            return sum(self.__in_flight.values()) - sum(self.__running.values())
+
+    def snapshot(self):
+        with self.__lock:
+            engines = set(self.__engine_slots).union(self.__in_flight)
+            return {
+                engine: {
+                    "slots": self.slots(engine),
+                    "in_flight": self.__in_flight.get(engine, 0),
+                    "running": self.__running.get(engine, 0)
+                } for engine in sorted(engines)
+            }
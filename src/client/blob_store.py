@@ -0,0 +1,212 @@
+import base64
+import hashlib
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+
+from src.client.testing_client import request_missing_blobs, upload_blob_chunk, link_blob
+from src.model.blob import BLOB_REF_PREFIX, BlobKind, is_blob_ref
+
+OBJECTS_DIR = "objects"
+LINKS_FILE = "pending_links.log"
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MB
+DEFAULT_UPLOAD_INTERVAL = 30  # 30 secs
+MAX_DIGESTS_PER_CHECK = 500
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+DEFAULT_MAX_AGE = 24 * 60 * 60  # 1 day
+# how long content stays inline after the service answered it has no blob endpoints
+BYPASS_INTERVAL = 30 * 60  # 30 mins
+
+
+class BlobStore:
+    """
+    Content-addressed local store of screenshots and page sources. `put` keeps one file per digest and
+    records which action references it; `upload_pending` sends each missing digest once in chunks and
+    asks the service to link it to the referencing actions. Blobs the service hasn't taken within
+    `max_age` seconds, or beyond `max_bytes`, are dropped; while the store is full or the service has no
+    blob endpoints, content stays inline in the records.
+    """
+
+    def __init__(self, directory, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=DEFAULT_MAX_BYTES,
+                 max_age=DEFAULT_MAX_AGE):
+        self.__directory = Path(directory)
+        (self.__directory / OBJECTS_DIR).mkdir(parents=True, exist_ok=True)
+        self.__chunk_size = chunk_size
+        self.__max_bytes = max_bytes
+        self.__max_age = max_age
+        self.__lock = threading.Lock()
+        self.__upload_lock = threading.Lock()
+        self.__stored_bytes = sum(size for _, size, _ in self.__stored_objects())
+        self.__bypass_until = 0
+
+    def put(self, data, kind, action_id):
+        """ returns the reference to send in place of the content """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.__object_path(digest)
+        with self.__lock:
+            if not path.is_file():
+                path.parent.mkdir(exist_ok=True)
+                tmp_path = path.with_suffix(".tmp")
+                tmp_path.write_bytes(data)
+                os.replace(tmp_path, path)
+                self.__stored_bytes += len(data)
+            else:
+                # its age counts from the last action referencing it
+                os.utime(path)
+            with open(self.__directory / LINKS_FILE, "a") as f:
+                f.write(f"{digest} {kind} {action_id}\n")
+        return f"{BLOB_REF_PREFIX}{digest}"
+
+    def externalize(self, test_case):
+        """ moves the screenshots and page sources of the test's reported actions into the store """
+        if time.monotonic() < self.__bypass_until or self.__stored_bytes >= self.__max_bytes:
+            return
+        for log in test_case.get_reported_logs():
+            screenshots = log.get_screenshots()
+            if isinstance(screenshots, str) and screenshots and not is_blob_ref(screenshots):
+                log.set_screenshots(self.put(base64.b64decode(screenshots), BlobKind.SCREENSHOT, log.get_id()))
+            page_source = log.get_page_source()
+            if isinstance(page_source, str) and page_source and not is_blob_ref(page_source):
+                log.set_page_source(self.put(page_source.encode("utf-8"), BlobKind.PAGE_SOURCE, log.get_id()))
+
+    def upload_pending(self):
+        with self.__upload_lock:
+            self.__prune()
+            if time.monotonic() < self.__bypass_until:
+                return
+            with self.__lock:
+                links = self.__read_links()
+            if not links:
+                return
+            grouped = {}
+            for digest, kind, action_id in links:
+                grouped.setdefault(digest, {}).setdefault(kind, []).append(action_id)
+            digests = list(grouped)
+            missing = set()
+            for i in range(0, len(digests), MAX_DIGESTS_PER_CHECK):
+                batch_missing = request_missing_blobs(digests[i:i + MAX_DIGESTS_PER_CHECK])
+                if batch_missing is None:
+                    logging.warning(f"Service has no blob endpoints, sending content inline for {BYPASS_INTERVAL} s")
+                    self.__bypass_until = time.monotonic() + BYPASS_INTERVAL
+                    return
+                missing.update(batch_missing)
+
+            done = set()
+            for digest in digests:
+                try:
+                    if digest in missing:
+                        self.__upload(digest)
+                    for kind, action_ids in grouped[digest].items():
+                        link_blob(digest, kind, action_ids)
+                    done.add(digest)
+                except Exception as e:
+                    logging.warning(f"Uploading blob {digest} failed, retrying later: {e}")
+            self.__forget({link for link in links if link[0] in done})
+
+    def __upload(self, digest):
+        path = self.__object_path(digest)
+        total = path.stat().st_size
+        offset = 0
+        with open(path, "rb") as f:
+            while True:
+                f.seek(offset)
+                chunk = f.read(self.__chunk_size)
+                # the service answers with how much it holds, so a broken upload resumes where it stopped
+                received = upload_blob_chunk(digest, chunk, offset, total)
+                if received >= total:
+                    return
+                if received == offset and chunk:
+                    raise IOError(f"service did not accept the chunk at {offset}")
+                offset = received
+
+    def __prune(self):
+        """ drops the blobs older than max_age, then the oldest ones while the store holds more than max_bytes """
+        objects = sorted(self.__stored_objects())
+        stored_bytes = sum(size for _, size, _ in objects)
+        cutoff = time.time() - self.__max_age
+        dropped = set()
+        for mtime, size, digest in objects:
+            if mtime >= cutoff and stored_bytes <= self.__max_bytes:
+                break
+            dropped.add(digest)
+            stored_bytes -= size
+        if dropped:
+            logging.warning(f"Dropping {len(dropped)} blobs the service didn't take in time")
+            self.__forget(set(), dropped=dropped)
+        self.__stored_bytes = stored_bytes
+
+    def __stored_objects(self):
+        """ (mtime, size, digest) of each stored blob """
+        objects = []
+        for path in (self.__directory / OBJECTS_DIR).glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            objects.append((stat.st_mtime, stat.st_size, path.name))
+        return objects
+
+    def __forget(self, links, dropped=frozenset()):
+        """ drops the handled links and every link of the `dropped` digests, links added meanwhile stay """
+        if not links and not dropped:
+            return
+        with self.__lock:
+            remaining = [link for link in self.__read_links() if link not in links and link[0] not in dropped]
+            links_path = self.__directory / LINKS_FILE
+            tmp_path = links_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                for digest, kind, action_id in remaining:
+                    f.write(f"{digest} {kind} {action_id}\n")
+            os.replace(tmp_path, links_path)
+            still_linked = {digest for digest, _, _ in remaining}
+            for digest in ({link[0] for link in links} | dropped) - still_linked:
+                path = self.__object_path(digest)
+                try:
+                    self.__stored_bytes -= path.stat().st_size
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def __read_links(self):
+        links_path = self.__directory / LINKS_FILE
+        if not links_path.is_file():
+            return []
+        links = []
+        with open(links_path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3:
+                    links.append(tuple(parts))
+        return links
+
+    def __object_path(self, digest):
+        return self.__directory / OBJECTS_DIR / digest[:2] / digest
+
+
+class BlobUploader:
+
+    def __init__(self, blob_store, interval=DEFAULT_UPLOAD_INTERVAL):
+        self.__blob_store = blob_store
+        self.__interval = interval
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name="blob_uploader", daemon=True)
+        self.__thread.start()
+
+    def close(self, timeout=30):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def __run(self):
+        while not self.__stop.wait(self.__interval):
+            try:
+                self.__blob_store.upload_pending()
+            except Exception as e:
+                logging.warning(f"Uploading blobs failed: {e}")
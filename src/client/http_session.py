@@ -0,0 +1,151 @@
+import gzip
+import json
+import logging
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError as RequestConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import NewConnectionError
+
+DEFAULT_POOL_SIZE = 6
+CONNECT_TIMEOUT = 5  # 5 secs
+READ_TIMEOUT = 60  # 1 min
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 0.5  # 500 ms
+RETRY_MAX_DELAY = 10  # 10 secs
+RETRY_STATUSES = {502, 503, 504}
+GZIP_MIN_SIZE = 8 * 1024  # 8 KB
+# path segments standing for a resource rather than a route, like /blobs/<digest>
+_RESOURCE_SEGMENT = re.compile(r"^[0-9a-f]{32,}$")
+
+
+def _never_sent(error):
+    """ the connection failed before anything was sent, so the request can't have reached the service """
+    if isinstance(error, ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError, whose reason is the connection error itself
+    cause = error.args[0] if error.args else None
+    return isinstance(getattr(cause, "reason", cause), NewConnectionError)
+
+
+class ServiceSession:
+    """
+    Thread-safe keep-alive session to the monitoring service. GETs and PUTs are retried on connection
+    errors, timeouts and gateway statuses; POSTs only when the connection couldn't be established, since
+    a reset or a gateway error may come after the service processed them.
+    Retries back off exponentially with full jitter so a fleet of agents doesn't retry in lockstep.
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 max_retries=MAX_RETRIES):
+        self.__timeout = timeout
+        self.__max_retries = max_retries
+        self.__stats_lock = threading.Lock()
+        self.__stats = {}
+        self.__session = None
+        self.__adapter = None
+        self.resize(pool_size)
+
+    def resize(self, pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        old_session, self.__session, self.__adapter = self.__session, session, adapter
+        if old_session is not None:
+            old_session.close()
+
+    def get(self, url, params=None, headers=None):
+        return self.__request("GET", url, params=params, headers=headers)
+
+    def post(self, url, json_body=None, headers=None):
+        headers = dict(headers or {})
+        data = json.dumps(json_body).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+        if len(data) >= GZIP_MIN_SIZE:
+            data = gzip.compress(data, compresslevel=5)
+            headers["Content-Encoding"] = "gzip"
+        return self.__request("POST", url, data=data, headers=headers)
+
+    def put(self, url, data, headers=None):
+        return self.__request("PUT", url, data=data, headers=headers)
+
+    def post_lines(self, url, lines, headers=None):
+        """ posts the lines as a gzip NDJSON body """
+        headers = dict(headers or {})
+        headers["Content-Type"] = "application/x-ndjson"
+        headers["Content-Encoding"] = "gzip"
+        data = gzip.compress("".join(f"{line.strip()}\n" for line in lines).encode("utf-8"), compresslevel=5)
+        return self.__request("POST", url, data=data, headers=headers)
+
+    def __request(self, method, url, **kwargs):
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.__session.request(method, url, timeout=self.__timeout, **kwargs)
+            except (RequestConnectionError, Timeout) as e:
+                self.__record(url, time.perf_counter() - start, error=True)
+                # PUTs carry their offset, GETs change nothing
+                retryable = method in ["GET", "PUT"] or _never_sent(e)
+                if not retryable or attempt >= self.__max_retries:
+                    raise
+                logging.info(f"{method} {url} failed, retrying: {e}")
+            else:
+                self.__record(url, time.perf_counter() - start, error=response.status_code >= 500)
+                if response.status_code not in RETRY_STATUSES or method == "POST" or attempt >= self.__max_retries:
+                    return response
+                logging.info(f"{method} {url} answered {response.status_code}, retrying")
+            attempt += 1
+            self.__record_retry(url)
+            time.sleep(random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt)))
+
+    @staticmethod
+    def __route(url):
+        segments = [s for s in urlsplit(url).path.split("/") if s and not _RESOURCE_SEGMENT.match(s)]
+        return "/".join(segments)
+
+    def __endpoint_stats(self, url):
+        endpoint = self.__route(url)
+        stats = self.__stats.get(endpoint)
+        if stats is None:
+            stats = self.__stats[endpoint] = {
+                "requests": 0, "errors": 0, "retries": 0, "total_latency": 0.0, "max_latency": 0.0
+            }
+        return stats
+
+    def __record(self, url, latency, error=False):
+        with self.__stats_lock:
+            stats = self.__endpoint_stats(url)
+            stats["requests"] += 1
+            stats["errors"] += 1 if error else 0
+            stats["total_latency"] += latency
+            stats["max_latency"] = max(stats["max_latency"], latency)
+
+    def __record_retry(self, url):
+        with self.__stats_lock:
+            self.__endpoint_stats(url)["retries"] += 1
+
+    def connections_opened(self):
+        pools = self.__adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in list(pools.keys()) if key in pools)
+
+    def stats(self, reset=False):
+        with self.__stats_lock:
+            endpoints = {
+                endpoint: {
+                    "requests": s["requests"],
+                    "errors": s["errors"],
+                    "retries": s["retries"],
+                    "avg_latency_ms": int(s["total_latency"] / s["requests"] * 1000) if s["requests"] else 0,
+                    "max_latency_ms": int(s["max_latency"] * 1000)
+                } for endpoint, s in self.__stats.items()
+            }
+            if reset:
+                self.__stats = {}
+        return {"connections_opened": self.connections_opened(), "endpoints": endpoints}
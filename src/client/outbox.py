@@ -0,0 +1,242 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".log"
+INDEX_FILE = "delivered.idx"
+DEFAULT_SEGMENT_MAX_BYTES = 16 * 1024 * 1024  # 16 MB
+DEFAULT_RETENTION = 3 * 24 * 60 * 60  # 3 days
+DEFAULT_COMPACTION_INTERVAL = 60 * 60  # 1 hour
+# a sealed segment is rewritten once at most this share of its records is still pending
+REWRITE_PENDING_RATIO = 0.5
+KEY_SIZE = 16
+# hex epoch seconds the record was first appended, kept when segments are rewritten
+APPENDED_SIZE = 8
+# delivered key, delivered epoch seconds
+INDEX_ENTRY = struct.Struct(f">{KEY_SIZE}sd")
+
+
+def record_key(feature_id, event_time):
+    """ stable across runs and machines, unlike the built-in hash() """
+    return hashlib.blake2b(f"{feature_id}|{event_time}".encode("utf-8"), digest_size=KEY_SIZE).digest()
+
+
+class _Segment:
+
+    def __init__(self, seq, path):
+        self.seq = seq
+        self.path = path
+        self.records = 0
+        self.pending = 0
+
+
+class Outbox:
+    """
+    Append-only segmented store of records waiting for delivery. Each segment line is
+    `<hex key> <hex appended time> <record>`; delivered keys are appended to a fixed-size binary index,
+    so startup only reads the index and the segments still holding pending records. A background
+    compaction drops fully delivered segments, rewrites mostly delivered ones and expires old index
+    entries and records still pending after `retention`.
+    """
+
+    def __init__(self, directory, segment_max_bytes=DEFAULT_SEGMENT_MAX_BYTES, retention=DEFAULT_RETENTION,
+                 compaction_interval=DEFAULT_COMPACTION_INTERVAL):
+        self.__directory = Path(directory)
+        self.__directory.mkdir(parents=True, exist_ok=True)
+        self.__segment_max_bytes = segment_max_bytes
+        self.__retention = retention
+        self.__lock = threading.RLock()
+        self.__delivered = {}
+        self.__pending = {}  # key -> (segment seq, offset, length, appended epoch seconds)
+        self.__segments = {}
+        self.__active = None
+        self.__active_writer = None
+
+        self.__load_index()
+        self.__recover_segments()
+        self.__index_writer = open(self.__directory / INDEX_FILE, "ab")
+        self.__roll_segment()
+
+        self.__stop = threading.Event()
+        self.__compactor = threading.Thread(target=self.__compact_periodically, args=(compaction_interval,),
+                                            name="outbox_compaction", daemon=True)
+        self.__compactor.start()
+
+    def append(self, key, record):
+        """ False when the record was delivered or is already waiting """
+        line = record.strip().encode("utf-8")
+        with self.__lock:
+            if key in self.__delivered or key in self.__pending:
+                return False
+            self.__write(key, line, int(time.time()))
+            return True
+
+    def mark_delivered(self, key):
+        with self.__lock:
+            location = self.__pending.pop(key, None)
+            if location is not None:
+                self.__segments[location[0]].pending -= 1
+            now = time.time()
+            self.__delivered[key] = now
+            self.__index_writer.write(INDEX_ENTRY.pack(key, now))
+            self.__index_writer.flush()
+
+    def is_delivered(self, key):
+        with self.__lock:
+            return key in self.__delivered
+
+    def pending_keys(self):
+        with self.__lock:
+            return list(self.__pending)
+
+    def pending_count(self):
+        with self.__lock:
+            return len(self.__pending)
+
+    def read(self, key):
+        with self.__lock:
+            location = self.__pending.get(key)
+            if location is None:
+                return None
+            seq, offset, length, _ = location
+            self.__active_writer.flush()
+            with open(self.__segments[seq].path, "rb") as f:
+                f.seek(offset)
+                return f.read(length).decode("utf-8")
+
+    def compact(self):
+        with self.__lock:
+            self.__expire_pending()
+            for seq in sorted(self.__segments):
+                segment = self.__segments[seq]
+                if segment is self.__active:
+                    continue
+                if segment.pending == 0:
+                    del self.__segments[seq]
+                    segment.path.unlink(missing_ok=True)
+                elif segment.pending <= segment.records * REWRITE_PENDING_RATIO or \
+                        time.time() - segment.path.stat().st_mtime >= self.__retention / 2:
+                    # old segments are rewritten before the index forgets their delivered records
+                    self.__rewrite(segment)
+            self.__compact_index()
+
+    def close(self):
+        self.__stop.set()
+        with self.__lock:
+            self.__active_writer.close()
+            self.__index_writer.close()
+
+    def __write(self, key, line, appended):
+        if self.__active_writer.tell() >= self.__segment_max_bytes:
+            self.__roll_segment()
+        offset = self.__active_writer.tell() + KEY_SIZE * 2 + 1 + APPENDED_SIZE + 1
+        self.__active_writer.write(key.hex().encode("ascii") + b" " + f"{appended:08x}".encode("ascii") + b" " +
+                                   line + b"\n")
+        self.__active_writer.flush()
+        self.__pending[key] = (self.__active.seq, offset, len(line), appended)
+        self.__active.records += 1
+        self.__active.pending += 1
+
+    def __roll_segment(self):
+        if self.__active_writer is not None:
+            self.__active_writer.close()
+        seq = max(self.__segments, default=0) + 1
+        self.__active = _Segment(seq, self.__directory / f"{SEGMENT_PREFIX}{seq:08d}{SEGMENT_SUFFIX}")
+        self.__segments[seq] = self.__active
+        self.__active_writer = open(self.__active.path, "ab")
+
+    def __rewrite(self, segment):
+        with open(segment.path, "rb") as f:
+            for key, (seq, offset, length, appended) in list(self.__pending.items()):
+                if seq != segment.seq:
+                    continue
+                f.seek(offset)
+                self.__write(key, f.read(length), appended)
+        del self.__segments[segment.seq]
+        segment.path.unlink(missing_ok=True)
+
+    def __load_index(self):
+        index_path = self.__directory / INDEX_FILE
+        if not index_path.is_file():
+            return
+        content = index_path.read_bytes()
+        # a torn tail entry from a crash is dropped
+        usable = len(content) - len(content) % INDEX_ENTRY.size
+        for key, delivered_time in INDEX_ENTRY.iter_unpack(content[:usable]):
+            self.__delivered[key] = delivered_time
+
+    def __recover_segments(self):
+        for path in sorted(self.__directory.glob(f"{SEGMENT_PREFIX}*{SEGMENT_SUFFIX}")):
+            try:
+                seq = int(path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            except ValueError:
+                continue
+            segment = _Segment(seq, path)
+            # lines written before the appended time was kept are as old as their segment at most
+            segment_time = int(path.stat().st_mtime)
+            threshold = time.time() - self.__retention
+            offset = 0
+            with open(path, "rb") as f:
+                for raw in f:
+                    line_offset, offset = offset, offset + len(raw)
+                    if not raw.endswith(b"\n"):
+                        # torn write, the record was never acknowledged to the caller
+                        break
+                    try:
+                        key = bytes.fromhex(raw[:KEY_SIZE * 2].decode("ascii"))
+                    except ValueError:
+                        continue
+                    segment.records += 1
+                    if key in self.__delivered or key in self.__pending:
+                        continue
+                    header_size, appended = KEY_SIZE * 2 + 1, segment_time
+                    field = raw[header_size:header_size + APPENDED_SIZE + 1]
+                    # a record is a json object, so it never starts like a hex time
+                    if field.endswith(b" ") and all(c in b"0123456789abcdef" for c in field[:-1]):
+                        header_size, appended = header_size + APPENDED_SIZE + 1, int(field[:-1], 16)
+                    if appended < threshold:
+                        continue
+                    self.__pending[key] = (seq, line_offset + header_size, len(raw) - header_size - 1, appended)
+                    segment.pending += 1
+            self.__segments[seq] = segment
+        if self.__pending:
+            logging.info(f"Recovered {len(self.__pending)} pending records from {len(self.__segments)} segments")
+
+    # the record never got through within `retention`, it is dropped like the old queue dropped it
+    def __expire_pending(self):
+        threshold = time.time() - self.__retention
+        expired = [key for key, location in self.__pending.items() if location[3] < threshold]
+        for key in expired:
+            seq = self.__pending.pop(key)[0]
+            self.__segments[seq].pending -= 1
+        if expired:
+            logging.warning(f"Dropped {len(expired)} records not delivered in {self.__retention} seconds")
+
+    def __compact_index(self):
+        threshold = time.time() - self.__retention
+        expired = [key for key, delivered_time in self.__delivered.items()
+                   if delivered_time < threshold and key not in self.__pending]
+        if not expired:
+            return
+        for key in expired:
+            del self.__delivered[key]
+        index_path = self.__directory / INDEX_FILE
+        tmp_path = index_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            for key, delivered_time in self.__delivered.items():
+                f.write(INDEX_ENTRY.pack(key, delivered_time))
+        self.__index_writer.close()
+        os.replace(tmp_path, index_path)
+        self.__index_writer = open(index_path, "ab")
+
+    def __compact_periodically(self, interval):
+        while not self.__stop.wait(interval):
+            try:
+                self.compact()
+            except Exception as e:
+                logging.error(f"Outbox compaction failed: {e}")
@@ -0,0 +1,60 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class ScheduleQueue:
+    """
+    Min-heap of holders ordered by `next_schedule`, guarded by a condition so the consumer
+    can sleep until the head is due and still be woken by a sooner push or an explicit `wake`
+    """
+
+    def __init__(self):
+        self.__heap = []
+        self.__seq = itertools.count()
+        self.__cond = threading.Condition()
+        self.__woken = False
+
+    def push(self, holder):
+        due = holder.next_schedule.timestamp()
+        with self.__cond:
+            heapq.heappush(self.__heap, (due, next(self.__seq), holder))
+            # only a new head can shorten the consumer's sleep
+            if self.__heap[0][2] is holder:
+                self.__cond.notify_all()
+
+    def wake(self):
+        with self.__cond:
+            self.__woken = True
+            self.__cond.notify_all()
+
+    # returns the head holder once it is due, or None when `deadline` (epoch seconds) passes or on wake()
+    def pop_due(self, deadline=None):
+        with self.__cond:
+            while True:
+                if self.__woken:
+                    self.__woken = False
+                    return None
+                now = time.time()
+                if self.__heap and self.__heap[0][0] <= now:
+                    return heapq.heappop(self.__heap)[2]
+                if deadline is not None and deadline <= now:
+                    return None
+
+                wait_until = self.__heap[0][0] if self.__heap else None
+                if deadline is not None:
+                    wait_until = deadline if wait_until is None else min(wait_until, deadline)
+                self.__cond.wait(None if wait_until is None else wait_until - now)
+
+    def peek(self):
+        with self.__cond:
+            return self.__heap[0][2] if self.__heap else None
+
+    def snapshot(self):
+        with self.__cond:
+            return [holder for _, _, holder in self.__heap]
+
+    def __len__(self):
+        with self.__cond:
+            return len(self.__heap)
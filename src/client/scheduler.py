@@ -1,20 +1,23 @@
 import logging
-import queue
 import random
-import time
 import json
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
 from requests.exceptions import RequestException
 
-from object_pool import ObjectPool
-
+from src.client.admission import AdmissionControl, TestPriority
+from src.client.blob_store import BlobStore, BlobUploader
+from src.client.schedule_queue import ScheduleQueue
+from src.client.scheduler_state import SchedulerState
 from src.client.test_submitter import TestSubmitter
 from src.client.utils import VmStatistics
 from src.client.testing_client import submit_record, request_tests, request_maintenance_features, submit_vm_report, \
-    TestScheduleJson
+    TestScheduleJson, configure_session
 from src.test_script.script_dict import get_test_script
-from src.test_script.script_test import get_driver
+from src.test_script.browser_pool import BrowserPool
+from src.test_script.browser_tabs import TabPool
+from src.test_script.probe_engine import ProbeEngine
 from src.test_script.script_utils import delete_obsolete_temp_driver_dirs
 
 REFRESH_INTERVAL = timedelta(minutes=10)
@@ -22,6 +25,15 @@ SKIPPING_TEST_THRESHOLD = timedelta(minutes=5)
 MAX_TEST_RUNNING_MINUTES = 30
 TEST_RESULT_SKIPPED = 'skip'
 MAX_SERVER_CONNECTION_LOST_ALLOWANCE = timedelta(days=2)
+DEFAULT_CONCURRENCY = 4
+BLOBS_DIR_NAME = "namp_blobs"
+# admitted tests allowed to wait for a worker, on top of the running ones
+RUN_QUEUE_SIZE_PER_WORKER = 1
+DEFER_DELAYS = {
+    TestPriority.HIGH: timedelta(seconds=5),
+    TestPriority.NORMAL: timedelta(seconds=30),
+    TestPriority.LOW: timedelta(minutes=2)
+}
 
 
 class DriverRunningType:
@@ -29,19 +41,55 @@ class DriverRunningType:
     SHARED_DRIVER = "selenium_shared"
     CONSOLE = "console"
     TEST_EXECUTE = "test_execute"
+    # availability scripts probed over HTTP, a pooled browser only when the probe isn't conclusive
+    HTTP_PROBE = "http_probe"
+    # tests as tabs of a browser shared with other tests
+    SHARED_TABS = "selenium_tabs"
+
+
+def default_engine_slots(concurrency, tab_capacity=0):
+    return {
+        DriverRunningType.SHARED_DRIVER: concurrency,
+        DriverRunningType.SHARED_TABS: tab_capacity,
+        DriverRunningType.SEPARATED_DRIVER: concurrency,
+        DriverRunningType.CONSOLE: concurrency,
+        DriverRunningType.HTTP_PROBE: concurrency,
+        # run_te kills any running TestExecute, so never run two at once
+        DriverRunningType.TEST_EXECUTE: 1
+    }
+
+
+# low priority tests never wait in the run queue, they only take a free worker
+# tabs have workers of their own on top of `concurrency`, see TestScheduler.execute
+def _create_admission(concurrency, engine_slots=None, tab_capacity=0):
+    slots = default_engine_slots(concurrency, tab_capacity)
+    if engine_slots is not None:
+        slots.update(engine_slots)
+    return AdmissionControl(slots, concurrency, concurrency * (1 + RUN_QUEUE_SIZE_PER_WORKER) + tab_capacity,
+                            low_priority_limit=concurrency)
 
 
 class _TestScriptHolder:
 
-    def __init__(self, test_script, driver_running_type, minute_interval, next_schedule):
+    def __init__(self, test_script, driver_running_type, minute_interval, next_schedule,
+                 priority=TestPriority.NORMAL):
         self.test_script = test_script
         self.driver_running_type = driver_running_type
         self.minute_interval = minute_interval
+        # the slot the cadence steps from; next_schedule, the dispatch time, only differs while deferred
+        self.nominal_schedule = next_schedule
         self.next_schedule = next_schedule
+        self.priority = priority
 
     def schedule_next(self):
-        while self.next_schedule <= datetime.now():
-            self.next_schedule = self.next_schedule + timedelta(minutes=self.minute_interval)
+        while self.nominal_schedule <= datetime.now():
+            self.nominal_schedule = self.nominal_schedule + timedelta(minutes=self.minute_interval)
+        self.next_schedule = self.nominal_schedule
+        return self.next_schedule
+
+    # delays this dispatch only, the following runs keep their slots
+    def defer(self, delay):
+        self.next_schedule = datetime.now() + delay
         return self.next_schedule
 
     def __lt__(self, other):
@@ -50,50 +98,33 @@ class _TestScriptHolder:
         return this_tstamp < that_tstamp
 
 
-class _DriverHolder:
-
-    def __init__(self):
-        self.driver = None
-        self.checked_feature = set()
-
-    # currently only support DriverType.DEFAULT
-    def take_driver(self, feature_id):
-        if self.driver is None or feature_id in self.checked_feature:
-            # probably redundant
-            if self.driver is not None:
-                self.clean_up()
-            self.checked_feature.clear()
-            self.driver = get_driver()
-
-        self.checked_feature.add(feature_id)
-        return self.driver
-
-    def clean_up(self):
-        if self.driver is not None:
-            self.driver.quit()
-            self.driver = None
-
-    def __del__(self):
-        self.clean_up()
-
-
 class TestScheduler:
 
     def __init__(self, region, data_dir):
-        self.holder_pq = queue.PriorityQueue()
-        self.driver_pool = ObjectPool(_DriverHolder, min_init=2)
+        self.holder_queue = ScheduleQueue()
+        self.browser_pool = BrowserPool()
+        self.probe_engine = ProbeEngine()
+        self.tab_pool = TabPool(self.browser_pool)
         self.region = region
-        self.scheduled_features = set()
+        # running and scheduled features, updated from the executor workers
+        self.state = SchedulerState()
         self.next_refresh_time = datetime.now()
         self.vm_stats = VmStatistics()
-        self.running_queue_size = 0
-        self.running_features = {}
+        self.admission = _create_admission(DEFAULT_CONCURRENCY)
         self.data_dir = data_dir
         self.test_submitter = TestSubmitter(data_dir)
+        # screenshots and page sources are uploaded apart from the test records
+        self.blob_store = BlobStore(Path(data_dir) / BLOBS_DIR_NAME)
+        self.blob_uploader = BlobUploader(self.blob_store)
         self.last_successfully_server_connection = datetime.now()
 
     def __push_holder(self, holder):
-        self.holder_pq.put(holder)
+        self.holder_queue.push(holder)
+
+    # preempts the dispatcher's wait so the next loop refreshes immediately, test_execute_tool calls it on SIGHUP
+    def request_refresh(self):
+        self.next_refresh_time = datetime.now()
+        self.holder_queue.wake()
 
     def __refresh(self):
         try:
@@ -113,32 +144,28 @@ class TestScheduler:
             feature_id = test.get(TestScheduleJson.FEATURE_ID)
             engine_type = test.get(TestScheduleJson.ENGINE_TYPE)
             interval = int(test.get(TestScheduleJson.INTERVAL))
+            priority = test.get(TestScheduleJson.PRIORITY) or TestPriority.NORMAL
 
             if feature_id in maintenance_features:
                 logging.info(f"Skip in maintenance feature: '{feature_id}'")
             else:
                 next_running_features.append(feature_id)
-                if feature_id not in self.scheduled_features:
+                if not self.state.is_scheduled(feature_id):
                     ts = get_test_script(feature_id)
                     if ts is None:
                         logging.fatal(f"Not found tests for '{feature_id}'")
                         exit(1)
                     if "selenium" in engine_type or engine_type in [DriverRunningType.TEST_EXECUTE,
-                                                                    DriverRunningType.CONSOLE]:
-                        self.add(ts, engine_type, interval)
-                        self.scheduled_features.add(feature_id)
+                                                                    DriverRunningType.CONSOLE,
+                                                                    DriverRunningType.HTTP_PROBE]:
+                        self.add(ts, engine_type, interval, priority=priority)
+                        self.state.add_scheduled(feature_id)
                     else:
                         logging.warning(f"Not handling due engine type '{engine_type}' - '{feature_id}'")
                     # TODO: support others
 
-        to_be_removed = []
-        for feature_id in self.scheduled_features:
-            if feature_id not in next_running_features:
-                logging.info(f"No schedule for feature: '{feature_id}'")
-                to_be_removed.append(feature_id)
-
-        for feature_id in to_be_removed:
-            self.scheduled_features.remove(feature_id)
+        for feature_id in self.state.retain_scheduled(next_running_features):
+            logging.info(f"No schedule for feature: '{feature_id}'")
 
         report = self.vm_stats.gen_report(self)
         # TODO: VM Report needs queuing mechanism as well
@@ -147,14 +174,21 @@ class TestScheduler:
         logging.info(f"VM Report:\n{json.dumps(report, indent=2)}")
 
     # random start in within interval
-    def add(self, test_script, driver_running_type, interval):
+    def add(self, test_script, driver_running_type, interval, priority=TestPriority.NORMAL):
         delay = random.randint(0, (interval * 60))
         next_schedule = datetime.now() + timedelta(seconds=delay)
-        holder = _TestScriptHolder(test_script, driver_running_type, interval, next_schedule)
+        holder = _TestScriptHolder(test_script, driver_running_type, interval, next_schedule, priority=priority)
         self.__push_holder(holder)
         logging.info(f'Scheduled next\t{delay} seconds for: "{test_script.get_feature_id()}"')
 
     def submit_holder(self, ts_holder, submitting_time):
+        self.admission.start(ts_holder.driver_running_type)
+        try:
+            self.__submit_holder(ts_holder, submitting_time)
+        finally:
+            self.admission.release(ts_holder.driver_running_type)
+
+    def __submit_holder(self, ts_holder, submitting_time):
         test_result = None
         test_script = ts_holder.test_script
         feature_id = test_script.get_feature_id()
@@ -164,80 +198,109 @@ class TestScheduler:
             logging.info(f"Skip obsolete scheduled test: {feature_id}"
                          f"(delayed {(datetime.now() - submitting_time).total_seconds()} seconds)")
             self.finish_test(test_script, TEST_RESULT_SKIPPED)
-        elif feature_id not in self.scheduled_features:
+        elif not self.state.is_scheduled(feature_id):
             logging.info(f"Skip not scheduled feature: {feature_id}")
             self.finish_test(test_script, TEST_RESULT_SKIPPED)
         else:
             try:
                 self.start_test(test_script)
-                if ts_holder.driver_running_type in [DriverRunningType.SEPARATED_DRIVER,
-                                                     DriverRunningType.CONSOLE,
+                if ts_holder.driver_running_type in [DriverRunningType.CONSOLE,
                                                      DriverRunningType.TEST_EXECUTE]:
                     test_result = _run_script(self, test_script, None)
+                elif ts_holder.driver_running_type == DriverRunningType.HTTP_PROBE:
+                    test_result = _run_script(self, test_script, None, driver_pool=self.browser_pool,
+                                              probe_engine=self.probe_engine)
+                elif ts_holder.driver_running_type == DriverRunningType.SHARED_TABS:
+                    with self.tab_pool.lease(**test_script.get_driver_spec()) as driver:
+                        test_result = _run_script(self, test_script, driver)
+                elif ts_holder.driver_running_type == DriverRunningType.SEPARATED_DRIVER:
+                    # the script leases a session matching its own driver type and options
+                    test_result = _run_script(self, test_script, None, driver_pool=self.browser_pool)
                 else:
-                    with self.driver_pool.get() as (driver_holder, stats):
-                        driver = driver_holder.take_driver(feature_id)
+                    with self.browser_pool.lease() as driver:
                         test_result = _run_script(self, test_script, driver)
             finally:
                 self.finish_test(test_script, test_result)
 
-    def execute(self, end_time, concurrency=4):
+    def execute(self, end_time, concurrency=DEFAULT_CONCURRENCY, engine_slots=None):
+        tab_capacity = self.tab_pool.capacity()
+        self.admission = _create_admission(concurrency, engine_slots=engine_slots, tab_capacity=tab_capacity)
+        configure_session(concurrency + tab_capacity)
+        self.blob_uploader.start()
         try:
-            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            with ThreadPoolExecutor(max_workers=concurrency + tab_capacity) as executor:
                 while True:
                     if self.next_refresh_time <= datetime.now():
                         self.__refresh()
                         self.next_refresh_time = datetime.now() + REFRESH_INTERVAL
 
-                    holder = self.holder_pq.get()
-
-                    if holder is None:
+                    next_holder = self.holder_queue.peek()
+                    if next_holder is None:
                         logging.warning("no tests is running")
-                        sleeping = 10
                     else:
-                        sleeping = (holder.next_schedule - datetime.now()).total_seconds()
+                        logging.debug(f'wait until {next_holder.next_schedule}: '
+                                      f'{next_holder.test_script.get_feature_id()}')
 
-                    if sleeping > 0:
-                        logging.info(
-                            f'sleep {sleeping} seconds at next {holder.next_schedule}: {holder.test_script.get_feature_id()}')
-                        time.sleep(sleeping)
+                    # wakes on due holder, refresh deadline, sooner push or a refresh requested on SIGHUP
+                    holder = self.holder_queue.pop_due(deadline=self.next_refresh_time.timestamp())
+                    if holder is None:
+                        continue
 
-                    if holder is not None and holder.test_script.get_feature_id() in self.scheduled_features:
+                    if self.state.is_scheduled(holder.test_script.get_feature_id()):
                         # if we're Linux we want to run forever
                         if end_time is not None and datetime.now() > end_time:
                             break
-                        else:
+                        elif self.admission.try_acquire(holder.driver_running_type, priority=holder.priority):
                             self.schedule_test(holder)
                             executor.submit(self.submit_holder, holder, datetime.now())
+                        else:
+                            self.defer_test(holder)
         finally:
+            self.tab_pool.close()
+            self.browser_pool.close()
+            self.probe_engine.close()
             self.test_submitter.close()
+            self.blob_uploader.close()
 
     def schedule_test(self, holder):
-        self.running_queue_size += 1
+        self.state.enqueue()
         holder.schedule_next()
         self.__push_holder(holder)
 
+    # backpressure: the engine is saturated, so retry later instead of queuing behind a hanging site
+    def defer_test(self, holder):
+        next_try = holder.defer(DEFER_DELAYS.get(holder.priority, DEFER_DELAYS[TestPriority.NORMAL]))
+        self.vm_stats.defer_test()
+        self.__push_holder(holder)
+        logging.info(f"Deferred ({holder.priority}) until {next_try}: {holder.test_script.get_feature_id()}")
+
     def finish_test(self, test_script, test_result):
-        if test_result is not None and test_result != TEST_RESULT_SKIPPED:
-            self.running_features.pop(test_script.get_feature_id(), None)
-        self.running_queue_size -= 1
+        self.state.finish(test_script.get_feature_id(),
+                          completed=test_result is not None and test_result != TEST_RESULT_SKIPPED)
         logging.info('Finished: %s - %s: %s' % (test_script.get_app_id(), test_script.get_feature_id(), test_result))
 
     def start_test(self, test_script):
-        self.running_features[test_script.get_feature_id()] = datetime.now()
+        self.state.start(test_script.get_feature_id(), datetime.now())
         logging.info('Started: %s - %s' % (test_script.get_app_id(), test_script.get_feature_id()))
 
 
-def _run_script(scheduler, test_script, driver):
+def _run_script(scheduler, test_script, driver, driver_pool=None, probe_engine=None):
     test_case = None
     try:
         hard_timeout = None
-        if driver is None:
+        # scripts without a probe run in their own pooled browser
+        if probe_engine is not None and hasattr(test_script, "probe_execute"):
+            test_case = test_script.probe_execute(probe_engine, region=scheduler.region, driver_pool=driver_pool)
+        elif driver is None and driver_pool is not None:
+            test_case = test_script.execute(region=scheduler.region, hard_timeout=hard_timeout,
+                                            driver_pool=driver_pool)
+        elif driver is None:
             test_case = test_script.execute(region=scheduler.region, hard_timeout=hard_timeout)
         else:
             test_case = test_script.execute(driver=driver, region=scheduler.region, hard_timeout=hard_timeout)
-        submit_result = scheduler.test_submitter.submit_record(test_case.to_json())
-        scheduler.vm_stats.record(test_case, submit_result)
+        scheduler.blob_store.externalize(test_case)
+        scheduler.test_submitter.enqueue(
+            test_case.to_json(), callback=lambda status_code: scheduler.vm_stats.record(test_case, status_code))
     except Exception as e:
         logging.error(e)
     finally:
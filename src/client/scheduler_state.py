@@ -0,0 +1,82 @@
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+StateSnapshot = namedtuple("StateSnapshot", ["running_queue_size", "running_features", "scheduled_features"])
+
+
+class AtomicCounter:
+
+    def __init__(self, value=0):
+        self.__value = value
+        self.__lock = threading.Lock()
+
+    def add(self, n=1):
+        with self.__lock:
+            self.__value += n
+            return self.__value
+
+    def value(self):
+        return self.__value
+
+    # the count so far, restarting from zero in the same step so nothing added meanwhile is lost
+    def reset(self):
+        with self.__lock:
+            value, self.__value = self.__value, 0
+            return value
+
+
+class SchedulerState:
+    """
+    Running and scheduled tests as seen by the dispatcher and the executor workers. Every change is made
+    on a copy under a lock and published as a new immutable snapshot, so `snapshot()` needs no lock and
+    its counter and features always belong to the same moment
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__snapshot = StateSnapshot(0, MappingProxyType({}), frozenset())
+
+    def snapshot(self):
+        return self.__snapshot
+
+    def is_scheduled(self, feature_id):
+        return feature_id in self.__snapshot.scheduled_features
+
+    def add_scheduled(self, feature_id):
+        with self.__lock:
+            snapshot = self.__snapshot
+            self.__snapshot = snapshot._replace(scheduled_features=snapshot.scheduled_features | {feature_id})
+
+    # keeps only `feature_ids` scheduled, returns the features dropped
+    def retain_scheduled(self, feature_ids):
+        with self.__lock:
+            snapshot = self.__snapshot
+            removed = snapshot.scheduled_features.difference(feature_ids)
+            if removed:
+                self.__snapshot = snapshot._replace(scheduled_features=snapshot.scheduled_features - removed)
+        return removed
+
+    # admitted and handed to the executor
+    def enqueue(self):
+        with self.__lock:
+            snapshot = self.__snapshot
+            self.__snapshot = snapshot._replace(running_queue_size=snapshot.running_queue_size + 1)
+
+    def start(self, feature_id, start_time):
+        with self.__lock:
+            running_features = dict(self.__snapshot.running_features)
+            running_features[feature_id] = start_time
+            self.__snapshot = self.__snapshot._replace(running_features=MappingProxyType(running_features))
+
+    # features whose run didn't complete stay listed as running, so the VM report shows them
+    def finish(self, feature_id, completed):
+        with self.__lock:
+            snapshot = self.__snapshot
+            running_features = snapshot.running_features
+            if completed and feature_id in running_features:
+                running_features = dict(running_features)
+                del running_features[feature_id]
+                running_features = MappingProxyType(running_features)
+            self.__snapshot = StateSnapshot(snapshot.running_queue_size - 1, running_features,
+                                            snapshot.scheduled_features)
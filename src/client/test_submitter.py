@@ -2,17 +2,23 @@ from datetime import timedelta, datetime
 from pathlib import Path
 
 import json
-from expiringdict import ExpiringDict
+import logging
+import queue
+import threading
 
-from src.client.testing_client import submit_record as client_submit_record
+from src.client.outbox import Outbox, record_key
+from src.client.testing_client import submit_record as client_submit_record, \
+    submit_records as client_submit_records
 from src.model.testcase import TestJson
 
 _RETRY_PERIOD = timedelta(hours=2)
-_RECHECK_PERIOD = timedelta(hours=12)
+_FLUSH_DEADLINE = timedelta(seconds=30)
+_SENDER_IDLE_WAIT = 1  # 1 sec
+_MAX_BATCH_SIZE = 50
+_MAX_QUEUED_RECORDS = 10_000
 _DIR_NAME = "namp_submits"
-_SUBMITTED_SUFFIX = "_submitted"
+_OUTBOX_DIR_NAME = "outbox"
 _CONTENT_SUFFIX = "_content"
-_FAIL_CONTENT_SUFFIX = "_failed_content"
 _TIME_FORMAT = "%Y-%m-%d"
 _MAX_TRACE_BACK_DAYS = timedelta(days=3)
 
@@ -52,9 +58,32 @@ class _DateRotationWriter:
             self.__cur_writer.close()
 
 
+# the service judged the record itself invalid, sending it again can't change that
+def _is_rejected(status_code):
+    return status_code is not None and 400 <= status_code < 500
+
+
+def _submit_one_by_one(submit_function, records):
+    status_codes = []
+    for record in records:
+        try:
+            status_codes.append(submit_function(record).status_code)
+        except Exception as e:
+            logging.warning(f"Submitting record failed: {e}")
+            # the service is unreachable, don't wait on the rest of the batch
+            status_codes.extend([None] * (len(records) - len(status_codes)))
+            break
+    return status_codes
+
+
 class TestSubmitter:
+    """
+    `enqueue` stores the record in the outbox and returns; a sender thread posts queued records in
+    batches of up to `_MAX_BATCH_SIZE` through `submit_batch_function(records) -> status codes` and
+    reports each status to the record's callback.
+    """
 
-    def __init__(self, root_dir, submit_function=client_submit_record):
+    def __init__(self, root_dir, submit_function=client_submit_record, submit_batch_function=client_submit_records):
         if not Path(root_dir).exists():
             Path(root_dir).mkdir()
         self.__directory = Path(f"{root_dir}/{_DIR_NAME}").resolve()
@@ -62,80 +91,121 @@ class TestSubmitter:
             self.__directory.mkdir()
         if not self.__directory.is_dir():
             raise NotADirectoryError(self.__directory.resolve())
-        self.__queued_tests = []
-        self.__submitted_tests = ExpiringDict(
-            1_000_000, max_age_seconds=_MAX_TRACE_BACK_DAYS.total_seconds())
 
         self.__content_rw = _DateRotationWriter(self.__directory, _CONTENT_SUFFIX)
-        self.__submitted_rw = _DateRotationWriter(self.__directory, _SUBMITTED_SUFFIX)
-        self.__fail_content_rw = _DateRotationWriter(self.__directory, _FAIL_CONTENT_SUFFIX)
+        self.__outbox = Outbox(self.__directory / _OUTBOX_DIR_NAME, retention=_MAX_TRACE_BACK_DAYS.total_seconds())
 
         self.__next_retry = datetime.now()
-        self.__next_recheck = datetime.now()
 
         self.__submit_function = submit_function
+        self.__submit_batch_function = submit_batch_function if submit_batch_function is not None else \
+            lambda records: _submit_one_by_one(submit_function, records)
+
+        self.__write_lock = threading.Lock()
+        self.__queue = queue.Queue(maxsize=_MAX_QUEUED_RECORDS)
+        self.__closing = threading.Event()
+        self.__sender = threading.Thread(target=self.__send_loop, name="test_submitter", daemon=True)
+        self.__sender.start()
+
+    def enqueue(self, record_content, callback=None):
+        """ `callback(status_code)` is called from the sender thread, status_code is None if unreachable """
+        key = self.__get_key(record_content)
+        with self.__write_lock:
+            self.__content_rw.write(record_content)
+            if not self.__outbox.append(key, record_content):
+                logging.debug("Record was already delivered or queued")
+        try:
+            self.__queue.put_nowait((key, record_content, callback))
+        except queue.Full:
+            # still durable in the outbox, the retry pass will send it
+            logging.warning("Submitting queue is full, record left for the retry pass")
+            if callback is not None:
+                callback(None)
 
     def submit_record(self, record_content, resubmit=False):
+        key = self.__get_key(record_content)
         if not resubmit:
-            self.__content_rw.write(record_content)
+            with self.__write_lock:
+                self.__content_rw.write(record_content)
+                if not self.__outbox.append(key, record_content):
+                    logging.debug("Record was already delivered or queued")
         submit_result = self.__submit_function(record_content)
-        http_status = submit_result.status_code
-        if http_status != 200:
-            self.__queued_tests.append(record_content)
-            self.__fail_content_rw.write(record_content)
-        else:
-            test_str, h = self.__get_test_str_and_hash(record_content)
-            self.__submitted_tests[h] = True
-            self.__submitted_rw.write(test_str)
-
-        self.__try_clear_queue()
-
+        if submit_result.status_code == 200:
+            self.__outbox.mark_delivered(key)
+        elif _is_rejected(submit_result.status_code):
+            self.__drop_rejected(key, submit_result.status_code)
         return submit_result
 
     def get_queued_size(self):
-        return len(self.__queued_tests)
-
-    def close(self):
-        self.__content_rw.close()
-        self.__submitted_rw.close()
-        self.__fail_content_rw.close()
+        return self.__outbox.pending_count()
+
+    def close(self, timeout=_FLUSH_DEADLINE.total_seconds()):
+        """ sends what is queued until `timeout`, the rest stays in the outbox for the next run """
+        self.__closing.set()
+        self.__sender.join(timeout)
+        with self.__write_lock:
+            self.__content_rw.close()
+        if self.__sender.is_alive():
+            # the outbox is flushed on every write, leave it open for the sender still running
+            logging.warning(f"Submitting queue not flushed in {timeout} seconds, "
+                            f"{self.get_queued_size()} records left in the outbox")
+        else:
+            self.__outbox.close()
+
+    def __send_loop(self):
+        while True:
+            try:
+                batch = [self.__queue.get(timeout=_SENDER_IDLE_WAIT)]
+            except queue.Empty:
+                if self.__closing.is_set():
+                    return
+                self.__try_clear_queue()
+                continue
+            while len(batch) < _MAX_BATCH_SIZE:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.__send_batch(batch)
+
+    def __send_batch(self, batch):
+        try:
+            status_codes = list(self.__submit_batch_function([record for _, record, _ in batch]))
+        except Exception as e:
+            logging.warning(f"Submitting {len(batch)} records failed: {e}")
+            status_codes = []
+        status_codes.extend([None] * (len(batch) - len(status_codes)))
+        for (key, _, callback), status_code in zip(batch, status_codes):
+            if status_code == 200:
+                self.__outbox.mark_delivered(key)
+            elif _is_rejected(status_code):
+                self.__drop_rejected(key, status_code)
+            if callback is not None:
+                try:
+                    callback(status_code)
+                except Exception as e:
+                    logging.error(f"Submit callback failed: {e}")
+
+    # taken out of the outbox like a delivered record, the content stays in the daily content file
+    def __drop_rejected(self, key, status_code):
+        logging.error(f"Record {key.hex()} rejected by the service ({status_code}), not sending it again")
+        self.__outbox.mark_delivered(key)
 
     def __try_clear_queue(self):
-        if self.__next_retry <= datetime.now():
-            self.__next_retry = datetime.now() + _RETRY_PERIOD
-            to_retry = self.__queued_tests.copy()
-            self.__queued_tests.clear()
-            for record in to_retry:
-                self.submit_record(record, resubmit=True)
-
-        if self.__next_recheck <= datetime.now():
-            self.__next_recheck = datetime.now() + _RECHECK_PERIOD
-            cur_time = datetime.now()
-            start_recheck_time = datetime.now() - _MAX_TRACE_BACK_DAYS
-            while cur_time > start_recheck_time:
-                cur_time -= _RECHECK_PERIOD
-                submitted_filepath, submitted_filename = self.__submitted_rw.resolve_file(cur_time)
-                if submitted_filepath.is_file():
-                    with open(submitted_filepath, 'r') as f:
-                        for line in f:
-                            self.__submitted_tests[hash(line)] = True
-
-                content_filepath, content_filename = self.__fail_content_rw.resolve_file(cur_time)
-                if content_filepath.is_file():
-                    with open(content_filepath, 'r') as f:
-                        for line in f:
-                            if not line.strip():
-                                continue
-                            test_str, h = self.__get_test_str_and_hash(line)
-                            if h not in self.__submitted_tests:
-                                self.submit_record(line, resubmit=True)
+        if self.__next_retry > datetime.now():
+            return
+        self.__next_retry = datetime.now() + _RETRY_PERIOD
+        keys = self.__outbox.pending_keys()
+        for i in range(0, len(keys), _MAX_BATCH_SIZE):
+            if self.__closing.is_set() or not self.__queue.empty():
+                # fresh results go first, the rest waits for the next pass
+                self.__next_retry = datetime.now()
+                return
+            batch = [(key, self.__outbox.read(key), None) for key in keys[i:i + _MAX_BATCH_SIZE]]
+            batch = [item for item in batch if item[1] is not None]
+            self.__send_batch(batch)
 
     @staticmethod
-    def __get_test_str_and_hash(record_content):
+    def __get_key(record_content):
         record = json.loads(record_content)
-        d = {
-            TestJson.EVENT_TIME: record[TestJson.EVENT_TIME],
-            TestJson.FEATURE_ID: record[TestJson.FEATURE_ID]
-        }
-        test_str = json.dumps(d).strip()
-        return test_str, hash(test_str)
+        return record_key(record[TestJson.FEATURE_ID], record[TestJson.EVENT_TIME])
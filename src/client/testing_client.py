@@ -1,20 +1,23 @@
 from datetime import datetime, timedelta
-import requests
 import logging as logger
 from abc import ABC, abstractmethod
 from urllib.parse import quote
 from expiringdict import ExpiringDict
+from src.client.http_session import ServiceSession
+from src.model.blob import BlobJson
 from src.model.testcase import TestJson
 
 CRED_FEATURE_PARAM = "feature-id"
 HARD_TIMEOUT_PARAM = "feature-id"
 TESTS_REGION_PARAM = "region"
+SNAPSHOT_SINCE_PARAM = "since"
 CRED_EXPIRE_TIME = 2 * 24 * 60 * 60
 HARD_TIMEOUT_EXPIRE = 24 * 60 * 60
 
 service_url = "http://127.0.0.1:8080/"
 get_cred_url = service_url + "/cred"
 record_url = service_url + "/record"
+records_url = service_url + "/records"
 tests_url = service_url + "/test-schedule"
 maintenance_url = service_url + "/maintenance"
 auto_maintenance_url = service_url + "/auto-maintenance"
@@ -24,6 +27,7 @@ sub_func_pwc_url = service_url + "/sub-func-pwc"
 warning_exclusion_url = service_url + "/warning-exclusion"
 namp_bucket_schedule_url = service_url + "/namp-bucket-schedule"
 namp_bucket_schedule_remove_url = service_url + "/namp-bucket-remove"
+blobs_url = service_url + "/blobs"
 
 headers = {
 
@@ -31,15 +35,79 @@ headers = {
 
 cred_cache = ExpiringDict(10000, max_age_seconds=CRED_EXPIRE_TIME)
 hard_timeout_cache = ExpiringDict(10000, max_age_seconds=HARD_TIMEOUT_EXPIRE)
+# refresh and vm report calls run beside the test workers
+EXTRA_CONNECTIONS = 2
+
+service_session = ServiceSession()
+
+
+def configure_session(concurrency):
+    service_session.resize(concurrency + EXTRA_CONNECTIONS)
 
 
 class TestScheduleJson:
     FEATURE_ID = TestJson.FEATURE_ID
     ENGINE_TYPE = "engine_type"
     INTERVAL = "test_interval"
+    PRIORITY = "priority"
     REGION = TestJson.REGION
 
 
+class SnapshotJson:
+    FEATURE_ID = TestJson.FEATURE_ID
+    VERSION = "version"
+    DELTA = "delta"
+    ITEMS = "items"
+    REMOVED = "removed"
+
+
+class RecordsJson:
+    STATUSES = "statuses"
+    ERRORS = "errors"
+
+
+class _SnapshotState:
+    """ last known /tests or /maintenance snapshot, refreshed with If-None-Match and deltas since its version """
+
+    def __init__(self):
+        # 0 is older than any service version, the first answer is a full snapshot
+        self.version = 0
+        self.etag = None
+        self.items = {}
+
+    def request(self, url, params=None):
+        params = dict(params or {})
+        request_headers = dict(headers)
+        params[SNAPSHOT_SINCE_PARAM] = self.version
+        if self.etag is not None:
+            request_headers["If-None-Match"] = self.etag
+        response = service_session.get(url, params, headers=request_headers)
+        if response.status_code == 304:
+            return list(self.items.values())
+        response.raise_for_status()
+        self.__apply(response.json())
+        self.etag = response.headers.get("ETag")
+        return list(self.items.values())
+
+    def __apply(self, content):
+        if isinstance(content, list):
+            # service without snapshot support
+            self.items = {item.get(SnapshotJson.FEATURE_ID): item for item in content}
+            return
+        items = {item.get(SnapshotJson.FEATURE_ID): item for item in content.get(SnapshotJson.ITEMS, [])}
+        if content.get(SnapshotJson.DELTA):
+            for feature_id in content.get(SnapshotJson.REMOVED, []):
+                self.items.pop(feature_id, None)
+            self.items.update(items)
+        else:
+            self.items = items
+        self.version = content.get(SnapshotJson.VERSION)
+
+
+tests_snapshots = {}
+maintenance_snapshot = _SnapshotState()
+
+
 class Credential(ABC):
     @staticmethod
     class Type:
@@ -88,11 +156,55 @@ class LazyCredential(Credential):
 
 
 def submit_record(record_content):
-    return requests.post(record_url, json=record_content, headers=headers)
+    return service_session.post(record_url, record_content, headers=headers)
+
+
+def submit_records(record_contents):
+    """ posts the records as one batch, returns the status code of each record in order """
+    response = service_session.post_lines(records_url, record_contents, headers=headers)
+    if response.status_code == 404:
+        # service without the batch endpoint
+        return [submit_record(record_content).status_code for record_content in record_contents]
+    if response.status_code != 200:
+        # the batch as a whole wasn't taken, no record was judged: unknown, so they are sent again
+        logger.warning(f"Batch of {len(record_contents)} records answered {response.status_code}")
+        return [None] * len(record_contents)
+    content = response.json()
+    for index, error in content.get(RecordsJson.ERRORS, {}).items():
+        logger.error(f"Record {index} of batch rejected: {error}")
+    return content.get(RecordsJson.STATUSES, [])
+
+
+def request_missing_blobs(digests):
+    """ None when the service has no blob endpoints """
+    response = service_session.post(f"{blobs_url}/missing", {BlobJson.DIGESTS: digests}, headers=headers)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return response.json().get(BlobJson.MISSING, [])
+
+
+def upload_blob_chunk(digest, chunk, offset, total):
+    """ returns how many bytes of the blob the service holds after this chunk """
+    chunk_headers = dict(headers)
+    chunk_headers["Content-Type"] = "application/octet-stream"
+    chunk_headers["Content-Range"] = f"bytes {offset}-{offset + len(chunk) - 1}/{total}"
+    response = service_session.put(f"{blobs_url}/{digest}", chunk, headers=chunk_headers)
+    # 409: the service holds a different length, resume from there
+    if response.status_code not in [200, 409]:
+        response.raise_for_status()
+    return response.json().get(BlobJson.RECEIVED, 0)
+
+
+def link_blob(digest, kind, action_ids):
+    response = service_session.post(f"{blobs_url}/{digest}/links",
+                                    {BlobJson.KIND: kind, BlobJson.ACTION_IDS: action_ids}, headers=headers)
+    response.raise_for_status()
+    return response
 
 
 def submit_vm_report(report_content):
-    return requests.post(vm_report_url, json=report_content, headers=headers)
+    return service_session.post(vm_report_url, report_content, headers=headers)
 
 
 def submit_password_change_request(feature_id, username, status):
@@ -102,7 +214,7 @@ def submit_password_change_request(feature_id, username, status):
         "status": status,
         "event_time": datetime.now().astimezone().isoformat()
     }
-    return requests.post(pw_change_url, json=record_content, headers=headers)
+    return service_session.post(pw_change_url, record_content, headers=headers)
 
 
 def submit_sub_func_pwc(username_type, username, status, expiration_date):
@@ -113,7 +225,7 @@ def submit_sub_func_pwc(username_type, username, status, expiration_date):
         "expiration_date": expiration_date,
         "event_time": datetime.now().astimezone().isoformat()
     }
-    return requests.post(sub_func_pwc_url, json=record_content, headers=headers)
+    return service_session.post(sub_func_pwc_url, record_content, headers=headers)
 
 
 def submit_warning_exclusion(feature_id, action_group, warning_status, exception):
@@ -124,7 +236,7 @@ def submit_warning_exclusion(feature_id, action_group, warning_status, exception
         "exception": exception,
         "event_time": datetime.now().astimezone().isoformat()
     }
-    return requests.post(warning_exclusion_url, json=record_content, headers=headers)
+    return service_session.post(warning_exclusion_url, record_content, headers=headers)
 
 
 def submit_auto_maint(feature_id, maint_start_time=None, maint_stop_time=None, hours_of_maint=None):
@@ -154,7 +266,7 @@ def submit_auto_maint(feature_id, maint_start_time=None, maint_stop_time=None, h
         "manual": "1",
         "open_ticket": ticket_num
     }
-    return requests.post(auto_maintenance_url, json=record_content, headers=headers)
+    return service_session.post(auto_maintenance_url, record_content, headers=headers)
 
 
 # def submit_namp_bucket_test(feature_id, engine_type, test_interval, region):
@@ -164,14 +276,14 @@ def submit_auto_maint(feature_id, maint_start_time=None, maint_stop_time=None, h
 #         "test_interval": test_interval,
 #         "region": region
 #     }
-#     return requests.post(namp_bucket_schedule_url, json=record_content, headers=headers)
+#     return service_session.post(namp_bucket_schedule_url, record_content, headers=headers)
 
 
 def remove_namp_bucket_test(feature_id):
     record_content = {
         "feature_id": feature_id
     }
-    return requests.post(namp_bucket_schedule_remove_url, json=record_content, headers=headers)
+    return service_session.post(namp_bucket_schedule_remove_url, record_content, headers=headers)
 
 
 def request_cred(feature_id, cred_type=Credential.Type.LAZY):
@@ -192,24 +304,21 @@ def _request_simple_cred(feature_id):
 
 
 def request_tests(region):
-    response = requests.get(tests_url, {TESTS_REGION_PARAM: region}, headers=headers)
-    return response.json()
+    snapshot = tests_snapshots.setdefault(region, _SnapshotState())
+    return snapshot.request(tests_url, {TESTS_REGION_PARAM: region})
 
 
 def request_maintenance_features(_time=None):
     # ignore time
-    response = requests.get(maintenance_url, headers=headers)
-    ret = set()
     try:
-        for f in response.json():
-            ret.add(f.get(TestJson.FEATURE_ID))
-    except:
-        pass
-    return ret
+        maintenance_snapshot.request(maintenance_url)
+    except ValueError as e:
+        logger.warning(f"Unable to parse maintenance features, keeping the last known ones: {e}")
+    return set(maintenance_snapshot.items)
 
 
 def request_cred_impl(feature_id):
-    response = requests.get(get_cred_url, {CRED_FEATURE_PARAM: feature_id}, headers=headers)
+    response = service_session.get(get_cred_url, {CRED_FEATURE_PARAM: feature_id}, headers=headers)
     cred = response.json()
     if cred["username"] is None and cred["password"] is None:
         logger.warning("Importing null username and password for feature: '%s'" % feature_id)
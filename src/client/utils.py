@@ -1,9 +1,11 @@
 import socket
+import threading
 import psutil
 from datetime import datetime
 from collections import deque
 
-from src.client.testing_client import TESTS_REGION_PARAM
+from src.client.scheduler_state import AtomicCounter
+from src.client.testing_client import TESTS_REGION_PARAM, service_session
 from src.model.testcase import TestJson
 
 VM_REPORT_SIZE = 100
@@ -27,9 +29,15 @@ class VmStatistics:
     LAST_TEST_TIME = "last_test_time"
     NUM_SKIPPED_TESTS = "num_skipped_tests"
     RUNNING_QUEUE_SIZE = "running_queue_size"
+    ADMISSION_QUEUE_DEPTH = "admission_queue_depth"
+    ENGINE_SLOTS = "engine_slots"
+    NUM_DEFERRED_TESTS = "num_deferred_tests"
     EXPECTED_TESTS_IN_PERIOD = "expected_run_test"
     RUNNING_FEATURES = "running_features"
     RUNNING_SECONDS = "running_seconds"
+    HTTP_CLIENT = "http_client"
+    PROBE_ENGINE = "probe_engine"
+    TAB_OCCUPANCY = "tab_occupancy"
 
     class __TYPE:
         skip = "skip"
@@ -38,7 +46,11 @@ class VmStatistics:
     def __init__(self):
         self.host_name = socket.gethostname()
         self.ip_addr = socket.gethostbyname(self.host_name)
-        self.reporting_items = deque(maxlen=VM_REPORT_SIZE)
+        # appended by the executor workers and the submitter's callbacks, read through reporting_snapshot()
+        self.__reporting_items = deque(maxlen=VM_REPORT_SIZE)
+        self.__reporting_lock = threading.Lock()
+        # deferrals since the last report, kept out of the reporting items so they don't evict real runs
+        self.num_deferred = AtomicCounter()
 
     def skip_test(self, submitting_time):
         item = (
@@ -47,16 +59,28 @@ class VmStatistics:
             None,
             submitting_time
         )
-        self.reporting_items.append(item)
+        self.__append(item)
 
-    def record(self, test_case, post_result):
+    def defer_test(self):
+        self.num_deferred.add()
+
+    # called by the test submitter once the post result is known
+    def record(self, test_case, post_status_code):
         item = (
             VmStatistics.__TYPE.executed,
             test_case.is_success(),
-            post_result.status_code == 200,
+            post_status_code == 200,
             test_case.action_time
         )
-        self.reporting_items.append(item)
+        self.__append(item)
+
+    def __append(self, item):
+        with self.__reporting_lock:
+            self.__reporting_items.append(item)
+
+    def reporting_snapshot(self):
+        with self.__reporting_lock:
+            return tuple(self.__reporting_items)
 
     def __to_megabytes(self, n_bytes):
         return int(n_bytes / 1024 / 1024)
@@ -68,8 +92,11 @@ class VmStatistics:
         first_time = None
         last_time = None
         memory_info = psutil.virtual_memory()
+        count_deferred = self.num_deferred.reset()
+        reporting_items = self.reporting_snapshot()
+        state = scheduler.state.snapshot()
 
-        for _type, test_success, post_success, test_time in self.reporting_items:
+        for _type, test_success, post_success, test_time in reporting_items:
             if _type == VmStatistics.__TYPE.executed:
                 count_test_success += 1 if test_success else 0
                 count_post_success += 1 if post_success else 0
@@ -81,14 +108,14 @@ class VmStatistics:
 
         if first_time is not None and last_time is not None:
             sum_expected_tpm = 0
-            for holder in scheduler.holder_pq.queue:
+            for holder in scheduler.holder_queue.snapshot():
                 sum_expected_tpm += 1 / (holder.minute_interval + VmStatistics.MAX_EXPECTED_TEST_RUNTIME)
             expected_tests_run_in_period = sum_expected_tpm * ((last_time - first_time).total_seconds() / 60)
         else:
             expected_tests_run_in_period = 0
 
         running_features = []
-        for feature_id, start_time in scheduler.running_features.items():
+        for feature_id, start_time in state.running_features.items():
             running_features.append({
                 TestJson.FEATURE_ID: feature_id,
                 VmStatistics.RUNNING_SECONDS: (datetime.now() - start_time).total_seconds()
@@ -99,7 +126,7 @@ class VmStatistics:
             VmStatistics.EVENT_TIME: datetime.now().astimezone().isoformat(),
             VmStatistics.HOST_NAME: self.host_name,
             VmStatistics.IP_ADDR: self.ip_addr,
-            VmStatistics.NUM_TEST: len(self.reporting_items),
+            VmStatistics.NUM_TEST: len(reporting_items),
             VmStatistics.TEST_SUCCESS: count_test_success,
             VmStatistics.POST_SUCCESS: count_post_success,
             VmStatistics.CPU_USAGE: psutil.cpu_percent(2),
@@ -108,7 +135,13 @@ class VmStatistics:
             VmStatistics.FIRST_TEST_TIME: None if first_time is None else first_time.astimezone().isoformat(),
             VmStatistics.LAST_TEST_TIME: None if last_time is None else last_time.astimezone().isoformat(),
             VmStatistics.NUM_SKIPPED_TESTS: count_skip,
-            VmStatistics.RUNNING_QUEUE_SIZE: scheduler.running_queue_size,
+            VmStatistics.NUM_DEFERRED_TESTS: count_deferred,
+            VmStatistics.RUNNING_QUEUE_SIZE: state.running_queue_size,
+            VmStatistics.ADMISSION_QUEUE_DEPTH: scheduler.admission.queue_depth(),
+            VmStatistics.ENGINE_SLOTS: scheduler.admission.snapshot(),
             VmStatistics.EXPECTED_TESTS_IN_PERIOD: expected_tests_run_in_period,
-            VmStatistics.RUNNING_FEATURES: running_features
+            VmStatistics.RUNNING_FEATURES: running_features,
+            VmStatistics.HTTP_CLIENT: service_session.stats(reset=True),
+            VmStatistics.PROBE_ENGINE: scheduler.probe_engine.stats(reset=True),
+            VmStatistics.TAB_OCCUPANCY: scheduler.tab_pool.stats()
         }
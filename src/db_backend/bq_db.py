@@ -1,18 +1,24 @@
 import json
 import logging
+import tempfile
 import time
+from pathlib import Path
 
 from google.api_core.exceptions import NotFound
 from google.api_core import exceptions
 from dateutil import parser as t_parser
 
-from src.db_backend.db_query import GET_CRED, GET_TESTS, GET_MAINTENANCE
+from src.db_backend.cred_cache import CredentialCache
+from src.db_backend.db_query import GET_CRED, GET_TESTS, GET_MAINTENANCE, GET_ALL_CREDS
 from src.db_backend.schemas import *
+from src.db_backend.write_buffer import WriteBehindBuffer
 
 PROJECT_ID = "itcnp-cloud-synthetics-pstpf"
 
 DATASET_ID = "cloud_synthetics_gi51h"
 
+SPILL_DIR_NAME = "bq_spill"
+
 
 class NAMPTables:
     TESTS = "tests"
@@ -42,6 +48,7 @@ def create_table(tbl_name, schema):
     try:
         client.get_table(table_id)  # Make an API request.
         print("Table {} already exists.".format(table_id))
+        migrate_table(client, tbl_name, schema)
     except NotFound:
         print("Table {} not found, going to create one".format(tbl_name))
         table = bigquery.Table(table_id, schema=schema)
@@ -54,6 +61,20 @@ def create_table(tbl_name, schema):
         print("Table {} already created.".format(table_id))
 
 
+# additive only: columns of `schema` missing from the live table are appended as NULLABLE,
+# existing columns are never changed or dropped. Returns the names of the columns added
+def migrate_table(client, tbl_name, schema):
+    table = client.get_table(generate_table_id(tbl_name))
+    existing = {field.name for field in table.schema}
+    added = [bigquery.SchemaField(field.name, field.field_type, mode="NULLABLE")
+             for field in schema if field.name not in existing]
+    if added:
+        table.schema = list(table.schema) + added
+        client.update_table(table, ["schema"])
+        logging.info(f"Added columns {[field.name for field in added]} to {tbl_name}")
+    return [field.name for field in added]
+
+
 def _initialization():
     try:
         create_table(NAMPTables.TESTS, SCHEMAS.TESTS_SCHEMA)
@@ -70,11 +91,49 @@ def _initialization():
         exit(1)
 
 
+# tables whose schema grew after deployment, brought up to date when the service starts
+MIGRATED_TABLES = {
+    NAMPTables.TEST_SCHEDULE: SCHEMAS.TEST_SCHEDULE_SCHEMA,
+    NAMPTables.TESTS: SCHEMAS.TESTS_SCHEMA,
+    NAMPTables.TRANSACTIONS: SCHEMAS.TRANSACTIONS_SCHEMA
+}
+
+
 class AppMonitorDB:
 
-    def __init__(self):
-        self.client = bigquery.Client()
+    def __init__(self, data_dir=None, client=None):
+        self.client = bigquery.Client() if client is None else client
         # _initialization()
+        # columns the live tables still lack, left out of the inserted rows
+        self.__missing_columns = {}
+        self.__migrate()
+        spill_dir = Path(tempfile.gettempdir() if data_dir is None else data_dir) / SPILL_DIR_NAME
+        # test results are written behind, other tables are low volume and stay synchronous
+        self.write_buffer = WriteBehindBuffer(self.__insert_rows, spill_dir)
+        self.cred_cache = CredentialCache(self.__query_all_creds, self.__query_cred)
+
+    def __migrate(self):
+        for tbl_name, schema in MIGRATED_TABLES.items():
+            try:
+                migrate_table(self.client, tbl_name, schema)
+            except Exception as e:
+                logging.error(f"Unable to migrate {tbl_name}: {e}")
+                # rows are still inserted, only without the columns the table lacks
+                try:
+                    table = self.client.get_table(generate_table_id(tbl_name))
+                    existing = {field.name for field in table.schema}
+                    self.__missing_columns[tbl_name] = {field.name for field in schema} - existing
+                except Exception as e:
+                    logging.error(f"Unable to get the schema of {tbl_name}: {e}")
+
+    def __insert_rows(self, table_id, rows, row_ids):
+        missing = self.__missing_columns.get(table_id)
+        if missing:
+            rows = [{k: v for k, v in row.items() if k not in missing} for row in rows]
+        return self.client.insert_rows_json(generate_table_id(table_id), rows, row_ids=row_ids)
+
+    def close(self):
+        self.write_buffer.close()
 
     @staticmethod
     def __replace_by_timestamp(obj):
@@ -101,44 +160,71 @@ class AppMonitorDB:
 
     # Below: Inserting data into BQ
 
+    @staticmethod
+    def __to_rows(r):
+        actions = r.get(TestJson.ACTIONS) or []
+        test_id = r.get(TestJson.TEST_ID)
+
+        # tests table row
+        test_record = {}
+        for k in [TestJson.APP_ID, TestJson.FEATURE_ID, TestJson.TEST_ENGINE, TestJson.TEST_ID,
+                  TestJson.EVENT_TIME, TestJson.DURATION, TestJson.RESULT, TestJson.METADATA, TestJson.REGION,
+                  TestJson.THINK_TIME]:
+            test_record[k] = r.get(k)
+
+        # transactions table rows
+        records_to_insert = []
+        for a in actions:
+            record = {
+                TestJson.TEST_ID: test_id
+            }
+
+            for k in [ActionJson.ID, ActionJson.ACTION_GROUP, ActionJson.TYPE, ActionJson.VALUE,
+                      ActionJson.EVENT_TIME, ActionJson.DURATION, ActionJson.RESULT, ActionJson.METADATA,
+                      ActionJson.EXCEPTION]:
+                record[k] = a.get(k)
+            metrics = a.get(ActionJson.METRICS)
+            if metrics:
+                for k in MetricsJson.COLUMNS:
+                    record[k] = metrics.get(k)
+                record[MetricsJson.RESOURCES] = json.dumps({
+                    MetricsJson.URL: metrics.get(MetricsJson.URL),
+                    MetricsJson.NAVIGATION_TYPE: metrics.get(MetricsJson.NAVIGATION_TYPE),
+                    MetricsJson.RESOURCES_BY_TYPE: metrics.get(MetricsJson.RESOURCES_BY_TYPE),
+                    MetricsJson.LARGEST_RESOURCES: metrics.get(MetricsJson.LARGEST_RESOURCES)
+                })
+            records_to_insert.append(record)
+        return test_record, records_to_insert
+
     def insert_test_result(self, test_result):
         try:
-            r = json.loads(test_result)
-            actions = r.get(TestJson.ACTIONS)
-            test_id = r.get(TestJson.TEST_ID)
+            r = test_result if isinstance(test_result, dict) else json.loads(test_result)
         except Exception as e:
             logging.error("Error content: %s" % test_result, e.args)
             return
 
         try:
-            # tests table insert
-            test_record = {}
-            for k in [TestJson.APP_ID, TestJson.FEATURE_ID, TestJson.TEST_ENGINE, TestJson.TEST_ID,
-                      TestJson.EVENT_TIME, TestJson.DURATION, TestJson.RESULT, TestJson.METADATA, TestJson.REGION]:
-                test_record[k] = r.get(k)
-            # print(test_record)
-            test_to_insert = [
-                test_record
-            ]
-
-            self.__insert_data(NAMPTables.TESTS, test_to_insert)
-
-            # transactions table insert
-            records_to_insert = []
-            for a in actions:
-                record = {
-                    TestJson.TEST_ID: test_id
-                }
-
-                for k in [ActionJson.ID, ActionJson.ACTION_GROUP, ActionJson.TYPE, ActionJson.VALUE,
-                          ActionJson.EVENT_TIME, ActionJson.DURATION, ActionJson.RESULT, ActionJson.METADATA,
-                          ActionJson.EXCEPTION]:
-                    record[k] = a.get(k)
-                records_to_insert.append(record)
-            self.__insert_data(NAMPTables.TRANSACTIONS, records_to_insert)
+            test_record, records_to_insert = self.__to_rows(r)
+            self.write_buffer.add(NAMPTables.TESTS, [test_record])
+            self.write_buffer.add(NAMPTables.TRANSACTIONS, records_to_insert)
         except Exception as e:
             logging.error(str(e))
 
+    def insert_test_results(self, test_results):
+        """ batch of already parsed records, rows of all records are buffered together """
+        tests_to_insert = []
+        transactions_to_insert = []
+        for r in test_results:
+            try:
+                test_record, records_to_insert = self.__to_rows(r)
+            except Exception as e:
+                logging.error(f"Unable to insert test {r.get(TestJson.TEST_ID)}: {e}")
+                continue
+            tests_to_insert.append(test_record)
+            transactions_to_insert.extend(records_to_insert)
+        self.write_buffer.add(NAMPTables.TESTS, tests_to_insert)
+        self.write_buffer.add(NAMPTables.TRANSACTIONS, transactions_to_insert)
+
     def insert_vm_report(self, report):
         try:
             r = json.loads(report)
@@ -224,31 +310,39 @@ class AppMonitorDB:
 
     # Below: Fetching datas from BQ
 
-    def get_cred(self, feature_id):
-        username = ""
-        password = ""
-        existence = False
+    def __query_all_creds(self):
+        table_id = f'''{DATASET_ID}.credentials'''
+        creds = {}
+        for row in self.client.query(GET_ALL_CREDS.format(table_id)).result():
+            creds.setdefault(row.get("feature_id"), []).append((row.get("username"), row.get("password")))
+        return creds
+
+    def __query_cred(self, feature_id):
         table_id = f'''{DATASET_ID}.credentials'''
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ScalarQueryParameter("feature_id", "STRING", feature_id),
             ])
+        rows = self.client.query(GET_CRED.format(table_id), job_config=job_config).result()
+        return [(row.get("username"), row.get("password")) for row in rows]
+
+    def get_cred(self, feature_id):
         try:
-            query_job = self.client.query(GET_CRED.format(table_id), job_config=job_config)
-            if query_job.result().total_rows == 1:
-                existence = True
-                for row in query_job:
-                    username = row.get("username")
-                    password = row.get("password")
-                return username, password, existence
-            elif query_job.result().total_rows == 0:
-                logging.error("No credentials for feature %s" % feature_id)
-                return None, None, existence
-            else:
-                logging.error("More than one credentials for feature %s" % feature_id)
-        except exceptions as e:
+            creds = self.cred_cache.get(feature_id)
+        except Exception as e:
             logging.error("Failed getting credential for: '%s'" % feature_id, e)
-            return None, None, existence
+            return None, None, False
+        if len(creds) == 1:
+            username, password = creds[0]
+            return username, password, True
+        elif len(creds) == 0:
+            logging.error("No credentials for feature %s" % feature_id)
+        else:
+            logging.error("More than one credentials for feature %s" % feature_id)
+        return None, None, False
+
+    def invalidate_cred(self, feature_id):
+        self.cred_cache.invalidate(feature_id)
 
     def get_test_schedule(self, region):
         table_id = f'''{DATASET_ID}.test_schedule'''
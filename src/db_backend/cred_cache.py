@@ -0,0 +1,96 @@
+import logging
+import threading
+import time
+
+DEFAULT_TTL = 15 * 60  # 15 mins
+REFRESH_AHEAD_RATIO = 0.8
+RETRY_LOAD_AFTER = 60  # 1 min
+
+
+class CredentialCache:
+    """
+    Read-through cache over the whole credentials table. `load_all()` returns a dict of
+    feature id -> list of (username, password) and is re-run in the background before the
+    snapshot expires; `load_one(feature_id)` serves features invalidated since the last load.
+    """
+
+    def __init__(self, load_all, load_one, ttl=DEFAULT_TTL, refresh_ahead_ratio=REFRESH_AHEAD_RATIO):
+        self.__load_all = load_all
+        self.__load_one = load_one
+        self.__ttl = ttl
+        self.__refresh_after = ttl * refresh_ahead_ratio
+        self.__creds = None
+        self.__invalidated = set()
+        self.__loaded_time = 0
+        self.__failed_time = None
+        self.__lock = threading.Lock()
+        self.__load_lock = threading.Lock()
+        self.__refreshing = False
+
+    def get(self, feature_id):
+        age = time.monotonic() - self.__loaded_time
+        if self.__creds is None or age >= self.__ttl:
+            self.__reload()
+        elif age >= self.__refresh_after:
+            self.__refresh_in_background()
+
+        with self.__lock:
+            creds = self.__creds
+            invalidated = feature_id in self.__invalidated
+        if creds is None or invalidated:
+            return self.__read_through(feature_id)
+        return creds.get(feature_id, [])
+
+    def invalidate(self, feature_id):
+        with self.__lock:
+            self.__invalidated.add(feature_id)
+
+    def __read_through(self, feature_id):
+        rows = self.__load_one(feature_id)
+        with self.__lock:
+            if self.__creds is not None:
+                self.__creds[feature_id] = rows
+                self.__invalidated.discard(feature_id)
+        return rows
+
+    def __reload(self):
+        with self.__load_lock:
+            # another request may have finished the load while we waited
+            if self.__creds is not None and time.monotonic() - self.__loaded_time < self.__refresh_after:
+                return
+            # don't let every request of a storm retry a failing full load, they read through meanwhile
+            if self.__failed_time is not None and time.monotonic() - self.__failed_time < RETRY_LOAD_AFTER:
+                return
+            invalidated_before = self.__snapshot_invalidated()
+            try:
+                creds = self.__load_all()
+            except Exception as e:
+                logging.error(f"Failed loading credentials table: {e}")
+                self.__failed_time = time.monotonic()
+                return
+            self.__failed_time = None
+            with self.__lock:
+                # features invalidated while loading may have been read before the change
+                self.__invalidated -= invalidated_before
+                self.__creds = creds
+                self.__loaded_time = time.monotonic()
+            logging.info(f"Loaded credentials of {len(creds)} features")
+
+    def __snapshot_invalidated(self):
+        with self.__lock:
+            return set(self.__invalidated)
+
+    def __refresh_in_background(self):
+        with self.__lock:
+            if self.__refreshing:
+                return
+            self.__refreshing = True
+
+        def refresh():
+            try:
+                self.__reload()
+            finally:
+                with self.__lock:
+                    self.__refreshing = False
+
+        threading.Thread(target=refresh, name="cred_refresh", daemon=True).start()
@@ -4,6 +4,11 @@ GET_CRED = """
     WHERE feature_id = @feature_id;
 """
 
+GET_ALL_CREDS = """
+    SELECT feature_id, username, password
+    FROM {};
+"""
+
 GET_TESTS = """
     SELECT *
     FROM {}
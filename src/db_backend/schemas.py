@@ -1,7 +1,7 @@
 from google.cloud import bigquery
 
 from src.client.utils import VmStatistics, TestJson
-from src.model.log.action_log import ActionJson
+from src.model.log.action_log import ActionJson, MetricsJson
 
 
 class SCHEMAS:
@@ -15,6 +15,7 @@ class SCHEMAS:
         bigquery.SchemaField(TestJson.RESULT, "STRING", mode="REQUIRED"),
         bigquery.SchemaField(TestJson.METADATA, "STRING", mode="NULLABLE"),
         bigquery.SchemaField(TestJson.REGION, "STRING", mode="NULLABLE"),
+        bigquery.SchemaField(TestJson.THINK_TIME, "FLOAT64", mode="NULLABLE"),
     ]
 
     TRANSACTIONS_SCHEMA = [
@@ -28,6 +29,19 @@ class SCHEMAS:
         bigquery.SchemaField(ActionJson.RESULT, "STRING", mode="REQUIRED"),
         bigquery.SchemaField(ActionJson.METADATA, "STRING", mode="NULLABLE"),
         bigquery.SchemaField(ActionJson.EXCEPTION, "STRING", mode="NULLABLE"),
+        # page timing of get_url actions
+        bigquery.SchemaField(MetricsJson.REDIRECT_MS, "FLOAT64", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.DNS_MS, "FLOAT64", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.CONNECT_MS, "FLOAT64", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.TLS_MS, "FLOAT64", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.TTFB_MS, "FLOAT64", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.RESPONSE_MS, "FLOAT64", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.DOM_CONTENT_LOADED_MS, "FLOAT64", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.LOAD_MS, "FLOAT64", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.TRANSFER_SIZE, "INTEGER", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.RESOURCE_COUNT, "INTEGER", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.RESOURCE_TRANSFER_SIZE, "INTEGER", mode="NULLABLE"),
+        bigquery.SchemaField(MetricsJson.RESOURCES, "STRING", mode="NULLABLE"),
     ]
 
     TEST_SCHEDULE_SCHEMA = [
@@ -35,6 +49,8 @@ class SCHEMAS:
         bigquery.SchemaField("engine_type", "STRING", mode="REQUIRED"),
         bigquery.SchemaField("test_interval", "INTEGER", mode="REQUIRED"),
         bigquery.SchemaField(TestJson.REGION, "STRING", mode="REQUIRED"),
+        # high, normal or low, see src.client.admission.TestPriority; missing means normal
+        bigquery.SchemaField("priority", "STRING", mode="NULLABLE"),
     ]
 
     CREDENTIALS_SCHEMA = [
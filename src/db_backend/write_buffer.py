@@ -0,0 +1,210 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+DEFAULT_MAX_BATCH_ROWS = 500
+DEFAULT_FLUSH_INTERVAL = 5  # 5 secs
+DEFAULT_MAX_BUFFERED_ROWS = 50_000
+DEFAULT_REPLAY_INTERVAL = 10 * 60  # 10 mins
+# rows rejected this many times are moved to the dead letter directory instead of being spilled again
+MAX_INSERT_ATTEMPTS = 5
+SPILL_SUFFIX = ".ndjson"
+# spills are written under this suffix first, so replay never picks up a file still being written
+TMP_SUFFIX = ".tmp"
+DEAD_LETTER_DIR_NAME = "dead_letter"
+# bigquery's reason for good rows not inserted because another row of the request was invalid
+STOPPED_REASON = "stopped"
+
+
+class WriteBehindBuffer:
+    """
+    Accepts rows immediately and flushes them per table from a background thread once a table holds
+    `max_batch_rows` or its oldest row is `flush_interval` seconds old. Memory is bounded by
+    `max_buffered_rows`; overflow and failed batches are spilled to `spill_dir` and replayed later.
+    Rows rejected `MAX_INSERT_ATTEMPTS` times are moved to the dead letter directory.
+
+    `insert_function(table, rows, row_ids)` returns a list of per-row errors like bigquery's
+    insert_rows_json; each row keeps its id through spills and replays, so retries can be deduplicated.
+    """
+
+    def __init__(self, insert_function, spill_dir, max_batch_rows=DEFAULT_MAX_BATCH_ROWS,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, max_buffered_rows=DEFAULT_MAX_BUFFERED_ROWS,
+                 replay_interval=DEFAULT_REPLAY_INTERVAL):
+        self.__insert_function = insert_function
+        self.__spill_dir = Path(spill_dir)
+        self.__spill_dir.mkdir(parents=True, exist_ok=True)
+        self.__dead_letter_dir = self.__spill_dir / DEAD_LETTER_DIR_NAME
+        self.__dead_letter_dir.mkdir(exist_ok=True)
+        self.__max_batch_rows = max_batch_rows
+        self.__flush_interval = flush_interval
+        self.__max_buffered_rows = max_buffered_rows
+        self.__replay_interval = replay_interval
+
+        self.__tables = {}
+        self.__oldest = {}
+        self.__buffered_rows = 0
+        self.__cond = threading.Condition()
+        self.__closed = False
+        self.__next_replay = time.monotonic()
+
+        self.__flusher = threading.Thread(target=self.__run, name="bq_write_behind", daemon=True)
+        self.__flusher.start()
+
+    def add(self, table, rows):
+        if not rows:
+            return True
+        # the insert id bigquery deduplicates retried rows by
+        entries = [(uuid.uuid4().hex, row) for row in rows]
+        with self.__cond:
+            if self.__closed or self.__buffered_rows + len(rows) > self.__max_buffered_rows:
+                overflow = True
+            else:
+                overflow = False
+                self.__tables.setdefault(table, deque()).extend(entries)
+                self.__oldest.setdefault(table, time.monotonic())
+                self.__buffered_rows += len(rows)
+                if len(self.__tables[table]) >= self.__max_batch_rows:
+                    self.__cond.notify_all()
+        if overflow:
+            logging.warning(f"Write-behind buffer full, spilling {len(rows)} rows of {table} to disk")
+            self.__spill(table, entries)
+            return False
+        return True
+
+    def buffered_rows(self):
+        with self.__cond:
+            return self.__buffered_rows
+
+    def flush(self):
+        for table, entries in self.__take_batches(force=True):
+            self.__insert(table, entries)
+
+    def close(self, timeout=30):
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+        self.__flusher.join(timeout)
+        self.flush()
+
+    def __take_batches(self, force=False):
+        now = time.monotonic()
+        batches = []
+        with self.__cond:
+            for table, rows in self.__tables.items():
+                due = force or len(rows) >= self.__max_batch_rows or \
+                      (rows and now - self.__oldest.get(table, now) >= self.__flush_interval)
+                while rows and due:
+                    batch = [rows.popleft() for _ in range(min(self.__max_batch_rows, len(rows)))]
+                    self.__buffered_rows -= len(batch)
+                    batches.append((table, batch))
+                    due = force or len(rows) >= self.__max_batch_rows
+                if rows:
+                    self.__oldest[table] = now
+                else:
+                    self.__oldest.pop(table, None)
+        return batches
+
+    def __next_wakeup(self):
+        if not self.__oldest:
+            return self.__flush_interval
+        return max(0, min(self.__oldest.values()) + self.__flush_interval - time.monotonic())
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                if self.__closed:
+                    return
+                self.__cond.wait(self.__next_wakeup())
+                if self.__closed:
+                    return
+            for table, entries in self.__take_batches():
+                self.__insert(table, entries)
+            if time.monotonic() >= self.__next_replay:
+                self.__next_replay = time.monotonic() + self.__replay_interval
+                self.replay_spilled()
+
+    # `attempts`: times these rows were already rejected, a failed request doesn't count as one
+    def __insert(self, table, entries, attempts=0):
+        try:
+            errors = self.__insert_function(table, [row for _, row in entries], [row_id for row_id, _ in entries])
+        except Exception as e:
+            logging.error(f"Failed inserting {len(entries)} rows into {table}, spilling to disk: {e}")
+            self.__spill(table, entries, attempts)
+            return False
+        if not errors:
+            return True
+
+        rejected, stopped = {}, []
+        for error in errors:
+            index = error.get("index")
+            if index is None or index >= len(entries):
+                continue
+            reasons = {e.get("reason") for e in error.get("errors", [])}
+            if reasons == {STOPPED_REASON}:
+                stopped.append(entries[index])
+            else:
+                rejected[index] = error
+        logging.error(f"Encountered errors while inserting into {table}, {len(rejected)} rows rejected: "
+                      f"{list(rejected.values())}")
+        rejected_entries = [entries[i] for i in sorted(rejected)]
+        if attempts + 1 >= MAX_INSERT_ATTEMPTS:
+            self.__dead_letter(table, rejected_entries, [rejected[i] for i in sorted(rejected)])
+        else:
+            self.__spill(table, rejected_entries, attempts + 1)
+        # the rows only held back by the rejected ones go again right away, without them
+        if stopped and rejected:
+            return self.__insert(table, stopped, attempts)
+        self.__spill(table, stopped, attempts)
+        return False
+
+    def __spill(self, table, entries, attempts=0):
+        if not entries:
+            return
+        spill_file = self.__spill_dir / f"{table}.{attempts}.{int(time.time())}.{uuid.uuid4().hex}{SPILL_SUFFIX}"
+        self.__write_lines(spill_file, [[row_id, row] for row_id, row in entries])
+
+    def __dead_letter(self, table, entries, errors):
+        logging.error(f"Moving {len(entries)} rows of {table} rejected {MAX_INSERT_ATTEMPTS} times to "
+                      f"{self.__dead_letter_dir}")
+        dead_letter_file = self.__dead_letter_dir / f"{table}.{int(time.time())}.{uuid.uuid4().hex}{SPILL_SUFFIX}"
+        self.__write_lines(dead_letter_file, [{"row_id": row_id, "row": row, "errors": error.get("errors")}
+                                              for (row_id, row), error in zip(entries, errors)])
+
+    @staticmethod
+    def __write_lines(path, lines):
+        tmp_path = path.with_name(path.name + TMP_SUFFIX)
+        try:
+            with open(tmp_path, "w") as f:
+                for line in lines:
+                    f.write(json.dumps(line))
+                    f.write("\n")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.error(f"Unable to write {len(lines)} rows to {path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def __parse_spill_name(spill_file):
+        # <table>.<attempts>.<time>.<uuid>, files spilled before attempts were counted have no attempts
+        parts = spill_file.name[:-len(SPILL_SUFFIX)].split(".")
+        return parts[0], int(parts[1]) if len(parts) == 4 else 0
+
+    def replay_spilled(self):
+        for spill_file in sorted(self.__spill_dir.glob(f"*{SPILL_SUFFIX}")):
+            try:
+                table, attempts = self.__parse_spill_name(spill_file)
+                with open(spill_file) as f:
+                    lines = [json.loads(line) for line in f if line.strip()]
+                # the file is gone either way: rows failing again are spilled to a new file
+                spill_file.unlink()
+            except (OSError, ValueError) as e:
+                logging.error(f"Unable to replay spilled rows {spill_file}: {e}")
+                continue
+            entries = [(line[0], line[1]) if isinstance(line, list) else (uuid.uuid4().hex, line) for line in lines]
+            for i in range(0, len(entries), self.__max_batch_rows):
+                self.__insert(table, entries[i:i + self.__max_batch_rows], attempts)
@@ -1,5 +1,6 @@
 import logging
 import os
+import signal
 from datetime import datetime, timedelta
 
 from src.client.scheduler import TestScheduler
@@ -35,4 +36,7 @@ if __name__ == '__main__':
 
     print('region: ' + region)
     scheduler = TestScheduler(region, data_dir)
+    if os.name == 'posix':
+        # `kill -HUP` reloads the schedule now instead of at the next refresh interval
+        signal.signal(signal.SIGHUP, lambda signum, frame: scheduler.request_refresh())
     scheduler.execute(END_TIME, concurrency=4)
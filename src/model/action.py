@@ -38,9 +38,9 @@ class Action(ActionChains):
             traceback.print_exc()
             self.__exception = str(traceback.format_exception_only(type(e), e))
         finally:
+            self.__duration = (datetime.now() - action_time).total_seconds() * 1000
             screenshots = try_screenshots(screenshots_opt, self._driver, result)
             page_source = try_save_page_source(page_source_opt, self._driver, result)
-            self.__duration = (datetime.now() - action_time).total_seconds() * 1000
             log = ActionLog(self.__action_group, ' '.join(self.__action_type), ' '.join(self.__action_value),
                             action_time, self.__duration, result, self.__exception,
                             screenshots, page_source)
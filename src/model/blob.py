@@ -0,0 +1,20 @@
+# shared by the agents' blob store and the service's blob endpoints
+
+BLOB_REF_PREFIX = "sha256:"
+
+
+class BlobKind:
+    SCREENSHOT = "screenshot"
+    PAGE_SOURCE = "page_source"
+
+
+class BlobJson:
+    DIGESTS = "digests"
+    MISSING = "missing"
+    RECEIVED = "received"
+    KIND = "kind"
+    ACTION_IDS = "action_ids"
+
+
+def is_blob_ref(value):
+    return isinstance(value, str) and value.startswith(BLOB_REF_PREFIX)
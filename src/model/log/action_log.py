@@ -1,43 +1,107 @@
+import json
 from datetime import datetime
 from uuid import uuid4 as gen_uuid
 
+# same output as json.dumps with default arguments
+encode_json = json.JSONEncoder().encode
+NS_PER_SECOND = 1_000_000_000
+NS_PER_MICROSECOND = 1_000
+
+
+def datetime2ns(dt):
+    """ epoch nanoseconds, naive datetimes are local time like datetime.now() """
+    return int(dt.replace(microsecond=0).timestamp()) * NS_PER_SECOND + dt.microsecond * NS_PER_MICROSECOND
+
+
+def ns2datetime(ns):
+    """ naive local datetime, the inverse of datetime2ns """
+    return datetime.fromtimestamp(ns // NS_PER_SECOND).replace(microsecond=ns % NS_PER_SECOND // NS_PER_MICROSECOND)
+
+
+def ns2isoformat(ns):
+    return ns2datetime(ns).astimezone().isoformat()
+
+
+def write_json_str(chunks, value):
+    """ base64 screenshots need no escaping, they are written as they are instead of copied by the encoder """
+    if isinstance(value, str) and value.isascii() and value.isprintable() and '"' not in value \
+            and '\\' not in value:
+        chunks.append('"')
+        chunks.append(value)
+        chunks.append('"')
+    else:
+        chunks.append(encode_json(value))
+
 
 class ActionLog(object):
+    # slotted and with an int timestamp, there is one per action and per retry
+    __slots__ = ("__action_id", "__action_group", "__action_type", "__action_value", "__action_time_ns",
+                 "__duration", "__result", "__exception", "__screenshots", "__page_source", "__metrics")
 
     def __init__(self, action_group, action_type, action_value, action_time, duration, result, exception=None,
-                 screenshots=None, page_source=None, action_id=None):
-        self.__action_id = action_id if action_id is not None else str(gen_uuid())
+                 screenshots=None, page_source=None, action_id=None, metrics=None):
+        # generated on first use
+        self.__action_id = action_id
         self.__action_group = action_group
         self.__action_type = action_type
         self.__action_value = action_value
-        self.__action_time = action_time
+        self.__action_time_ns = datetime2ns(action_time)
         self.__duration = duration
         self.__result = result
         self.__exception = exception
         self.__screenshots = screenshots
         self.__page_source = page_source
+        # browser side timings of the action, see MetricsJson
+        self.__metrics = metrics
 
     def to_dict(self):
         return {
-            ActionJson.ID: self.__action_id,
+            ActionJson.ID: self.get_id(),
             ActionJson.ACTION_GROUP: self.__action_group,
-            ActionJson.EVENT_TIME: self.__action_time,
+            ActionJson.EVENT_TIME: self.get_action_time(),
             ActionJson.DURATION: self.__duration,
             ActionJson.RESULT: self.__result,
             ActionJson.TYPE: self.__action_type,
             ActionJson.VALUE: self.__action_value,
             ActionJson.EXCEPTION: self.__exception,
-            ActionJson.SCREENSHOTS: self.__screenshots,
-            ActionJson.PAGE_SOURCE: self.__page_source
+            ActionJson.SCREENSHOTS: self.get_screenshots(),
+            ActionJson.PAGE_SOURCE: self.__page_source,
+            ActionJson.METRICS: self.__metrics
         }
 
     # json cannot automatically handle time so that's why we need this
     def to_dict_json(self):
         d = self.to_dict()
-        d[ActionJson.EVENT_TIME] = self.__action_time.astimezone().isoformat()
+        d[ActionJson.EVENT_TIME] = ns2isoformat(self.__action_time_ns)
         d[ActionJson.EXCEPTION] = str(self.__exception) if self.__exception is not None else None
         return d
 
+    # streaming counterpart of json.dumps(self.to_dict_json()), appends the encoded pieces to `chunks`
+    def write_json(self, chunks):
+        exception = str(self.__exception) if self.__exception is not None else None
+        chunks.append(f'{{"{ActionJson.ID}": ')
+        chunks.append(encode_json(self.get_id()))
+        chunks.append(f', "{ActionJson.ACTION_GROUP}": ')
+        chunks.append(encode_json(self.__action_group))
+        chunks.append(f', "{ActionJson.EVENT_TIME}": "{ns2isoformat(self.__action_time_ns)}"')
+        chunks.append(f', "{ActionJson.DURATION}": ')
+        chunks.append(encode_json(self.__duration))
+        chunks.append(f', "{ActionJson.RESULT}": ')
+        chunks.append(encode_json(self.__result))
+        chunks.append(f', "{ActionJson.TYPE}": ')
+        chunks.append(encode_json(self.__action_type))
+        chunks.append(f', "{ActionJson.VALUE}": ')
+        chunks.append(encode_json(self.__action_value))
+        chunks.append(f', "{ActionJson.EXCEPTION}": ')
+        chunks.append(encode_json(exception))
+        chunks.append(f', "{ActionJson.SCREENSHOTS}": ')
+        write_json_str(chunks, self.get_screenshots())
+        chunks.append(f', "{ActionJson.PAGE_SOURCE}": ')
+        chunks.append(encode_json(self.__page_source))
+        chunks.append(f', "{ActionJson.METRICS}": ')
+        chunks.append(encode_json(self.__metrics))
+        chunks.append('}')
+
     def set_action_group(self, action_group):
         self.__action_group = action_group
 
@@ -47,6 +111,20 @@ class ActionLog(object):
     def set_action_result(self, result):
         self.__result = result
 
+    def set_screenshots(self, screenshots):
+        self.__screenshots = screenshots
+
+    def set_page_source(self, page_source):
+        self.__page_source = page_source
+
+    def set_metrics(self, metrics):
+        self.__metrics = metrics
+
+    def get_id(self):
+        if self.__action_id is None:
+            self.__action_id = str(gen_uuid())
+        return self.__action_id
+
     def get_value(self):
         return self.__action_value
 
@@ -57,7 +135,10 @@ class ActionLog(object):
         return self.__result
 
     def get_action_time(self):
-        return self.__action_time
+        return ns2datetime(self.__action_time_ns)
+
+    def get_action_time_ns(self):
+        return self.__action_time_ns
 
     def get_duration(self):
         return self.__duration
@@ -65,6 +146,18 @@ class ActionLog(object):
     def get_exception(self):
         return self.__exception
 
+    def get_page_source(self):
+        return self.__page_source
+
+    def get_metrics(self):
+        return self.__metrics
+
+    # screenshots may still be encoding in the background (PendingScreenshot), wait for them here
+    def get_screenshots(self):
+        if callable(getattr(self.__screenshots, "result", None)):
+            self.__screenshots = self.__screenshots.result()
+        return self.__screenshots
+
 
 class ActionJson:
     ID = "id"
@@ -78,3 +171,27 @@ class ActionJson:
     METADATA = "metadata"
     SCREENSHOTS = "screenshots"
     PAGE_SOURCE = "page_source"
+    METRICS = "metrics"
+
+
+class MetricsJson:
+    """ keys of ActionJson.METRICS, the navigation and resource timing of a loaded page (ms and bytes) """
+    URL = "url"
+    NAVIGATION_TYPE = "navigation_type"
+    REDIRECT_MS = "redirect_ms"
+    DNS_MS = "dns_ms"
+    CONNECT_MS = "connect_ms"
+    TLS_MS = "tls_ms"
+    TTFB_MS = "ttfb_ms"
+    RESPONSE_MS = "response_ms"
+    DOM_CONTENT_LOADED_MS = "dom_content_loaded_ms"
+    LOAD_MS = "load_ms"
+    TRANSFER_SIZE = "transfer_size"
+    RESOURCE_COUNT = "resource_count"
+    RESOURCE_TRANSFER_SIZE = "resource_transfer_size"
+    RESOURCES_BY_TYPE = "resources_by_type"
+    LARGEST_RESOURCES = "largest_resources"
+    # stored as transaction columns of their own, the rest goes in RESOURCES as json
+    COLUMNS = [REDIRECT_MS, DNS_MS, CONNECT_MS, TLS_MS, TTFB_MS, RESPONSE_MS, DOM_CONTENT_LOADED_MS, LOAD_MS,
+               TRANSFER_SIZE, RESOURCE_COUNT, RESOURCE_TRANSFER_SIZE]
+    RESOURCES = "resources"
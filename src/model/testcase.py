@@ -4,7 +4,7 @@ import os
 import subprocess
 import time
 import traceback
-from datetime import datetime, timedelta
+from datetime import datetime
 from uuid import uuid4 as gen_uuid
 import re
 from invoke import CommandTimedOut
@@ -14,14 +14,17 @@ from selenium.webdriver.support.wait import WebDriverWait
 
 from src.model.action import Action
 from src.model.action import ActionResult
-from src.model.log.action_log import ActionLog
+from src.model.log.action_log import ActionLog, encode_json, datetime2ns, ns2datetime, ns2isoformat
 from src.test_script.script_utils import try_screenshots, ScreenshotsOption, try_save_page_source, \
-    PageSourceOption
+    PageSourceOption, try_capture_page_timing
+from src.test_script.wait_engine import wait_for_first, poll_until, wait_until_settled
+from src.test_script.browser_tabs import turn_wait_ns, in_shared_tab, WindowSwitchingNotSupported
 
 TEST_ENGINE_SELENIUM = "selenium"
 TEST_ENGINE_TEST_EXECUTE = "test_execute"
 TEST_ENGINE_CONSOLE_REMOTE = "console_remote"
-TRIES_BREAK = 5  # 5 secs
+TRIES_BREAK = 5  # 5 secs, at most, the page settling ends it sooner
+MIN_TRIES_BACKOFF = 2  # 2 secs before the first retry, doubled for each next one up to TRIES_BREAK
 NO_SET_DELAY = -1
 DEFAULT_VISIBILITY = False
 CONTAIN_INVERT_EC_DELAY = 5  # 5 secs
@@ -47,15 +50,18 @@ class TestJson:
     RESULT = "result"
     METADATA = "metadata"
     REGION = "region"
+    THINK_TIME = "think_time"
 
 
 class TestCase(object):
+    __slots__ = ("app_id", "feature_id", "test_id", "__action_time_ns", "result", "test_engine", "region", "__logs",
+                 "__screenshots", "__exception", "metadata", "__id", "__pauses")
 
     def __init__(self, app_id, feature_id, test_engine, uid=None, test_id=None, action_time=None, region=None):
         self.app_id = app_id
         self.feature_id = feature_id
         self.test_id = test_id if test_id is not None else str(gen_uuid())
-        self.action_time = datetime.now() if action_time is None else action_time
+        self.__action_time_ns = time.time_ns() if action_time is None else datetime2ns(action_time)
         self.result = ActionResult.SUCCESS
         self.test_engine = test_engine
         self.region = region
@@ -64,6 +70,8 @@ class TestCase(object):
         self.__screenshots = None
         self.__exception = None
         self.metadata = None
+        # deliberate pauses as (epoch ns at their end, ns), not part of the duration
+        self.__pauses = []
 
         if uid is not None:
             self.__id = uid
@@ -71,33 +79,94 @@ class TestCase(object):
     def is_success(self):
         return self.result == ActionResult.SUCCESS
 
-    def to_json(self, indent=None):
+    def to_json(self, indent=None, result=None, metadata=None):
+        """ `result` and `metadata` override the test's own values in the output """
+        result = self.result if result is None else result
+        metadata = self.metadata if metadata is None else metadata
+        if indent is not None:
+            return json.dumps(self.__to_dict_json(result, metadata), indent=indent)
+
+        # written piece by piece instead of building the whole dict, screenshots aren't copied on the way
+        chunks = [
+            f'{{"{TestJson.TEST_ID}": ', encode_json(self.test_id),
+            f', "{TestJson.TEST_ENGINE}": ', encode_json(self.test_engine),
+            f', "{TestJson.ACTIONS}": ['
+        ]
+        for i, log in enumerate(self.__logs):
+            if i > 0:
+                chunks.append(', ')
+            log.write_json(chunks)
+        chunks.extend([
+            f'], "{TestJson.FEATURE_ID}": ', encode_json(self.feature_id),
+            f', "{TestJson.APP_ID}": ', encode_json(self.app_id),
+            f', "{TestJson.EVENT_TIME}": "{ns2isoformat(self.__action_time_ns)}"',
+            f', "{TestJson.DURATION}": ', encode_json(self.__get_duration()),
+            f', "{TestJson.THINK_TIME}": ', encode_json(self.get_think_time()),
+            f', "{TestJson.RESULT}": ', encode_json(result),
+            f', "{TestJson.REGION}": ', encode_json(self.region),
+            f', "{TestJson.METADATA}": ', encode_json(metadata),
+            '}'
+        ])
+        return ''.join(chunks)
+
+    def __to_dict_json(self, result, metadata):
         logs_json = {
             TestJson.TEST_ID: self.test_id,
             TestJson.TEST_ENGINE: self.test_engine,
             TestJson.ACTIONS: [],
             TestJson.FEATURE_ID: self.feature_id,
             TestJson.APP_ID: self.app_id,
-            TestJson.EVENT_TIME: self.action_time.astimezone().isoformat(),
+            TestJson.EVENT_TIME: ns2isoformat(self.__action_time_ns),
             TestJson.DURATION: self.__get_duration(),
-            TestJson.RESULT: self.result,
+            TestJson.THINK_TIME: self.get_think_time(),
+            TestJson.RESULT: result,
             TestJson.REGION: self.region,
             # TODO: get a real metadata
-            TestJson.METADATA: self.metadata
+            TestJson.METADATA: metadata
         }
         for log in self.__logs:
             dict_json = log.to_dict_json()
             logs_json[TestJson.ACTIONS].append(dict_json)
-        return json.dumps(logs_json, indent=indent)
+        return logs_json
 
     def __get_duration(self):
         logs = self.logs
         if len(logs) > 0:
             last = logs[len(logs) - 1]
-            end_time = last.get_action_time()
-            return (end_time - self.action_time).total_seconds() * 1000 + last.get_duration()
+            # pauses within the last action are already out of its duration
+            last_start = last.get_action_time_ns()
+            think_ns = sum(pause_ns for end_ns, pause_ns in self.__pauses if end_ns <= last_start)
+            return (last_start - self.__action_time_ns - think_ns) / 1_000_000 + last.get_duration()
         return 0
 
+    def think(self, seconds):
+        """ a deliberate pause, recorded as think time instead of counting in the durations """
+        if seconds > 0:
+            self.add_think_time(lambda: time.sleep(seconds))
+
+    def add_think_time(self, pause):
+        """ runs `pause()` as think time, time waiting for the other tabs of a shared browser aside """
+        start = time.perf_counter_ns()
+        wait_ns = turn_wait_ns()
+        try:
+            return pause()
+        finally:
+            self.__pauses.append((time.time_ns(), time.perf_counter_ns() - start - (turn_wait_ns() - wait_ns)))
+
+    def get_think_time(self):
+        return self.get_think_time_ns() / 1_000_000
+
+    def get_think_time_ns(self):
+        return sum(pause_ns for _, pause_ns in self.__pauses)
+
+    def get_action_time(self):
+        return ns2datetime(self.__action_time_ns)
+
+    def set_action_time(self, value):
+        self.__action_time_ns = datetime2ns(value)
+
+    action_time = property(get_action_time, set_action_time)
+
     def append_log(self, action_log):
         self.__logs.append(action_log)
         self.result = ActionResult.SUCCESS if action_log.get_result() in [
@@ -107,6 +176,10 @@ class TestCase(object):
     def get_logs(self):
         return self.__logs
 
+    def get_reported_logs(self):
+        """ the logs to_json writes, the same as `logs` unless the test reports another test case """
+        return self.__logs
+
     def set_logs(self, value):
         self.__logs = value
 
@@ -140,6 +213,11 @@ class WebDriverTestCase(TestCase):
     def try_save_ps(self, result):
         return try_save_page_source(self.__ps_opt, self.__driver, result, tries=0)
 
+    def wait_until_settled(self, timeout):
+        """ waits for the page to finish loading, at most `timeout`, instead of a fixed sleep """
+        if self.is_success():
+            wait_until_settled(self.__driver, timeout)
+
     def take_screenshot(self, action_group="screenshot"):
         action_time = datetime.now()
         screenshots = try_screenshots(ScreenshotsOption.ALL, self.__driver, self.result)
@@ -220,8 +298,9 @@ class WebDriverTestCase(TestCase):
 
         action_delay = self.__action_delay if action_delay == NO_SET_DELAY else action_delay
         for i in range(self.__counter, len(self.__actions)):
+            # the delay only bounds the wait for the page to settle
             if action_delay > 0:
-                time.sleep(action_delay)
+                wait_until_settled(self.__driver, action_delay)
             action = self.__actions[i]
             log = action.perform(screenshots_opt=self.__scr_opt)
             self.append_log(log)
@@ -231,9 +310,11 @@ class WebDriverTestCase(TestCase):
         self.__counter = len(self.__actions)
 
     def load_url(self, url, title=None, log_url=None, tries=DEFAULT_LOAD_URL_TRIES, action_group="get_url", delay=1):
-        time.sleep(delay)
         if not self.is_success():
             return
+        # the page before may still be busy (login redirects...), at most `delay`
+        if delay > 0:
+            wait_until_settled(self.__driver, delay)
 
         wait = self.__wait if self.__timeout <= 0 else WebDriverWait(self.__driver, 30)
         log_url = log_url if log_url is not None else url
@@ -241,6 +322,7 @@ class WebDriverTestCase(TestCase):
         self.driver_actions(
             "get_url", lambda driver: _WebDriverTestCaseHelpers.get_url(driver, url, title, wait),
             action_group=action_group, action_value=log_url, tries=tries)
+        get_url_log = self.logs[-1]
 
         if self.is_success():
             if title is None:
@@ -250,6 +332,9 @@ class WebDriverTestCase(TestCase):
             else:
                 self.wait_for_title_contains(title, timeout=max(self.__timeout, 30), action_group=action_group)
 
+        # read once the page settled, outside of the measured actions
+        get_url_log.set_metrics(try_capture_page_timing(self.__driver))
+
     def log(self, action_group, action, action_value, result, exception, screenshots, page_source,
             action_time=datetime.now(), end_time=datetime.now()):
         self.append_log(
@@ -258,8 +343,8 @@ class WebDriverTestCase(TestCase):
                 ((end_time - action_time).total_seconds() * 1000),
                 result, exception, screenshots=screenshots, page_source=page_source))
 
-    # this wait is not accurate about time
     # the first which satisfied will be returned by its index
+    # inverted conditions are only accepted after `delay` (at least CONTAIN_INVERT_EC_DELAY when contains_invert)
     def wait_for_many(self, prioritized_ec,
                       action_group=None, action_type="wait_for_many", action_value=None,
                       timeout=0, delay=1, contains_invert=False, tries=1, refresh_on_try=False):
@@ -277,11 +362,13 @@ class WebDriverTestCase(TestCase):
         next_window = self.driver_actions("wait_for_window",
                                           lambda d: _WebDriverTestCaseHelpers.wait_for_window(
                                               self.__driver, self.__window_handles,
-                                              self.__timeout if timeout <= 0 else timeout, delay),
+                                              self.__timeout if timeout <= 0 else timeout),
                                           action_group=action_group)
         self.driver_actions("switch_to_window",
                             lambda d: self.__driver.switch_to.window(next_window),
                             action_group=action_group)
+        # the new window's page gets up to `delay` to load, like the sleep before looking for it used to
+        self.wait_until_settled(delay)
         return next_window
 
     def switch_to_root_window(self, action_group=None):
@@ -310,7 +397,7 @@ class WebDriverTestCase(TestCase):
             for kts in key_to_send:
                 self.action(action_group=action_group).send_keys_to_element(elem, kts, value=value)
                 self.exe_actions(action_delay=action_delay)
-                time.sleep(key_delay)
+                self.think(key_delay)
         return elem
 
     def driver_actions(self, action_type, actions, action_group=None, action_value=None, tries=1,
@@ -321,7 +408,10 @@ class WebDriverTestCase(TestCase):
         exception = None
         result = ActionResult.SUCCESS
         action_time = datetime.now()
+        wait_ns = turn_wait_ns()
+        think_ns = self.get_think_time_ns()
         ret = None
+        backoff = MIN_TRIES_BACKOFF
         try:
             while True:
                 tries = tries - 1
@@ -343,37 +433,41 @@ class WebDriverTestCase(TestCase):
                             # This should never happen
                             if not self.is_success():
                                 break
-                        time.sleep(TRIES_BREAK)
+                        # retry once the page settled, the pause isn't the application's time
+                        self.add_think_time(lambda: self.__retry_pause(backoff))
+                        backoff = min(backoff * 2, TRIES_BREAK)
         # TODO: list of ignored_exceptions
         except Exception as e:
             result = ActionResult.TIMEOUT if isinstance(e, TimeoutException) else ActionResult.FAILURE
             logger.info("error: ", exc_info=e)
             exception = str(traceback.format_exception_only(type(e), e))
         finally:
+            # captures below are not part of the measured action, nor are waiting for the other tabs of a
+            # shared browser and the pauses between tries
+            end_time = datetime.now()
+            duration = (end_time - action_time).total_seconds() * 1000 - \
+                (turn_wait_ns() - wait_ns + self.get_think_time_ns() - think_ns) / 1_000_000
             screenshots = self.try_screenshots(result)
             page_source = self.try_save_ps(result)
-            log = ActionLog(action_group, action_type, action_value, action_time,
-                            (datetime.now() - action_time).total_seconds() * 1000,
+            log = ActionLog(action_group, action_type, action_value, action_time, duration,
                             result, exception, screenshots=screenshots, page_source=page_source)
             self.append_log(log)
             return ret
 
+    # an error page settles at once: still back off, so a transient outage can pass before the next try
+    def __retry_pause(self, backoff):
+        deadline = time.monotonic() + backoff
+        wait_until_settled(self.__driver, TRIES_BREAK)
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
 
 class _WebDriverTestCaseHelpers:
 
     @staticmethod
     def wait_for_many(driver, prioritized_ec, timeout, delay):
-        end_time = datetime.now() + timedelta(seconds=timeout)
-        time.sleep(delay)
-        while datetime.now() < end_time:
-            for i in range(len(prioritized_ec)):
-                try:
-                    if prioritized_ec[i](driver):
-                        return i
-                except WebDriverException:
-                    pass
-            time.sleep(1)
-        raise TimeoutException(msg="None of conditions satisfied")
+        return wait_for_first(driver, prioritized_ec, timeout, settle_time=delay)
 
     @staticmethod
     def switch_to_frame(driver, val):
@@ -389,15 +483,16 @@ class _WebDriverTestCaseHelpers:
             wait.until(lambda d: title.lower() in d.title.lower())
 
     @staticmethod
-    def wait_for_window(driver, window_handles, timeout, delay):
-        end_time = datetime.now() + timedelta(seconds=timeout)
-        time.sleep(delay)
-        while datetime.now() < end_time:
-            wh_now = driver.window_handles
-            wh_then = window_handles
-            if len(wh_now) > len(wh_then):
-                return set(wh_now).difference(set(wh_then)).pop()
-        raise WebDriverException("No new window was opened")
+    def wait_for_window(driver, window_handles, timeout):
+        if in_shared_tab():
+            # the new windows of a shared browser belong to the other tests, fail now instead of timing out
+            raise WindowSwitchingNotSupported()
+
+        def new_window():
+            opened = set(driver.window_handles).difference(set(window_handles))
+            return opened.pop() if opened else None
+
+        return poll_until(new_window, timeout, lambda: WebDriverException("No new window was opened"))
 
 
 class ConsoleRemoteTestCase(TestCase):
@@ -493,6 +588,7 @@ class TCTestCase(TestCase):
         self.__exclude_list = ["open_sap", "search_app", "login_credentials", "check_system_message", "logout"]
         self.__ag_exception = action_group_exception
         self.__software = software
+        self.__parsed = None
         if tc_version is None:
             self.__tc_version = 14
         else:
@@ -552,10 +648,20 @@ class TCTestCase(TestCase):
             os.replace(os.path.join(log_dir, f), target_dir)
             self.__target_directory = target_dir
 
+    # parsed once, so the blob store and to_json see the same action logs
+    def __get_parsed(self):
+        if self.__parsed is None:
+            self.__parsed = self._parsing()
+        return self.__parsed
+
+    def get_reported_logs(self):
+        tc = self.__get_parsed()
+        return tc.logs if tc is not None else []
+
     def _parsing(self):
         if self.__target_directory is not None:
-            from src.testcomplete.tc_parser import dir2json, parse_json_dir
-            tc = parse_json_dir(dir2json(self.__target_directory), self.__scr_opt, self.region)
+            from src.testcomplete.tc_parser import parse_dir
+            tc = parse_dir(self.__target_directory, self.__scr_opt, self.region)
             self._test_execute_exclusion(tc)
             self._cred_glitch(tc)
             self._password_check(tc)
@@ -640,20 +746,15 @@ class TCTestCase(TestCase):
                     commands.append(i)
                 subprocess.run(commands, shell=True, cwd=path)
 
-    def to_json(self, indent=None):
+    def to_json(self, indent=None, result=None, metadata=None):
         if self.__target_directory is not None:
-            tc = self._parsing()
-            content = tc.to_json(indent=indent)
-            c = json.loads(content)
-            if self.metadata is not None:
-                c["metadata"] = self.metadata
-            if c["result"] != ActionResult.SUCCESS and c["actions"][-1]["result"] == ActionResult.SUCCESS:
-                c["result"] = ActionResult.SUCCESS
-                con = json.dumps(c, indent=indent)
-                self._remove_old_tc_file(5)
-                return con
-            else:
-                self._remove_old_tc_file(5)
-                return content
+            tc = self.__get_parsed()
+            if result is None and tc.result != ActionResult.SUCCESS and len(tc.logs) > 0 and \
+                    tc.logs[-1].get_result() == ActionResult.SUCCESS:
+                result = ActionResult.SUCCESS
+            content = tc.to_json(indent=indent, result=result,
+                                 metadata=self.metadata if metadata is None else metadata)
+            self._remove_old_tc_file(5)
+            return content
         else:
             return "{}"
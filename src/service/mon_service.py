@@ -1,3 +1,4 @@
+import gzip
 import json
 import ssl
 import sys
@@ -9,9 +10,16 @@ import flask
 import atexit
 from flask import Flask, request, jsonify, abort
 
-from src.database.app_monitor_db import AppMonitorDB, TestScheduleJson
+from src.database.app_monitor_db import AppMonitorDB
 from src.database.es_db import ElasticSearchDb
+from src.client.admission import TestPriority
+from src.client.testing_client import SNAPSHOT_SINCE_PARAM, RecordsJson, TestScheduleJson
+from src.model.testcase import TestJson
 from src.service.screenshot_service import add_namp_screenshots_endpoints
+from src.service.snapshot_cache import VersionedSnapshot, SnapshotUnavailable
+
+RECORDS_DB_BATCH_SIZE = 200
+REQUIRED_RECORD_KEYS = [TestJson.FEATURE_ID, TestJson.TEST_ID, TestJson.EVENT_TIME]
 
 app = Flask(__name__)
 context = ssl.SSLContext(ssl.PROTOCOL_TLSv1_2)
@@ -36,6 +44,13 @@ WHITE_LIST = [
 ]
 
 
+@app.before_request
+def decompress_request():
+    # agents gzip large test results, /records inflates its stream itself
+    if request.headers.get("Content-Encoding") == "gzip" and request.endpoint != "submit_records":
+        request._cached_data = gzip.decompress(request.get_data(cache=True))
+
+
 def limit_remote_addr():
     if request.remote_addr not in WHITE_LIST:
         from werkzeug.exceptions import Forbidden
@@ -80,6 +95,65 @@ def push_to_db(content, connection=None):
     app.logger.info("record: %s", content)
 
 
+@app.route("/records", methods=["POST"])
+def submit_records():
+    if not limit_remote_addr():
+        return
+
+    stream = request.stream
+    if request.headers.get("Content-Encoding") == "gzip":
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    try:
+        statuses, errors = push_records_to_db(stream)
+    except (OSError, EOFError) as e:
+        # truncated or corrupted gzip stream, nothing after the failing point could be read
+        app.logger.error(f"Error reading records stream: {e}")
+        from werkzeug.exceptions import BadRequest
+        abort(BadRequest.code)
+        return
+    return jsonify({RecordsJson.STATUSES: statuses, RecordsJson.ERRORS: errors})
+
+
+def parse_record_line(line):
+    """ returns the record dict, or raises ValueError describing why it is rejected """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("record is not a json object")
+    missing = [k for k in REQUIRED_RECORD_KEYS if record.get(k) is None]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if not isinstance(record.get(TestJson.ACTIONS, []), list):
+        raise ValueError(f"{TestJson.ACTIONS} is not a list")
+    return record
+
+
+def push_records_to_db(lines):
+    """ parses NDJSON lines one at a time and inserts valid records in batches, returns per-line statuses """
+    statuses = []
+    errors = {}
+    batch = []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        # every line gets a status, agents match statuses to their records by position
+        index = len(statuses)
+        try:
+            if not line.strip():
+                raise ValueError("empty record")
+            batch.append(parse_record_line(line))
+            statuses.append(200)
+        except ValueError as e:
+            statuses.append(400)
+            errors[str(index)] = str(e)
+        if len(batch) >= RECORDS_DB_BATCH_SIZE:
+            am_db.insert_test_results(batch)
+            batch = []
+    if batch:
+        am_db.insert_test_results(batch)
+    app.logger.info(f"records: {statuses.count(200)} accepted, {len(errors)} rejected")
+    return statuses, errors
+
+
 @app.route("/cred", methods=["GET"])
 def get_cred():
     if not limit_remote_addr():
@@ -102,6 +176,50 @@ def get_cred():
     return jsonify(ret)
 
 
+def snapshot_response(snapshot):
+    etag = snapshot.etag()
+    if etag is not None and request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
+    else:
+        since = request.args.get(SNAPSHOT_SINCE_PARAM, type=int)
+        try:
+            # agents not sending a version still get the plain list
+            response = jsonify(snapshot.items() if since is None else snapshot.response(since))
+        except SnapshotUnavailable as e:
+            # agents keep their current schedule on errors
+            app.logger.error(f"No snapshot to serve: {e}")
+            from werkzeug.exceptions import ServiceUnavailable
+            abort(ServiceUnavailable.code)
+            return
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def load_tests(region):
+    ret = []
+    for row in am_db.get_tests(region):
+        feature_id, engine_type, interval, _region = row[:4]
+        # schedules without the priority column run at normal priority
+        priority = row[4] if len(row) > 4 and row[4] else TestPriority.NORMAL
+        ret.append({
+            TestScheduleJson.FEATURE_ID: feature_id,
+            TestScheduleJson.ENGINE_TYPE: engine_type,
+            TestScheduleJson.INTERVAL: interval,
+            TestScheduleJson.REGION: _region,
+            TestScheduleJson.PRIORITY: priority
+        })
+    return ret
+
+
+def load_maintenance():
+    return [{TestScheduleJson.FEATURE_ID: feature_id[0]} for feature_id in am_db.get_maintenance_features()]
+
+
+tests_snapshots = {}
+maintenance_snapshot = VersionedSnapshot(load_maintenance)
+
+
 @app.route("/tests", methods=["GET"])
 def get_tests():
     if not limit_remote_addr():
@@ -111,16 +229,9 @@ def get_tests():
         return
 
     region = unquote(request.args.get("region"))
-    ret = []
-    results = am_db.get_tests(region)
-    for feature_id, engine_type, interval, region in results:
-        ret.append({
-            TestScheduleJson.FEATURE_ID: feature_id,
-            TestScheduleJson.ENGINE_TYPE: engine_type,
-            TestScheduleJson.INTERVAL: interval,
-            TestScheduleJson.REGION: region
-        })
-    return jsonify(ret)
+    if region not in tests_snapshots:
+        tests_snapshots.setdefault(region, VersionedSnapshot(lambda: load_tests(region)))
+    return snapshot_response(tests_snapshots[region])
 
 
 @app.route("/maintenance", methods=["GET"])
@@ -128,13 +239,7 @@ def get_maintenance():
     if not limit_remote_addr():
         return
 
-    ret = []
-    results = am_db.get_maintenance_features()
-    for feature_id in results:
-        ret.append({
-            TestScheduleJson.FEATURE_ID: feature_id[0]
-        })
-    return jsonify(ret)
+    return snapshot_response(maintenance_snapshot)
 
 
 @app.route("/hard-timeout", methods=["GET"])
@@ -184,6 +289,8 @@ def change_password():
         }
     app.logger.info("pw-change: %s", content)
     am_db.insert_pw_change(content)
+    if content.get("feature_id") is not None:
+        am_db.invalidate_cred(content.get("feature_id"))
     return ""
 
 
@@ -321,6 +428,6 @@ if __name__ == '__main__':
     atexit.register(handle_exit)
 
     if environ.get('GOOGLE_APPLICATION_CREDENTIALS') is not None:
-        add_namp_screenshots_endpoints(app)
+        add_namp_screenshots_endpoints(app, limit_remote_addr=limit_remote_addr)
 
     app.run(threaded=True, debug=True, host='0.0.0.0', port=5000, ssl_context=context)
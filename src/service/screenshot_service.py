@@ -1,25 +1,50 @@
 import base64
+import hashlib
+import re
 import ssl
+import tempfile
+import threading
 from pathlib import Path
 from urllib.parse import unquote
 
-from flask import Flask, request, make_response, render_template
+from flask import Flask, request, make_response, render_template, jsonify
+from google.api_core.exceptions import NotFound
 from google.cloud import storage
 
+from src.model.blob import BlobKind, BlobJson
 from src.database.app_monitor_db import JPEG_EXTENSION
 from src.database.utils import get_namp_screenshots_data_dir
 
 
 NAMP_SCREENSHOTS_BUCKET = "namp_screenshots"
+BLOBS_PREFIX = "blobs"
+HTML_EXTENSION = ".html"
+# object at the action's path holding the digest of the blob it shows
+REF_SUFFIX = ".ref"
+BLOB_EXTENSIONS = {
+    BlobKind.SCREENSHOT: JPEG_EXTENSION,
+    BlobKind.PAGE_SOURCE: HTML_EXTENSION
+}
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+CONTENT_RANGE_PATTERN = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
 
 
 def get_image(action_id, namp_screenshots_dir, gcs_bucket):
-    file_path = str(namp_screenshots_dir.get_file_path(action_id, extension=JPEG_EXTENSION))
-    blob = gcs_bucket.blob(file_path)
-    return blob.download_as_bytes()
+    return get_action_blob(action_id, JPEG_EXTENSION, namp_screenshots_dir, gcs_bucket)
 
 
-def add_namp_screenshots_endpoints(_app):
+def get_action_blob(action_id, extension, namp_screenshots_dir, gcs_bucket):
+    file_path = str(namp_screenshots_dir.get_file_path(action_id, extension=extension))
+    try:
+        digest = gcs_bucket.blob(f"{file_path}{REF_SUFFIX}").download_as_text().strip()
+    except NotFound:
+        # uploaded before blobs were linked by reference
+        return gcs_bucket.blob(file_path).download_as_bytes()
+    return gcs_bucket.blob(f"{BLOBS_PREFIX}/{digest}").download_as_bytes()
+
+
+def add_namp_screenshots_endpoints(_app, limit_remote_addr=None):
+    """ the agents' blob upload endpoints are only added along with the service's address whitelist check """
     storage_client = storage.Client()
     namp_screenshots_dir = get_namp_screenshots_data_dir("screenshots", init_if_not_exists=False)
     gcs_bucket = storage_client.get_bucket(NAMP_SCREENSHOTS_BUCKET)
@@ -40,6 +65,89 @@ def add_namp_screenshots_endpoints(_app):
         img = base64.b64encode(get_image(action_id, namp_screenshots_dir, gcs_bucket)).decode('ascii')
         return render_template("screenshots.html", image_base64=img)
 
+    if limit_remote_addr is not None:
+        add_namp_blob_endpoints(_app, namp_screenshots_dir, gcs_bucket, limit_remote_addr)
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def add_namp_blob_endpoints(_app, namp_screenshots_dir, gcs_bucket, limit_remote_addr):
+    """
+    Agents upload each screenshot/page source once by sha256 digest, in resumable chunks, then link it
+    to the actions referencing it; linking stores the digest next to the action's path, see get_action_blob
+    """
+    staging_dir = Path(tempfile.gettempdir()) / "namp_blob_uploads"
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    known_digests = set()
+    digest_locks = {}
+    locks_lock = threading.Lock()
+
+    def digest_lock(digest):
+        with locks_lock:
+            return digest_locks.setdefault(digest, threading.Lock())
+
+    def content_blob(digest):
+        return gcs_bucket.blob(f"{BLOBS_PREFIX}/{digest}")
+
+    def is_stored(digest):
+        if digest not in known_digests and content_blob(digest).exists():
+            known_digests.add(digest)
+        return digest in known_digests
+
+    @_app.route("/blobs/missing", methods=["POST"])
+    def missing_blobs():
+        if not limit_remote_addr():
+            return
+        digests = request.json.get(BlobJson.DIGESTS, [])
+        return jsonify({BlobJson.MISSING: [d for d in digests if DIGEST_PATTERN.match(d) and not is_stored(d)]})
+
+    @_app.route("/blobs/<digest>", methods=["PUT"])
+    def put_blob_chunk(digest):
+        if not limit_remote_addr():
+            return
+        content_range = CONTENT_RANGE_PATTERN.match(request.headers.get("Content-Range", ""))
+        if not DIGEST_PATTERN.match(digest) or content_range is None:
+            return jsonify({BlobJson.RECEIVED: 0}), 400
+        start, total = int(content_range.group(1)), int(content_range.group(3))
+
+        with digest_lock(digest):
+            if is_stored(digest):
+                return jsonify({BlobJson.RECEIVED: total})
+            staging_file = staging_dir / digest
+            received = staging_file.stat().st_size if staging_file.is_file() else 0
+            if start != received:
+                return jsonify({BlobJson.RECEIVED: received}), 409
+            with open(staging_file, "ab") as f:
+                f.write(request.get_data())
+            received = staging_file.stat().st_size
+            if received >= total:
+                if _file_sha256(staging_file) != digest:
+                    staging_file.unlink()
+                    return jsonify({BlobJson.RECEIVED: 0}), 400
+                content_blob(digest).upload_from_filename(str(staging_file))
+                known_digests.add(digest)
+                staging_file.unlink()
+            return jsonify({BlobJson.RECEIVED: received})
+
+    @_app.route("/blobs/<digest>/links", methods=["POST"])
+    def link_blob(digest):
+        if not limit_remote_addr():
+            return
+        content = request.json
+        extension = BLOB_EXTENSIONS.get(content.get(BlobJson.KIND))
+        if not DIGEST_PATTERN.match(digest) or extension is None or not is_stored(digest):
+            return "", 400
+        for action_id in content.get(BlobJson.ACTION_IDS, []):
+            file_path = str(namp_screenshots_dir.get_file_path(action_id, extension=extension))
+            gcs_bucket.blob(f"{file_path}{REF_SUFFIX}").upload_from_string(digest, content_type="text/plain")
+        return ""
+
 
 if __name__ == '__main__':
     app = Flask(__name__)
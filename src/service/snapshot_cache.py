@@ -0,0 +1,114 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from src.client.testing_client import SnapshotJson
+
+DEFAULT_REFRESH_INTERVAL = 60  # 1 min
+DEFAULT_MAX_DELTAS = 100
+FAILED_REFRESH_BACKOFF = 10  # 10 secs
+
+
+class SnapshotUnavailable(Exception):
+    pass
+
+
+class VersionedSnapshot:
+    """
+    In-memory copy of a query result keyed by feature id. `loader()` returns the current list of items
+    and is re-run at most every `refresh_interval` seconds no matter how many agents ask; every change
+    bumps the version and the last `max_deltas` changes are kept so agents can catch up with a delta.
+    """
+
+    def __init__(self, loader, key=SnapshotJson.FEATURE_ID, refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 max_deltas=DEFAULT_MAX_DELTAS):
+        self.__loader = loader
+        self.__key = key
+        self.__refresh_interval = refresh_interval
+        self.__max_deltas = max_deltas
+        self.__items = {}
+        # starting from the clock keeps versions of a restarted service apart from the ones agents hold
+        self.__version = int(time.time() * 1000)
+        self.__etag = None
+        self.__deltas = OrderedDict()  # version -> (upserted keys, removed keys) leading to it
+        # monotonic time the snapshot goes stale at, None before the first load attempt
+        self.__next_refresh = None
+        self.__lock = threading.Lock()
+        self.__load_lock = threading.Lock()
+
+    def etag(self):
+        self.__refresh_if_stale()
+        return self.__etag
+
+    def is_loaded(self):
+        return self.__etag is not None
+
+    def response(self, since=None):
+        """ full snapshot when `since` is unknown or too old, otherwise the changes after `since` """
+        self.__refresh_if_stale()
+        self.__check_loaded()
+        with self.__lock:
+            ret = {SnapshotJson.VERSION: self.__version}
+            if since is not None and since == self.__version:
+                ret.update({SnapshotJson.DELTA: True, SnapshotJson.ITEMS: [], SnapshotJson.REMOVED: []})
+            elif since is not None and since + 1 in self.__deltas:
+                upserted, removed = set(), set()
+                for version in range(since + 1, self.__version + 1):
+                    v_upserted, v_removed = self.__deltas[version]
+                    upserted = (upserted - v_removed) | v_upserted
+                    removed = (removed - v_upserted) | v_removed
+                ret.update({
+                    SnapshotJson.DELTA: True,
+                    SnapshotJson.ITEMS: [self.__items[k] for k in upserted],
+                    SnapshotJson.REMOVED: list(removed)
+                })
+            else:
+                ret.update({SnapshotJson.DELTA: False, SnapshotJson.ITEMS: list(self.__items.values())})
+            return ret
+
+    def items(self):
+        self.__refresh_if_stale()
+        self.__check_loaded()
+        with self.__lock:
+            return list(self.__items.values())
+
+    # an empty list would be applied by agents as "nothing scheduled", so no snapshot is no answer at all
+    def __check_loaded(self):
+        if not self.is_loaded():
+            raise SnapshotUnavailable("snapshot not loaded yet")
+
+    def __is_fresh(self):
+        return self.__next_refresh is not None and time.monotonic() < self.__next_refresh
+
+    def __refresh_if_stale(self):
+        if self.__is_fresh():
+            return
+        # one request reloads, the others keep being served from the current snapshot
+        if not self.__load_lock.acquire(blocking=not self.is_loaded()):
+            return
+        try:
+            if self.__is_fresh():
+                return
+            self.__update(self.__loader())
+            self.__next_refresh = time.monotonic() + self.__refresh_interval
+        except Exception as e:
+            # retried soon, the last loaded snapshot is served meanwhile
+            logging.error(f"Failed refreshing snapshot: {e}")
+            self.__next_refresh = time.monotonic() + min(FAILED_REFRESH_BACKOFF, self.__refresh_interval)
+        finally:
+            self.__load_lock.release()
+
+    def __update(self, new_items):
+        new_items = {item[self.__key]: item for item in new_items}
+        with self.__lock:
+            upserted = {k for k, item in new_items.items() if self.__items.get(k) != item}
+            removed = set(self.__items) - set(new_items)
+            if not upserted and not removed and self.__etag is not None:
+                return
+            self.__items = new_items
+            self.__version += 1
+            self.__deltas[self.__version] = (upserted, removed)
+            while len(self.__deltas) > self.__max_deltas:
+                self.__deltas.popitem(last=False)
+            self.__etag = str(self.__version)
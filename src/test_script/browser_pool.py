@@ -0,0 +1,261 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from src.test_script.script_test import get_driver, DriverType
+
+DEFAULT_MIN_IDLE = 2
+DEFAULT_MAX_IDLE = 4
+DEFAULT_MAX_AGE = timedelta(hours=2)
+DEFAULT_MAX_USES = 50
+DEFAULT_IDLE_TTL = timedelta(minutes=10)
+BLANK_PAGE = "about:blank"
+CLEAR_STORAGE_SCRIPT = """
+try { window.localStorage.clear(); } catch (e) {}
+try { window.sessionStorage.clear(); } catch (e) {}
+"""
+
+
+def driver_spec(driver_type=DriverType.DEFAULT, headless=False, proxy_addr=None, additional_opts=None):
+    return {
+        "driver_type": DriverType.DEFAULT if driver_type is None else driver_type,
+        "headless": headless,
+        "proxy_addr": proxy_addr,
+        "additional_opts": additional_opts
+    }
+
+
+def _spec_key(spec):
+    opts = spec["additional_opts"]
+    # firefox options come as [pref, value] pairs from json
+    opts = None if opts is None else tuple(tuple(o) if isinstance(o, list) else o for o in opts)
+    return spec["driver_type"], spec["headless"], spec["proxy_addr"], opts
+
+
+def reset_driver(driver):
+    handles = driver.window_handles
+    try:
+        driver.execute_script(CLEAR_STORAGE_SCRIPT)
+    except Exception as e:
+        logging.debug(f"Clearing storage failed: {e}")
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+    # webdriver's delete_all_cookies only covers the current domain, chromium can wipe the whole jar
+    execute_cdp_cmd = getattr(driver, "execute_cdp_cmd", None)
+    if execute_cdp_cmd is not None:
+        execute_cdp_cmd("Network.clearBrowserCookies", {})
+    else:
+        driver.delete_all_cookies()
+    driver.get(BLANK_PAGE)
+
+
+class PooledDriver:
+
+    def __init__(self, key, spec, driver):
+        self.key = key
+        self.spec = spec
+        self.driver = driver
+        self.created_time = datetime.now()
+        self.idle_since = None
+        self.uses = 0
+
+    def is_expired(self, max_age, max_uses):
+        return self.uses >= max_uses or datetime.now() - self.created_time >= max_age
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception as e:
+            logging.warning(f"Error quitting pooled driver {self.key}: {e}")
+
+
+class BrowserPool:
+    """
+    Keeps warm WebDriver sessions per driver type and options; sessions are reset before being
+    handed out and recycled after `max_age` or `max_uses`. Only options acquired within `idle_ttl` are
+    kept warm, and sessions idle for longer than `idle_ttl` are quit beyond those
+    """
+
+    def __init__(self, min_idle=DEFAULT_MIN_IDLE, max_idle=DEFAULT_MAX_IDLE, max_age=DEFAULT_MAX_AGE,
+                 max_uses=DEFAULT_MAX_USES, idle_ttl=DEFAULT_IDLE_TTL, driver_factory=get_driver):
+        self.__min_idle = min_idle
+        self.__max_idle = max(min_idle, max_idle)
+        self.__max_age = max_age
+        self.__max_uses = max_uses
+        self.__idle_ttl = idle_ttl
+        self.__driver_factory = driver_factory
+        self.__idle = {}
+        self.__specs = {}
+        self.__last_acquired = {}
+        self.__spawning = {}
+        self.__leased = 0
+        self.__lock = threading.Lock()
+        self.__spawner = ThreadPoolExecutor(max_workers=2, thread_name_prefix="browser_pool")
+        self.__closed = False
+        self.__stop = threading.Event()
+        self.__reaper = threading.Thread(target=self.__reap_periodically, args=(idle_ttl.total_seconds() / 2,),
+                                         name="browser_pool_reaper", daemon=True)
+        self.__reaper.start()
+
+    def warm_up(self, **spec_args):
+        spec = driver_spec(**spec_args)
+        key = _spec_key(spec)
+        with self.__lock:
+            self.__specs[key] = spec
+            self.__last_acquired[key] = datetime.now()
+            self.__idle.setdefault(key, deque())
+        self.__replenish(key)
+
+    def acquire(self, **spec_args):
+        spec = driver_spec(**spec_args)
+        key = _spec_key(spec)
+        with self.__lock:
+            self.__specs[key] = spec
+            self.__last_acquired[key] = datetime.now()
+            self.__idle.setdefault(key, deque())
+            self.__leased += 1
+
+        try:
+            pooled = self.__take_healthy(key)
+            if pooled is None:
+                pooled = PooledDriver(key, spec, self.__driver_factory(**spec))
+        except Exception:
+            with self.__lock:
+                self.__leased -= 1
+            raise
+        finally:
+            self.__replenish(key)
+
+        pooled.uses += 1
+        return pooled
+
+    def release(self, pooled, healthy=True):
+        with self.__lock:
+            self.__leased -= 1
+            idle = self.__idle.setdefault(pooled.key, deque())
+            keep = healthy and not self.__closed and len(idle) < self.__max_idle and \
+                not pooled.is_expired(self.__max_age, self.__max_uses)
+            if keep:
+                pooled.idle_since = datetime.now()
+                idle.append(pooled)
+        if not keep:
+            pooled.quit()
+            self.__replenish(pooled.key)
+
+    @contextmanager
+    def lease(self, **spec_args):
+        pooled = self.acquire(**spec_args)
+        healthy = True
+        try:
+            yield pooled.driver
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self.release(pooled, healthy=healthy)
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "leased": self.__leased,
+                "idle": sum(len(idle) for idle in self.__idle.values()),
+                "spawning": sum(self.__spawning.values())
+            }
+
+    def reap_idle(self):
+        """ quits the sessions idle for longer than `idle_ttl`, except the warm ones of recently acquired options """
+        now = datetime.now()
+        to_quit = []
+        with self.__lock:
+            for key, idle in list(self.__idle.items()):
+                keep_warm = self.__min_idle if self.__is_wanted(key, now) else 0
+                kept = deque()
+                # newest first, so the warm ones kept are the freshest
+                for pooled in reversed(idle):
+                    stale = now - pooled.idle_since >= self.__idle_ttl or \
+                        pooled.is_expired(self.__max_age, self.__max_uses)
+                    if stale and len(kept) >= keep_warm:
+                        to_quit.append(pooled)
+                    else:
+                        kept.appendleft(pooled)
+                self.__idle[key] = kept
+                if not keep_warm and not kept and not self.__spawning.get(key):
+                    del self.__idle[key]
+                    self.__specs.pop(key, None)
+                    self.__last_acquired.pop(key, None)
+                    self.__spawning.pop(key, None)
+        for pooled in to_quit:
+            logging.info(f"Quitting idle pooled driver {pooled.key}")
+            pooled.quit()
+
+    def close(self):
+        self.__stop.set()
+        with self.__lock:
+            self.__closed = True
+            to_quit = [pooled for idle in self.__idle.values() for pooled in idle]
+            self.__idle.clear()
+        self.__spawner.shutdown(wait=False)
+        for pooled in to_quit:
+            pooled.quit()
+
+    def __take_healthy(self, key):
+        while True:
+            with self.__lock:
+                idle = self.__idle.get(key)
+                if not idle:
+                    return None
+                pooled = idle.popleft()
+            if pooled.is_expired(self.__max_age, self.__max_uses):
+                pooled.quit()
+                continue
+            try:
+                reset_driver(pooled.driver)
+                return pooled
+            except Exception as e:
+                logging.info(f"Discarding unhealthy pooled driver {key}: {e}")
+                pooled.quit()
+
+    def __is_wanted(self, key, now):
+        last_acquired = self.__last_acquired.get(key)
+        return last_acquired is not None and now - last_acquired < self.__idle_ttl
+
+    def __replenish(self, key):
+        with self.__lock:
+            if self.__closed or not self.__is_wanted(key, datetime.now()):
+                return
+            missing = self.__min_idle - len(self.__idle.get(key, ())) - self.__spawning.get(key, 0)
+            if missing <= 0:
+                return
+            self.__spawning[key] = self.__spawning.get(key, 0) + missing
+            spec = self.__specs[key]
+        for _ in range(missing):
+            self.__spawner.submit(self.__spawn, key, spec)
+
+    def __spawn(self, key, spec):
+        pooled = None
+        try:
+            pooled = PooledDriver(key, spec, self.__driver_factory(**spec))
+        except Exception as e:
+            logging.error(f"Pre-spawning driver {key} failed: {e}")
+        finally:
+            with self.__lock:
+                self.__spawning[key] -= 1
+                idle = self.__idle.setdefault(key, deque())
+                if pooled is not None and not self.__closed and len(idle) < self.__max_idle:
+                    pooled.idle_since = datetime.now()
+                    idle.append(pooled)
+                    pooled = None
+        if pooled is not None:
+            pooled.quit()
+
+    def __reap_periodically(self, interval):
+        while not self.__stop.wait(interval):
+            try:
+                self.reap_idle()
+            except Exception as e:
+                logging.error(f"Reaping idle drivers failed: {e}")
@@ -0,0 +1,374 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4 as gen_uuid
+
+from selenium.common.exceptions import TimeoutException, WebDriverException, NoSuchWindowException
+from selenium.webdriver.remote.command import Command
+
+DEFAULT_TABS_PER_BROWSER = 4
+DEFAULT_MAX_BROWSERS = 1
+# a shared browser goes back to the browser pool after that many tests, to be recycled like the others
+DEFAULT_MAX_TABS_SERVED = 200
+DEFAULT_PAGE_LOAD_TIMEOUT = 45  # 45 secs
+NAVIGATION_POLL_INTERVAL = 0.05  # 50 ms
+BLANK_PAGE = "about:blank"
+# navigates without blocking the session, the old document keeps the marker until it is replaced
+_NAVIGATE_SCRIPT = "window.__nampTabNavigation = arguments[1]; window.location.href = arguments[0];"
+_NAVIGATION_STATE_SCRIPT = """
+if (window.__nampTabNavigation === arguments[0]) { return null; }
+var nav = performance.getEntriesByType ? performance.getEntriesByType('navigation')[0] : null;
+return [document.readyState, window.location.href, nav ? nav.loadEventEnd : null];
+"""
+
+_bound = threading.local()
+_WINDOW_HANDLES_COMMANDS = {getattr(Command, name, None) for name in ["W3C_GET_WINDOW_HANDLES", "GET_WINDOW_HANDLES"]}
+
+
+class WindowSwitchingNotSupported(WebDriverException):
+    """ the other windows of a shared browser are other tests' tabs, a tab only drives its own """
+
+    def __init__(self):
+        super().__init__("Tests switching windows can't run as tabs of a shared browser, "
+                         "schedule them as selenium_shared or selenium_separated")
+
+
+def turn_wait_ns():
+    """ time the calling thread's tab spent waiting for the other tabs of its browser, 0 outside tabs """
+    tab = getattr(_bound, "tab", None)
+    return 0 if tab is None else tab.wait_ns
+
+
+def in_shared_tab():
+    return getattr(_bound, "tab", None) is not None
+
+
+class _TurnScheduler:
+    """ FIFO turns on one browser session, reentrant for the thread holding the turn """
+
+    def __init__(self):
+        self.__cond = threading.Condition()
+        self.__next_ticket = 0
+        self.__serving = 0
+        self.__owner = None
+        self.__depth = 0
+
+    @contextmanager
+    def turn(self):
+        me = threading.get_ident()
+        with self.__cond:
+            if self.__owner != me:
+                ticket = self.__next_ticket
+                self.__next_ticket += 1
+                while self.__serving != ticket:
+                    self.__cond.wait()
+                self.__owner = me
+            self.__depth += 1
+        try:
+            yield
+        finally:
+            with self.__cond:
+                self.__depth -= 1
+                if self.__depth == 0:
+                    self.__owner = None
+                    self.__serving += 1
+                    self.__cond.notify_all()
+
+
+class _Tab:
+
+    def __init__(self, browser, handle, context_id):
+        self.browser = browser
+        self.handle = handle
+        self.context_id = context_id
+        self.wait_ns = 0
+        self.page_load_timeout = DEFAULT_PAGE_LOAD_TIMEOUT
+
+
+class TabbedBrowser:
+    """
+    One pooled driver hosting up to `max_tabs` tests, each in its own tab. Every driver command of a
+    tab (element commands included, they all go through `driver.execute`) runs in its turn after
+    switching to the tab's window; page loads don't hold the turn, so the tabs load in parallel.
+    A tab only sees and drives its own window, switching to another one raises WindowSwitchingNotSupported.
+    """
+
+    def __init__(self, pooled, key, max_tabs):
+        self.pooled = pooled
+        self.key = key
+        self.max_tabs = max_tabs
+        self.healthy = True
+        # leased tabs, counted by the TabPool before the tab is opened
+        self.leases = 0
+        self.served = 0
+        self.__driver = pooled.driver
+        self.__turns = _TurnScheduler()
+        self.__root_handle = self.__driver.current_window_handle
+        self.__current_handle = self.__root_handle
+        self.__isolated = None
+        self.__original_execute = self.__driver.execute
+        # shadows WebDriver.execute on this instance only, undone by detach
+        self.__driver.execute = self.__execute
+
+    @property
+    def driver(self):
+        return self.__driver
+
+    def is_isolated(self):
+        return bool(self.__isolated)
+
+    def open_tab(self):
+        with self.__turns.turn():
+            before = set(self.__original_window_handles())
+            context_id = self.__create_context() if self.__isolated is not False else None
+            if context_id is None:
+                self.__driver.execute_script(f"window.open('{BLANK_PAGE}', '_blank');")
+            opened = set(self.__original_window_handles()) - before
+            if not opened and context_id is not None:
+                # the driver doesn't expose tabs of other browser contexts, share the cookie jar instead
+                logging.info("Browser contexts are not reachable through the driver, tabs share cookies")
+                self.__dispose_context(context_id)
+                self.__isolated = False
+                context_id = None
+                self.__driver.execute_script(f"window.open('{BLANK_PAGE}', '_blank');")
+                opened = set(self.__original_window_handles()) - before
+            if not opened:
+                raise WebDriverException("No tab was opened")
+            if context_id is not None:
+                self.__isolated = True
+            tab = _Tab(self, opened.pop(), context_id)
+            return tab
+
+    def close_tab(self, tab):
+        with self.__turns.turn():
+            try:
+                self.__switch_to(tab.handle)
+                self.__original_execute(Command.CLOSE)
+                if tab.context_id is not None:
+                    self.__dispose_context(tab.context_id)
+            finally:
+                self.__switch_to(self.__root_handle)
+
+    def detach(self):
+        """ gives the driver back its own execute, before it returns to the browser pool """
+        del self.__driver.execute
+
+    @contextmanager
+    def bind(self, tab):
+        _bound.tab = tab
+        try:
+            yield self.__driver
+        finally:
+            _bound.tab = None
+
+    def __execute(self, driver_command, params=None):
+        tab = getattr(_bound, "tab", None)
+        if tab is None or tab.browser is not self:
+            # pool and tab bookkeeping, always called within a turn
+            return self.__original_execute(driver_command, params)
+        if driver_command == Command.GET:
+            return self.__navigate(tab, params["url"])
+        if driver_command in _WINDOW_HANDLES_COMMANDS:
+            return {"value": [tab.handle]}
+        if driver_command == getattr(Command, "NEW_WINDOW", None) or \
+                (driver_command == Command.SWITCH_TO_WINDOW and
+                 params.get("handle", params.get("name")) != tab.handle):
+            raise WindowSwitchingNotSupported()
+        with self.__on_tab(tab):
+            response = self.__original_execute(driver_command, params)
+            if driver_command == Command.CLOSE:
+                self.__current_handle = None
+            elif driver_command == Command.SET_TIMEOUTS and params.get("pageLoad") is not None:
+                tab.page_load_timeout = params["pageLoad"] / 1000
+        return response
+
+    @contextmanager
+    def __on_tab(self, tab):
+        # waiting for the turn and switching windows is the cost of sharing, not time spent by the site
+        start = time.perf_counter_ns()
+        with self.__turns.turn():
+            self.__switch_to(tab.handle)
+            tab.wait_ns += time.perf_counter_ns() - start
+            yield
+
+    def __navigate(self, tab, url):
+        wait_ns = tab.wait_ns
+        token = gen_uuid().hex
+        start = time.perf_counter_ns()
+        deadline = time.monotonic() + tab.page_load_timeout
+        self.__driver.execute_script(_NAVIGATE_SCRIPT, url, token)
+        while True:
+            time.sleep(NAVIGATION_POLL_INTERVAL)
+            poll_wait_ns = tab.wait_ns
+            try:
+                state = self.__driver.execute_script(_NAVIGATION_STATE_SCRIPT, token)
+            except NoSuchWindowException:
+                raise
+            except WebDriverException as e:
+                # the old document is going away
+                logging.debug(f"Polling navigation to {url}: {e}")
+                state = None
+            # as driver.get: done once the load event ran
+            if state is not None and state[0] == "complete" and (state[2] is None or state[2] > 0):
+                break
+            if time.monotonic() > deadline:
+                raise TimeoutException(f"timeout: page load of {url} exceeded {tab.page_load_timeout} seconds")
+
+        if state[1].startswith("chrome-error://"):
+            raise WebDriverException(f"unknown error: net error navigating to {url}")
+        if state[2] is not None:
+            # the page's own load time is what driver.get would have waited for, the rest was sharing
+            elapsed_ns = time.perf_counter_ns() - start
+            tab.wait_ns = wait_ns + max(0, elapsed_ns - int(state[2] * 1_000_000))
+        else:
+            tab.wait_ns = wait_ns + (tab.wait_ns - poll_wait_ns)
+        return {"value": None}
+
+    def __switch_to(self, handle):
+        if handle != self.__current_handle:
+            params = {"handle": handle} if getattr(self.__driver, "w3c", True) else {"name": handle}
+            self.__original_execute(Command.SWITCH_TO_WINDOW, params)
+            self.__current_handle = handle
+
+    def __original_window_handles(self):
+        command = Command.W3C_GET_WINDOW_HANDLES if getattr(self.__driver, "w3c", True) \
+            else Command.GET_WINDOW_HANDLES
+        return self.__original_execute(command)["value"]
+
+    def __create_context(self):
+        execute_cdp_cmd = getattr(self.__driver, "execute_cdp_cmd", None)
+        if execute_cdp_cmd is None:
+            self.__isolated = False
+            return None
+        try:
+            context_id = execute_cdp_cmd("Target.createBrowserContext", {})["browserContextId"]
+            execute_cdp_cmd("Target.createTarget", {"url": BLANK_PAGE, "browserContextId": context_id})
+            return context_id
+        except WebDriverException as e:
+            logging.info(f"Browser contexts are not supported, tabs share cookies: {e}")
+            self.__isolated = False
+            return None
+
+    def __dispose_context(self, context_id):
+        try:
+            self.__driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": context_id})
+        except WebDriverException as e:
+            logging.warning(f"Disposing browser context {context_id} failed: {e}")
+
+
+class TabPool:
+    """
+    Runs tests as tabs of shared browsers taken from `browser_pool`: up to `tabs_per_browser` tests
+    per browser and `max_browsers` browsers. Tabs get their own browser context (cookie jar) where
+    the driver allows it. `lease` blocks until a tab is free.
+    """
+
+    def __init__(self, browser_pool, tabs_per_browser=DEFAULT_TABS_PER_BROWSER, max_browsers=DEFAULT_MAX_BROWSERS,
+                 max_tabs_served=DEFAULT_MAX_TABS_SERVED):
+        self.__browser_pool = browser_pool
+        self.__tabs_per_browser = tabs_per_browser
+        self.__max_browsers = max_browsers
+        self.__max_tabs_served = max_tabs_served
+        self.__browsers = []
+        self.__opening = 0
+        self.__cond = threading.Condition()
+
+    def capacity(self):
+        return self.__tabs_per_browser * self.__max_browsers
+
+    @contextmanager
+    def lease(self, **spec_args):
+        browser = self.__acquire_browser(spec_args)
+        healthy = True
+        tab = None
+        try:
+            tab = browser.open_tab()
+            with browser.bind(tab) as driver:
+                yield driver
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self.__release_browser(browser, tab, healthy)
+
+    def stats(self):
+        with self.__cond:
+            return [{
+                "driver_type": json.loads(browser.key).get("driver_type"),
+                "tabs": browser.leases,
+                "max_tabs": browser.max_tabs,
+                "isolated_contexts": browser.is_isolated()
+            } for browser in self.__browsers]
+
+    def close(self):
+        with self.__cond:
+            browsers, self.__browsers = self.__browsers, []
+            self.__cond.notify_all()
+        for browser in browsers:
+            browser.detach()
+            self.__browser_pool.release(browser.pooled, healthy=False)
+
+    def __acquire_browser(self, spec_args):
+        key = json.dumps(spec_args, sort_keys=True)
+        with self.__cond:
+            while True:
+                browser = min((b for b in self.__browsers if b.key == key and b.healthy and
+                               b.served < self.__max_tabs_served and b.leases < b.max_tabs),
+                              key=lambda b: b.leases, default=None)
+                if browser is not None:
+                    browser.leases += 1
+                    return browser
+                if len(self.__browsers) + self.__opening < self.__max_browsers:
+                    self.__opening += 1
+                    break
+                if not self.__evict_idle():
+                    self.__cond.wait()
+
+        try:
+            pooled = self.__browser_pool.acquire(**spec_args)
+        except Exception:
+            with self.__cond:
+                self.__opening -= 1
+                self.__cond.notify_all()
+            raise
+        browser = TabbedBrowser(pooled, key, self.__tabs_per_browser)
+        browser.leases = 1
+        with self.__cond:
+            self.__opening -= 1
+            self.__browsers.append(browser)
+        return browser
+
+    def __release_browser(self, browser, tab, healthy):
+        if tab is not None:
+            try:
+                browser.close_tab(tab)
+            except Exception as e:
+                logging.warning(f"Closing tab failed: {e}")
+                healthy = False
+        with self.__cond:
+            browser.leases -= 1
+            browser.served += 1
+            browser.healthy = browser.healthy and healthy
+            retire = not browser.healthy or browser.served >= self.__max_tabs_served
+            to_release = retire and browser.leases == 0 and browser in self.__browsers
+            if to_release:
+                self.__browsers.remove(browser)
+            self.__cond.notify_all()
+        if to_release:
+            browser.detach()
+            self.__browser_pool.release(browser.pooled, healthy=browser.healthy)
+
+    def __evict_idle(self):
+        """ makes room for another driver type by returning an unused browser, called under the lock """
+        for browser in self.__browsers:
+            if browser.leases == 0:
+                self.__browsers.remove(browser)
+                threading.Thread(target=self.__return_to_pool, args=(browser,), daemon=True).start()
+                return True
+        return False
+
+    def __return_to_pool(self, browser):
+        browser.detach()
+        self.__browser_pool.release(browser.pooled)
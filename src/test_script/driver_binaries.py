@@ -0,0 +1,76 @@
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_FILE = Path.home() / ".wdm" / "namp_driver_binaries.json"
+
+
+class DriverBinaryCache:
+    """
+    Process-wide map of driver name to resolved driver binary path, persisted in a versioned json file
+    so webdriver_manager only has to run again when a cached binary is missing or fails to launch
+    """
+
+    VERSION = "version"
+    DRIVERS = "drivers"
+    PATH = "path"
+    RESOLVED_TIME = "resolved_time"
+
+    def __init__(self, installers, cache_file=DEFAULT_CACHE_FILE):
+        self.__installers = installers
+        self.__cache_file = Path(cache_file)
+        self.__lock = threading.Lock()
+        self.__entries = self.__load()
+
+    def resolve(self, name, refresh=False):
+        with self.__lock:
+            path = self.__entries.get(name, {}).get(DriverBinaryCache.PATH)
+            if refresh or path is None or not os.path.isfile(path):
+                path = self.__installers[name]()
+                self.__entries[name] = {
+                    DriverBinaryCache.PATH: path,
+                    DriverBinaryCache.RESOLVED_TIME: datetime.now().astimezone().isoformat()
+                }
+                self.__save()
+                logging.info(f"Resolved '{name}' driver binary: {path}")
+            return path
+
+    def launch(self, name, launcher):
+        path = self.resolve(name)
+        try:
+            return launcher(path)
+        except Exception as e:
+            logging.warning(f"Launching '{name}' with cached binary {path} failed, re-resolving: {e}")
+            fresh_path = self.resolve(name, refresh=True)
+            if fresh_path == path:
+                raise e
+            return launcher(fresh_path)
+
+    def __load(self):
+        try:
+            with open(self.__cache_file) as f:
+                content = json.load(f)
+            if content.get(DriverBinaryCache.VERSION) != CACHE_FORMAT_VERSION:
+                return {}
+            return {name: entry for name, entry in content.get(DriverBinaryCache.DRIVERS, {}).items()
+                    if isinstance(entry, dict) and entry.get(DriverBinaryCache.PATH)}
+        except (OSError, ValueError, AttributeError):
+            return {}
+
+    def __save(self):
+        content = {
+            DriverBinaryCache.VERSION: CACHE_FORMAT_VERSION,
+            DriverBinaryCache.DRIVERS: self.__entries
+        }
+        try:
+            self.__cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = self.__cache_file.with_suffix(".tmp")
+            with open(tmp_file, "w") as f:
+                json.dump(content, f, indent=2)
+            os.replace(tmp_file, self.__cache_file)
+        except OSError as e:
+            logging.warning(f"Unable to persist driver binary cache {self.__cache_file}: {e}")
@@ -0,0 +1,302 @@
+import asyncio
+import html
+import logging
+import re
+import socket
+import ssl
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urljoin
+
+from src.model.action import ActionResult
+from src.model.log.action_log import ActionLog
+from src.model.testcase import TestCase, TEST_ENGINE_SELENIUM
+
+DEFAULT_MAX_CONCURRENCY = 32
+DEFAULT_PROBE_TIMEOUT = 30  # 30 secs
+MAX_REDIRECTS = 10
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 2 * 1024 * 1024  # 2 MB, the title is near the top anyway
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+USER_AGENT = "Mozilla/5.0 (compatible; NAMP availability probe)"
+PROBE_METADATA = "probe"
+_TITLE_PATTERN = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+_CHARSET_PATTERN = re.compile(r"charset=[\"']?([\w.:-]+)", re.IGNORECASE)
+
+
+def _elapsed_ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def _insecure_ssl_context():
+    # same as the browsers' --ignore-certificate-errors, internal sites use their own CAs
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class ProbeResult:
+
+    def __init__(self, url):
+        self.url = url
+        self.final_url = url
+        self.start_time = datetime.now()
+        self.status = None
+        self.title = None
+        self.page_source = None
+        self.exception = None
+        self.redirects = 0
+        # summed over redirects
+        self.dns_ms = 0
+        self.connect_ms = 0
+        self.tls_ms = 0
+        self.ttfb_ms = 0
+        self.download_ms = 0
+        self.total_ms = 0
+
+    def is_available(self, expected_title=None):
+        """ no error status and, as in the browser's load_url check, the title contains `expected_title` """
+        if self.exception is not None or self.status is None or self.status >= 400:
+            return False
+        return expected_title is None or self.title is not None and expected_title.lower() in self.title.lower()
+
+    def timing(self):
+        return {
+            "url": self.final_url,
+            "status": self.status,
+            "redirects": self.redirects,
+            "dns_ms": round(self.dns_ms, 3),
+            "connect_ms": round(self.connect_ms, 3),
+            "tls_ms": round(self.tls_ms, 3),
+            "ttfb_ms": round(self.ttfb_ms, 3),
+            "download_ms": round(self.download_ms, 3),
+            "total_ms": round(self.total_ms, 3)
+        }
+
+
+def probe_test_case(probe, app_id, feature_id, title=None, region=None):
+    """ the probe as the logs WebDriverTestCase.load_url writes, with the timing breakdown in metadata """
+    test_case = TestCase(app_id, feature_id, TEST_ENGINE_SELENIUM, action_time=probe.start_time, region=region)
+    test_case.append_log(ActionLog("get_url", "get_url", probe.url, probe.start_time, probe.total_ms,
+                                   ActionResult.SUCCESS))
+    end_time = probe.start_time + timedelta(milliseconds=probe.total_ms)
+    if title is None:
+        test_case.append_log(ActionLog("get_url", "get_url", probe.url, end_time, 0, ActionResult.SUCCESS))
+    else:
+        test_case.append_log(ActionLog("get_url", "wait_title", title, end_time, 0, ActionResult.SUCCESS))
+    test_case.metadata = {PROBE_METADATA: probe.timing()}
+    return test_case
+
+
+class _ReaderProtocol(asyncio.StreamReaderProtocol):
+
+    # TLS is started on the plain connection, so the stream doesn't know it runs over ssl: keeping the
+    # transport half open on eof is not supported there, and responses end with the connection anyway
+    def eof_received(self):
+        super().eof_received()
+        return False
+
+
+async def probe_url(url, timeout=DEFAULT_PROBE_TIMEOUT, ssl_context=None):
+    """ GETs `url` following redirects, never raises: failures are kept in the result's exception """
+    result = ProbeResult(url)
+    ssl_context = ssl_context if ssl_context is not None else _insecure_ssl_context()
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(_follow(result, ssl_context), timeout)
+    except asyncio.TimeoutError:
+        result.exception = f"TimeoutException: {result.final_url} did not load in {timeout} seconds"
+    except Exception as e:
+        result.exception = str(traceback.format_exception_only(type(e), e))
+    result.total_ms = _elapsed_ms(start)
+    return result
+
+
+async def _follow(result, ssl_context):
+    url = result.url
+    while True:
+        status, headers, body = await _fetch(result, url, ssl_context)
+        location = headers.get("location")
+        if status in REDIRECT_STATUSES and location and result.redirects < MAX_REDIRECTS:
+            result.redirects += 1
+            url = urljoin(url, location)
+            result.final_url = url
+            continue
+        result.status = status
+        result.page_source = _decode(body, headers.get("content-type"))
+        match = _TITLE_PATTERN.search(result.page_source)
+        # whitespace collapsed as in document.title
+        result.title = " ".join(html.unescape(match.group(1)).split()) if match is not None else None
+        return
+
+
+async def _fetch(result, url, ssl_context):
+    loop = asyncio.get_running_loop()
+    parts = urlsplit(url)
+    https = parts.scheme == "https"
+    port = parts.port or (443 if https else 80)
+
+    start = time.perf_counter()
+    addresses = await loop.getaddrinfo(parts.hostname, port, type=socket.SOCK_STREAM)
+    result.dns_ms += _elapsed_ms(start)
+
+    reader = asyncio.StreamReader(limit=MAX_HEADER_BYTES)
+    protocol = _ReaderProtocol(reader)
+    start = time.perf_counter()
+    transport = await _connect(loop, protocol, addresses)
+    result.connect_ms += _elapsed_ms(start)
+    try:
+        if https:
+            # the handshake on its own, so TLS time isn't hidden in the connect time
+            start = time.perf_counter()
+            transport = await loop.start_tls(transport, protocol, ssl_context, server_hostname=parts.hostname)
+            result.tls_ms += _elapsed_ms(start)
+        writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        writer.write((f"GET {path} HTTP/1.1\r\n"
+                      f"Host: {parts.netloc.rsplit('@', 1)[-1]}\r\n"
+                      f"User-Agent: {USER_AGENT}\r\n"
+                      "Accept: text/html,application/xhtml+xml,*/*\r\n"
+                      "Accept-Encoding: identity\r\n"
+                      "Connection: close\r\n\r\n").encode("latin-1"))
+
+        start = time.perf_counter()
+        status, headers = _parse_head(await reader.readuntil(b"\r\n\r\n"))
+        result.ttfb_ms += _elapsed_ms(start)
+        start = time.perf_counter()
+        body = await _read_body(reader, status, headers)
+        result.download_ms += _elapsed_ms(start)
+        return status, headers, body
+    finally:
+        transport.close()
+
+
+async def _connect(loop, protocol, addresses):
+    error = None
+    for family, _, _, _, address in addresses:
+        try:
+            transport, _ = await loop.create_connection(lambda: protocol, address[0], address[1], family=family)
+            return transport
+        except OSError as e:
+            error = e
+    raise error if error is not None else OSError("no address to connect to")
+
+
+def _parse_head(head):
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+
+async def _read_body(reader, status, headers):
+    if status < 200 or status in (204, 304):
+        return b""
+    body = bytearray()
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        while len(body) < MAX_BODY_BYTES:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                break
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        return bytes(body)
+    remaining = int(headers["content-length"]) if "content-length" in headers else MAX_BODY_BYTES
+    remaining = min(remaining, MAX_BODY_BYTES)
+    while remaining > 0:
+        chunk = await reader.read(min(remaining, 64 * 1024))
+        if not chunk:
+            break
+        body += chunk
+        remaining -= len(chunk)
+    return bytes(body)
+
+
+def _decode(body, content_type):
+    match = _CHARSET_PATTERN.search(content_type or "")
+    try:
+        return body.decode(match.group(1) if match is not None else "utf-8", errors="replace")
+    except LookupError:
+        return body.decode("utf-8", errors="replace")
+
+
+class ProbeEngine:
+    """
+    Runs availability probes on one asyncio loop in a background thread, up to `max_concurrency` at once.
+    `submit` can be called from any thread and returns a concurrent.futures.Future of the ProbeResult;
+    the loop starts with the first probe.
+    """
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=DEFAULT_PROBE_TIMEOUT):
+        self.__max_concurrency = max_concurrency
+        self.__timeout = timeout
+        self.__ssl_context = _insecure_ssl_context()
+        self.__loop = None
+        self.__thread = None
+        self.__semaphore = None
+        self.__lock = threading.Lock()
+        self.__stats = {"probed": 0, "available": 0, "escalated": 0}
+
+    def submit(self, url, title=None):
+        return asyncio.run_coroutine_threadsafe(self.__probe(url, title), self.__ensure_started())
+
+    def probe_many(self, urls):
+        futures = [self.submit(url) for url in urls]
+        return [future.result() for future in futures]
+
+    # a probe not conclusive enough, the script went on with a browser
+    def escalated(self):
+        with self.__lock:
+            self.__stats["escalated"] += 1
+
+    def stats(self, reset=False):
+        with self.__lock:
+            stats = dict(self.__stats)
+            if reset:
+                self.__stats = dict.fromkeys(self.__stats, 0)
+        return stats
+
+    def close(self, timeout=10):
+        with self.__lock:
+            loop, self.__loop = self.__loop, None
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            self.__thread.join(timeout)
+
+    async def __probe(self, url, title):
+        async with self.__semaphore:
+            result = await probe_url(url, self.__timeout, self.__ssl_context)
+        with self.__lock:
+            self.__stats["probed"] += 1
+            self.__stats["available"] += 1 if result.is_available(title) else 0
+        return result
+
+    def __ensure_started(self):
+        with self.__lock:
+            if self.__loop is None:
+                ready = threading.Event()
+                self.__thread = threading.Thread(target=self.__run_loop, args=(ready,), name="probe_engine",
+                                                 daemon=True)
+                self.__thread.start()
+                ready.wait()
+            return self.__loop
+
+    def __run_loop(self, ready):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.__semaphore = asyncio.Semaphore(self.__max_concurrency)
+        self.__loop = loop
+        ready.set()
+        try:
+            loop.run_forever()
+        except Exception as e:
+            logging.error(f"Probe loop stopped: {e}")
+        finally:
+            loop.close()
@@ -1,25 +1,30 @@
 import os
 import json
+import threading
+from collections import namedtuple
 
 from src.test_script.script_utils import PageSourceOption
 from src.test_script.script_test import AvailabilityTestScript
 from src.test_script.scripts.nampgui import NAMPTestScript
 
+AT_FILE = os.path.dirname(os.path.abspath(__file__)) + "/am_tests.json"
 
-def get_all_scripts():
-    # Initialize
-    scripts = [
-        NAMPTestScript()
+# how to build the script of a feature, nothing is constructed until the feature is scheduled
+ScriptSpec = namedtuple("ScriptSpec", ["feature_id", "factory", "args"])
+
+
+def _script_specs():
+    specs = [
+        ScriptSpec(NAMPTestScript.FEATURE_ID, NAMPTestScript, ())
     ]
 
-    list_scripts = [
+    list_specs = [
 
     ]
-    for ls in list_scripts:
-        scripts.extend(ls)
+    for ls in list_specs:
+        specs.extend(ls)
 
-    at_file = os.path.dirname(os.path.abspath(__file__)) + "/am_tests.json"
-    with open(at_file) as f:
+    with open(AT_FILE) as f:
         at_content = json.load(f)
     at_content = at_content["tests"]
 
@@ -27,35 +32,75 @@ def get_all_scripts():
         links = service["urls"]
         app_id = service["service_name"]
         for link_obj in links:
-            scripts.append(create_test_script(app_id, link_obj))
+            specs.append(ScriptSpec(avail_feature_id(app_id, link_obj["url"]), create_test_script, (app_id, link_obj)))
+
+    return specs
+
+
+def avail_feature_id(app_id, url):
+    return f"{app_id}|avail|{url}"
+
 
-    return scripts
+def get_all_scripts():
+    return [get_test_script(spec.feature_id) for spec in __REGISTRY.specs()]
 
 
 def create_test_script(app_id, json_obj):
     url = json_obj["url"]
     title = json_obj.get("title")
-    feature_id = f"{app_id}|avail|{url}"
+    feature_id = avail_feature_id(app_id, url)
     driver_type = json_obj.get("driver_type")
     driver_opts = json_obj.get("driver_options")
     timeout = json_obj.get("timeout")
     page_source_opt = json_obj.get("page_source_opt")
+    # checks the availability probe can't see in the raw html, the browser always runs them
+    requires_js = json_obj.get("requires_js", False)
 
     if driver_type is None:
 
         return AvailabilityTestScript(app_id, feature_id, url, title=title, driver_opts=driver_opts,
-                                      timeout=timeout, page_source_opt=page_source_opt)
+                                      timeout=timeout, page_source_opt=page_source_opt, requires_js=requires_js)
     else:
         return AvailabilityTestScript(app_id, feature_id, url, title=title,
                                       driver_type=driver_type, driver_opts=driver_opts,
-                                      timeout=timeout, page_source_opt=page_source_opt)
+                                      timeout=timeout, page_source_opt=page_source_opt, requires_js=requires_js)
+
+
+class _ScriptRegistry:
+    """
+    Feature id -> ScriptSpec index, read on the first lookup. A script is built the first time its
+    feature is looked up and reused afterwards, so only the features scheduled in this region are built.
+    """
+
+    def __init__(self, load_specs):
+        self.__load_specs = load_specs
+        self.__specs = None
+        self.__scripts = {}
+        self.__lock = threading.Lock()
+
+    def specs(self):
+        with self.__lock:
+            return list(self.__index().values())
+
+    def get(self, feature_id):
+        with self.__lock:
+            ts = self.__scripts.get(feature_id)
+            if ts is None:
+                spec = self.__index().get(feature_id)
+                if spec is None:
+                    return None
+                ts = spec.factory(*spec.args)
+                self.__scripts[feature_id] = ts
+            return ts
+
+    def __index(self):
+        if self.__specs is None:
+            self.__specs = {spec.feature_id: spec for spec in self.__load_specs()}
+        return self.__specs
 
 
-__ALL_SCRIPTS = get_all_scripts()
-__FID_TO_SCRIPT = {}
-for ts in __ALL_SCRIPTS:
-    __FID_TO_SCRIPT[ts.get_feature_id()] = ts
+__REGISTRY = _ScriptRegistry(_script_specs)
 
 
 def get_test_script(feature_id):
-    return __FID_TO_SCRIPT.get(feature_id)
+    return __REGISTRY.get(feature_id)
@@ -14,7 +14,9 @@ from webdriver_manager.firefox import GeckoDriverManager
 from webdriver_manager.microsoft import EdgeChromiumDriverManager, IEDriverManager
 
 from src.model.testcase import WebDriverTestCase, ConsoleRemoteTestCase, TCTestCase
-from src.client.testing_client import request_cred, Credential
+from src.client.testing_client import request_cred
+from src.test_script.driver_binaries import DriverBinaryCache
+from src.test_script.probe_engine import probe_test_case, PROBE_METADATA
 from src.test_script.script_utils import ScreenshotsOption as ScrOpt, PageSourceOption
 
 MAX_DRIVER_INIT_TRIES = 3
@@ -39,6 +41,22 @@ class DriverType:
     }
 
 
+def _install_edge_driver():
+    try:
+        return EdgeChromiumDriverManager().install()
+    except ValueError:
+        return EdgeChromiumDriverManager(version=win_edge_retry()).install()
+
+
+# resolved once per process (and persisted), re-resolved only when a driver fails to launch
+DRIVER_BINARIES = DriverBinaryCache({
+    DriverType.EDGE: _install_edge_driver,
+    DriverType.CHROME: lambda: ChromeDriverManager().install(),
+    DriverType.FIREFOX: lambda: GeckoDriverManager().install(),
+    DriverType.IE: lambda: IEDriverManager().install()
+})
+
+
 def get_driver(tries=0, headless=False, driver_type=DriverType.DEFAULT, proxy_addr=None, additional_opts=None):
     try:
         if proxy_addr is not None:
@@ -72,10 +90,10 @@ def get_internet_explorer(headless=True):
     caps["se:ieOptions"]['ie.browserCommandLineSwitches'] = '-private'
     # caps["se:ieOptions"]["ie.ensureCleanSession"] = True
 
-    return webdriver.Ie(
-        executable_path=IEDriverManager().install(),
+    return DRIVER_BINARIES.launch(DriverType.IE, lambda driver_path: webdriver.Ie(
+        executable_path=driver_path,
         capabilities=caps
-    )
+    ))
 
 
 def get_edge_driver(headless=True, incognito=True, additional_opts=None):
@@ -98,16 +116,10 @@ def get_edge_driver(headless=True, incognito=True, additional_opts=None):
 
     add_chromium_opts(edge_options, additional_opts)
     from msedge.selenium_tools.webdriver import WebDriver as Edge
-    try:
-        return Edge(
-            executable_path=EdgeChromiumDriverManager().install(),
-            options=edge_options,
-            desired_capabilities=DesiredCapabilities.EDGE)
-    except ValueError:
-        return Edge(
-            executable_path=EdgeChromiumDriverManager(version=win_edge_retry()).install(),
-            options=edge_options,
-            desired_capabilities=DesiredCapabilities.EDGE)
+    return DRIVER_BINARIES.launch(DriverType.EDGE, lambda driver_path: Edge(
+        executable_path=driver_path,
+        options=edge_options,
+        desired_capabilities=DesiredCapabilities.EDGE))
 
 
 def get_chrome_driver(headless=True, incognito=True, user_data_dir=None, additional_opts=None):
@@ -121,10 +133,10 @@ def get_chrome_driver(headless=True, incognito=True, user_data_dir=None, additio
 
     add_chromium_opts(chrome_options, additional_opts)
 
-    return webdriver.Chrome(
-        executable_path=ChromeDriverManager().install(),
+    return DRIVER_BINARIES.launch(DriverType.CHROME, lambda driver_path: webdriver.Chrome(
+        executable_path=driver_path,
         options=chrome_options,
-        desired_capabilities=DesiredCapabilities.CHROME)
+        desired_capabilities=DesiredCapabilities.CHROME))
 
 
 def win_edge_retry():
@@ -184,14 +196,23 @@ def get_firefox_driver(headless=True, incognito=True, proxy=None, additional_opt
     if headless:
         options.headless = headless
 
-    driver = webdriver.Firefox(
-        executable_path=GeckoDriverManager().install(),
+    driver = DRIVER_BINARIES.launch(DriverType.FIREFOX, lambda driver_path: webdriver.Firefox(
+        executable_path=driver_path,
         options=options,
-        firefox_profile=firefox_profile, proxy=proxy)
+        firefox_profile=firefox_profile, proxy=proxy))
     driver.maximize_window()
     return driver
 
 
+# chromium drivers capture the full page through DevTools, without resizing the window under test
+_DEFAULT_SCREENSHOTS_OPTIONS = {
+    DriverType.DEFAULT: ScrOpt.FULL_PAGE_DEFAULT,
+    DriverType.EDGE: ScrOpt.FULL_PAGE_DEFAULT,
+    DriverType.CHROME: ScrOpt.FULL_PAGE_DEFAULT,
+    DriverType.FIREFOX: ScrOpt.NO_RESIZE_DEFAULT
+}
+
+
 class WebDriverTestScript(ABC):
 
     def __init__(self, app_id, feature_id, timeout=DEFAULT_TIMEOUT,
@@ -217,7 +238,7 @@ class WebDriverTestScript(ABC):
 
     def set_screenshot_option(self, screenshots_opt):
         if screenshots_opt is None:
-            self.__scr_opt = ScrOpt.NO_RESIZE_DEFAULT if self.__driver_type == DriverType.FIREFOX else ScrOpt.DEFAULT
+            self.__scr_opt = _DEFAULT_SCREENSHOTS_OPTIONS.get(self.__driver_type, ScrOpt.DEFAULT)
         else:
             self.__scr_opt = screenshots_opt
 
@@ -227,11 +248,23 @@ class WebDriverTestScript(ABC):
         else:
             self.__ps_opt = page_source_opt
 
-    def execute(self, driver=None, close_driver=False, region=None, hard_timeout=None):
+    def get_driver_spec(self):
+        return {
+            "driver_type": self.__driver_type,
+            "headless": False if self.__headless is None else self.__headless,
+            "proxy_addr": self.__proxy_addr,
+            "additional_opts": self.__driver_opts
+        }
+
+    def execute(self, driver=None, close_driver=False, region=None, hard_timeout=None, driver_pool=None):
         print(f"headless? {self.__headless}")
         print(f"Driver? {driver}")
 
-        if driver is None:
+        pooled = None
+        if driver is None and driver_pool is not None:
+            pooled = driver_pool.acquire(**self.get_driver_spec())
+            driver = pooled.driver
+        elif driver is None:
             if self.__headless is None:
                 driver = get_driver(driver_type=self.__driver_type, proxy_addr=self.__proxy_addr,
                                     additional_opts=self.__driver_opts)
@@ -256,7 +289,9 @@ class WebDriverTestScript(ABC):
             logger.fatal("[FATAL] some error was not handled: %s" % e)
             traceback.print_exc()
         finally:
-            if close_driver:
+            if pooled is not None:
+                driver_pool.release(pooled)
+            elif close_driver:
                 driver.quit()
             return wb_test_case
 
@@ -268,7 +303,7 @@ class WebDriverTestScript(ABC):
 class AvailabilityTestScript(WebDriverTestScript):
 
     def __init__(self, app_id, feature_id, url, title=None, driver_type=DriverType.DEFAULT, driver_opts=None,
-                 timeout=None, page_source_opt=None):
+                 timeout=None, page_source_opt=None, requires_js=False):
         if timeout is not None:
             super().__init__(app_id, feature_id, driver_type=driver_type, driver_opts=driver_opts, timeout=timeout,
                              page_source_opt=page_source_opt)
@@ -281,16 +316,36 @@ class AvailabilityTestScript(WebDriverTestScript):
 
         self.__url = url
         self.__title = title
+        self.__requires_js = requires_js
 
     def execute_impl(self, driver, wb_test_case):
         wb_test_case.load_url(self.__url, title=self.__title)
 
+    def probe_execute(self, probe_engine, region=None, driver_pool=None):
+        """
+        HTTP probe first, the browser only runs when the page needs javascript or the probe didn't
+        find it up, so failures are still decided by a browser
+        """
+        if self.__requires_js:
+            return self.execute(region=region, driver_pool=driver_pool)
+
+        probe = probe_engine.submit(self.__url, self.__title).result()
+        if probe.is_available(self.__title):
+            return probe_test_case(probe, self._app_id, self._feature_id, title=self.__title, region=region)
+
+        logger.info(f"Probe of '{self._feature_id}' not conclusive (status {probe.status}, title {probe.title!r}, "
+                    f"{probe.exception}), loading it in a browser")
+        probe_engine.escalated()
+        wb_test_case = self.execute(region=region, driver_pool=driver_pool)
+        wb_test_case.metadata = {PROBE_METADATA: probe.timing()}
+        return wb_test_case
+
 
 class LoginTestScript(ABC):
 
+    # the credential is requested when the script first logs in, not when it is built
     def __init__(self, app_id, feature_id):
         self.__feature_id = feature_id
-        self.__cred = request_cred(feature_id)
 
     @property
     def _cred(self):
@@ -410,7 +465,6 @@ class TCLoginTestScript(ABC):
 
     def __init__(self, app_id, feature_id):
         self.__feature_id = feature_id
-        self.__cred = request_cred(feature_id, cred_type=Credential.Type.SIMPLE)
 
     @property
     def _cred(self):
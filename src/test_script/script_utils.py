@@ -1,7 +1,8 @@
 import json
 import logging
-import time
+import threading
 import os
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 from selenium.webdriver.common.by import By
@@ -14,6 +15,10 @@ EC_CHECK_BODY = EC.presence_of_element_located((By.TAG_NAME, "body"))
 DRIVER_TEMP_DIR_EXPIRING_TIME = 6  # 6 hours
 __MAX_SCREENSHOT_TRIES = 3
 __MAX_PAGE_SOURCE_TRIES = 3
+SCREENSHOT_ENCODING_WORKERS = 2
+SCREENSHOT_ENCODING_TIMEOUT = 60  # 60 secs
+JPEG_QUALITY = 40
+MAX_STITCHED_TILES = 10
 
 
 def sso_check_password(wb_test_case):
@@ -136,15 +141,14 @@ def sp_sf_cookie(driver, wb_test_case):
         wb_test_case.driver_actions("accept_cookie",
                                     lambda d: driver.find_element(By.XPATH, "//button[text()='Acknowledge']").click(),
                                     action_group="sf_cookie_acknowledge")
-        time.sleep(3)
+        wb_test_case.wait_until_settled(3)
     else:
         pass
 
 
 def skip_login_alert(driver, cred, wb_test_case, delay=0, url=None):
     if delay > 0:
-        import time
-        time.sleep(delay)
+        wb_test_case.wait_until_settled(delay)
     import urllib.parse
     if url is None:
         cur_url = driver.current_url
@@ -158,8 +162,7 @@ def skip_login_alert(driver, cred, wb_test_case, delay=0, url=None):
 
 def skip_login_window(driver, cred, wb_test_case, delay=0, url=None):
     if delay > 0:
-        import time
-        time.sleep(delay)
+        wb_test_case.wait_until_settled(delay)
     import urllib.parse
     if url is None:
         cur_url = driver.current_url
@@ -218,25 +221,93 @@ class ScreenshotsOption:
     NO_RESIZE_ON_FAILURE = "no_resize_don_failure"
     NO_RESIZE_ALL = "no_resize_dall"
 
+    # full page without resizing the window: DevTools capture on chromium, scroll and stitch otherwise
+    FULL_PAGE_DEFAULT = "full_page_default"
+    FULL_PAGE_ON_FAILURE = "full_page_on_failure"
+    FULL_PAGE_ALL = "full_page_all"
+
 
 class PageSourceOption:
     DEFAULT = "default"
     ON = 'turn_on'
 
 
-def __base64png2base64jpg(png_base64):
+def png2base64jpg(png_bytes):
     from PIL import Image
     import io
     import base64
-    png_bytes = base64.b64decode(png_base64)
     png = Image.open(io.BytesIO(png_bytes))
     png = png.convert("RGB")
     jpg_bytes = io.BytesIO()
-    png.save(jpg_bytes, "JPEG", quality=40, optimize=True)
+    png.save(jpg_bytes, "JPEG", quality=JPEG_QUALITY, optimize=True)
     b64 = base64.b64encode(jpg_bytes.getvalue()).decode('ascii')
     return b64
 
 
+# tiles are (scroll_y, png_bytes) captured at `viewport_width` css pixels, in scroll order
+def stitch_tiles2base64jpg(tiles, viewport_width, page_height):
+    from PIL import Image
+    import io
+    import base64
+    images = [(scroll_y, Image.open(io.BytesIO(png_bytes)).convert("RGB")) for scroll_y, png_bytes in tiles]
+    # screenshots are in device pixels
+    scale = images[0][1].width / viewport_width
+    page = Image.new("RGB", (images[0][1].width, int(page_height * scale)))
+    for scroll_y, image in images:
+        page.paste(image, (0, int(scroll_y * scale)))
+    jpg_bytes = io.BytesIO()
+    page.save(jpg_bytes, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    return base64.b64encode(jpg_bytes.getvalue()).decode('ascii')
+
+
+_encoder_pool = None
+_encoder_pool_lock = threading.Lock()
+
+
+def _get_encoder_pool():
+    global _encoder_pool
+    with _encoder_pool_lock:
+        if _encoder_pool is None:
+            _encoder_pool = ProcessPoolExecutor(max_workers=SCREENSHOT_ENCODING_WORKERS)
+        return _encoder_pool
+
+
+class PendingScreenshot:
+    """
+    Raw PNG captured on the test thread; decoding and JPEG encoding run in a background process
+    and the base64 JPEG is only awaited when the action log is serialized
+    """
+
+    def __init__(self, encoder, *encoder_args):
+        self.__encoder = encoder
+        self.__encoder_args = encoder_args
+        self.__value = None
+        try:
+            self.__future = _get_encoder_pool().submit(encoder, *encoder_args)
+        except Exception as e:
+            logging.warning(f"Screenshot encoder pool unavailable, encoding on serialization: {e}")
+            self.__future = None
+
+    def result(self, timeout=SCREENSHOT_ENCODING_TIMEOUT):
+        if self.__encoder is None:
+            return self.__value
+        try:
+            if self.__future is None:
+                raise RuntimeError("not submitted")
+            self.__value = self.__future.result(timeout)
+        except Exception as e:
+            logging.warning(f"Background screenshot encoding failed, encoding inline: {e}")
+            try:
+                self.__value = self.__encoder(*self.__encoder_args)
+            except Exception as inline_error:
+                logging.error(f"Error encoding screenshot: {inline_error}")
+                self.__value = None
+        self.__encoder = None
+        self.__encoder_args = None
+        self.__future = None
+        return self.__value
+
+
 def set_maximize_by_page(driver):
     from selenium.common.exceptions import JavascriptException
     try:
@@ -247,15 +318,104 @@ def set_maximize_by_page(driver):
         pass
 
 
+def capture_full_page(driver):
+    import base64
+    # chromium drivers (edge, chrome) expose the DevTools protocol
+    if getattr(driver, "execute_cdp_cmd", None) is not None:
+        try:
+            metrics = driver.execute_cdp_cmd("Page.getLayoutMetrics", {})
+            content = metrics.get("cssContentSize", metrics.get("contentSize"))
+            scr = driver.execute_cdp_cmd("Page.captureScreenshot", {
+                "format": "png",
+                "captureBeyondViewport": True,
+                "clip": {"x": 0, "y": 0, "width": content["width"], "height": content["height"], "scale": 1}
+            })
+            return PendingScreenshot(png2base64jpg, base64.b64decode(scr["data"]))
+        except Exception as e:
+            logging.info(f"DevTools full page screenshot failed, falling back to stitching: {e}")
+    return __capture_stitched(driver)
+
+
+def __capture_stitched(driver):
+    viewport_width, viewport_height, page_height, original_y = driver.execute_script(
+        "var e = document.documentElement;"
+        "return [e.clientWidth, e.clientHeight, Math.max(e.scrollHeight, document.body.scrollHeight),"
+        " window.pageYOffset];")
+    tiles = []
+    target_y = 0
+    try:
+        while target_y < page_height and len(tiles) < MAX_STITCHED_TILES:
+            scroll_y = driver.execute_script("window.scrollTo(0, arguments[0]); return window.pageYOffset;", target_y)
+            tiles.append((scroll_y, driver.get_screenshot_as_png()))
+            # clamped at the bottom of the page
+            if scroll_y < target_y:
+                break
+            target_y += viewport_height
+    finally:
+        driver.execute_script("window.scrollTo(0, arguments[0]);", original_y)
+    captured_height = min(page_height, tiles[-1][0] + viewport_height)
+    return PendingScreenshot(stitch_tiles2base64jpg, tiles, viewport_width, captured_height)
+
+
+# navigation and resource timing of the current page in one round trip, keys are those of MetricsJson
+_PAGE_TIMING_SCRIPT = """
+var maxResources = arguments[0], maxNameLength = arguments[1];
+var nav = performance.getEntriesByType ? performance.getEntriesByType('navigation')[0] : null;
+if (!nav) { return null; }
+function span(start, end) { return start > 0 && end >= start ? end - start : null; }
+var resources = performance.getEntriesByType('resource');
+var byType = {}, transferSize = 0;
+for (var i = 0; i < resources.length; i++) {
+  var r = resources[i], t = byType[r.initiatorType] || (byType[r.initiatorType] = {count: 0, transfer_size: 0});
+  t.count += 1;
+  t.transfer_size += r.transferSize || 0;
+  transferSize += r.transferSize || 0;
+}
+var largest = resources.slice().sort(function (a, b) {
+  return (b.transferSize || 0) - (a.transferSize || 0) || b.duration - a.duration;
+}).slice(0, maxResources).map(function (r) {
+  return {name: r.name.substring(0, maxNameLength), initiator_type: r.initiatorType, start_ms: r.startTime,
+          duration_ms: r.duration, transfer_size: r.transferSize || 0};
+});
+return {
+  url: nav.name, navigation_type: nav.type,
+  redirect_ms: span(nav.redirectStart, nav.redirectEnd),
+  dns_ms: span(nav.domainLookupStart, nav.domainLookupEnd),
+  connect_ms: span(nav.connectStart, nav.connectEnd),
+  tls_ms: span(nav.secureConnectionStart, nav.connectEnd),
+  ttfb_ms: span(nav.requestStart, nav.responseStart),
+  response_ms: span(nav.responseStart, nav.responseEnd),
+  dom_content_loaded_ms: nav.domContentLoadedEventEnd || null,
+  load_ms: nav.loadEventEnd || null,
+  transfer_size: nav.transferSize || 0,
+  resource_count: resources.length, resource_transfer_size: transferSize,
+  resources_by_type: byType, largest_resources: largest
+};
+"""
+MAX_TIMED_RESOURCES = 10
+MAX_RESOURCE_NAME_LENGTH = 300
+
+
+def try_capture_page_timing(driver):
+    """ None when the browser has no navigation timing or the page is gone, it's not an application failure """
+    try:
+        return driver.execute_script(_PAGE_TIMING_SCRIPT, MAX_TIMED_RESOURCES, MAX_RESOURCE_NAME_LENGTH)
+    except Exception as e:
+        logging.info(f"Capturing page timing failed: {e}")
+        return None
+
+
 def try_screenshots(screenshots_opt, driver, result, tries=0):
     from src.model.action import ActionResult
     import traceback
-    if screenshots_opt in [ScreenshotsOption.ALL, ScreenshotsOption.NO_RESIZE_ALL] or \
+    if screenshots_opt in [ScreenshotsOption.ALL, ScreenshotsOption.NO_RESIZE_ALL, ScreenshotsOption.FULL_PAGE_ALL] or \
             (result != ActionResult.SUCCESS and (screenshots_opt in [
                 ScreenshotsOption.ON_FAILURE,
                 ScreenshotsOption.NO_RESIZE_ON_FAILURE,
+                ScreenshotsOption.FULL_PAGE_ON_FAILURE,
                 ScreenshotsOption.DEFAULT,
-                ScreenshotsOption.NO_RESIZE_DEFAULT
+                ScreenshotsOption.NO_RESIZE_DEFAULT,
+                ScreenshotsOption.FULL_PAGE_DEFAULT
             ])):
 
         # last try then stop every scripts before taking screenshot
@@ -264,18 +424,24 @@ def try_screenshots(screenshots_opt, driver, result, tries=0):
             driver.execute_script("return window.stop")
 
         try:
-            if screenshots_opt not in [
+            if screenshots_opt in [
+                ScreenshotsOption.FULL_PAGE_DEFAULT,
+                ScreenshotsOption.FULL_PAGE_ALL,
+                ScreenshotsOption.FULL_PAGE_ON_FAILURE
+            ]:
+                return capture_full_page(driver)
+            elif screenshots_opt not in [
                 ScreenshotsOption.NO_RESIZE_DEFAULT,
                 ScreenshotsOption.NO_RESIZE_ALL,
                 ScreenshotsOption.NO_RESIZE_ON_FAILURE
             ]:
                 original_size = driver.get_window_size()
                 set_maximize_by_page(driver)
-                scr = driver.get_screenshot_as_base64()
+                scr = driver.get_screenshot_as_png()
                 driver.set_window_size(original_size['width'], original_size['height'])
             else:
-                scr = driver.get_screenshot_as_base64()
-            return __base64png2base64jpg(scr)
+                scr = driver.get_screenshot_as_png()
+            return PendingScreenshot(png2base64jpg, scr)
         except Exception as e:
             if tries >= __MAX_SCREENSHOT_TRIES:
                 # it's not an application failure
@@ -16,13 +16,14 @@ __URLS = ["https://namp.ext.net.nokia.com/login"]
 
 
 class NAMPTestScript(LoginTestScript, WebDriverTestScript):
+    APP_ID = "NAMP"
+    URL = "https://namp.ext.net.nokia.com/login"
+    FEATURE_ID = APP_ID + "|avail|" + URL
 
     def __init__(self):
-        self.__url = "https://namp.ext.net.nokia.com/login"
-        app_id = "NAMP"
-        feature_id = app_id + "|avail|" + self.__url
-        LoginTestScript.__init__(self, app_id, feature_id)
-        WebDriverTestScript.__init__(self, app_id, feature_id, timeout=25)
+        self.__url = self.URL
+        LoginTestScript.__init__(self, self.APP_ID, self.FEATURE_ID)
+        WebDriverTestScript.__init__(self, self.APP_ID, self.FEATURE_ID, timeout=25)
         # print(self._cred.username())
 
     def execute_impl(self, driver, wb_test_case):
@@ -0,0 +1,173 @@
+import time
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+
+from src.test_script.script_utils import invert_expected_condition
+
+MIN_POLL_INTERVAL = 0.05  # 50 ms
+MAX_POLL_INTERVAL = 1  # 1 sec
+POLL_BACKOFF = 1.5
+NETWORK_QUIET_TIME = 0.5  # 500 ms
+
+# readyState and ms since the last resource finished loading
+_SETTLED_SCRIPT = """
+var entries = performance.getEntriesByType ? performance.getEntriesByType('resource') : [], last = 0;
+for (var i = 0; i < entries.length; i++) { last = Math.max(last, entries[i].responseEnd); }
+return [document.readyState, performance.now() - last];
+"""
+
+# evaluates the translated conditions in priority order and returns the first satisfied index, -1 if none
+_PROBE_SCRIPT = """
+var specs = arguments[0], allowInvert = arguments[1];
+function find(by, value) {
+  switch (by) {
+    case 'id': return document.getElementById(value);
+    case 'name': return document.getElementsByName(value)[0] || null;
+    case 'class name': return document.getElementsByClassName(value)[0] || null;
+    case 'tag name': return document.getElementsByTagName(value)[0] || null;
+    case 'css selector': return document.querySelector(value);
+    case 'xpath':
+      return document.evaluate(value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    case 'link text':
+    case 'partial link text':
+      var links = document.getElementsByTagName('a');
+      for (var i = 0; i < links.length; i++) {
+        var text = (links[i].innerText || '').trim();
+        if (by === 'link text' ? text === value : text.indexOf(value) >= 0) return links[i];
+      }
+      return null;
+  }
+  throw new Error('unsupported locator ' + by);
+}
+function visible(el) {
+  var style = window.getComputedStyle(el);
+  if (style.visibility === 'hidden' || style.display === 'none' || style.opacity === '0') return false;
+  return el.offsetWidth > 0 || el.offsetHeight > 0 || el.getClientRects().length > 0;
+}
+function check(spec) {
+  switch (spec.kind) {
+    case 'title_is': return document.title === spec.value;
+    case 'title_contains': return document.title.indexOf(spec.value) >= 0;
+    case 'url_contains': return window.location.href.indexOf(spec.value) >= 0;
+  }
+  var el = find(spec.by, spec.value);
+  if (el === null) return false;
+  if (spec.kind === 'presence') return true;
+  if (spec.kind === 'visibility') return visible(el);
+  return visible(el) && !el.disabled;
+}
+for (var i = 0; i < specs.length; i++) {
+  var spec = specs[i];
+  if (spec.invert && !allowInvert) continue;
+  var satisfied;
+  try { satisfied = check(spec); } catch (e) { satisfied = false; }
+  if (spec.invert ? !satisfied : satisfied) return i;
+}
+return -1;
+"""
+
+_LOCATOR_KINDS = {
+    "presence_of_element_located": "presence",
+    "visibility_of_element_located": "visibility",
+    "element_to_be_clickable": "clickable"
+}
+_LOCATOR_BYS = {By.ID, By.NAME, By.CLASS_NAME, By.TAG_NAME, By.CSS_SELECTOR, By.XPATH, By.LINK_TEXT,
+                By.PARTIAL_LINK_TEXT}
+
+
+class AdaptivePoller:
+
+    def __init__(self, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL, backoff=POLL_BACKOFF):
+        self.__interval = min_interval
+        self.__max_interval = max_interval
+        self.__backoff = backoff
+
+    def sleep(self, end_time):
+        remaining = end_time - time.monotonic()
+        if remaining > 0:
+            time.sleep(min(self.__interval, remaining))
+        self.__interval = min(self.__max_interval, self.__interval * self.__backoff)
+
+
+def poll_until(probe, timeout, exception_factory):
+    end_time = time.monotonic() + timeout
+    poller = AdaptivePoller()
+    while True:
+        ret = probe()
+        if ret is not None:
+            return ret
+        if time.monotonic() >= end_time:
+            raise exception_factory()
+        poller.sleep(end_time)
+
+
+def wait_until_settled(driver, timeout, quiet_time=NETWORK_QUIET_TIME):
+    """
+    Waits until the document is complete and no resource finished loading for `quiet_time`, at most
+    `timeout`. Returns False if the page is still busy then, that is left to the next action to judge.
+    """
+    end_time = time.monotonic() + timeout
+    poller = AdaptivePoller()
+    while True:
+        try:
+            ready_state, idle_ms = driver.execute_script(_SETTLED_SCRIPT)
+            if ready_state == "complete" and idle_ms >= quiet_time * 1000:
+                return True
+        except (WebDriverException, TypeError):
+            # page is navigating
+            pass
+        if time.monotonic() >= end_time:
+            return False
+        poller.sleep(end_time)
+
+
+def to_probe_spec(condition):
+    invert = isinstance(condition, invert_expected_condition)
+    ec = condition.ec if invert else condition
+    name = type(ec).__name__
+    if name in ["title_is", "title_contains"] and isinstance(getattr(ec, "title", None), str):
+        return {"kind": name, "value": ec.title, "invert": invert}
+    if name == "url_contains" and isinstance(getattr(ec, "url", None), str):
+        return {"kind": name, "value": ec.url, "invert": invert}
+    locator = getattr(ec, "locator", None)
+    if name in _LOCATOR_KINDS and isinstance(locator, tuple) and locator[0] in _LOCATOR_BYS:
+        return {"kind": _LOCATOR_KINDS[name], "by": locator[0], "value": locator[1], "invert": invert}
+    return None
+
+
+def _check_in_python(driver, prioritized_ec, allow_invert):
+    for i, condition in enumerate(prioritized_ec):
+        if not allow_invert and isinstance(condition, invert_expected_condition):
+            continue
+        try:
+            if condition(driver):
+                return i
+        except WebDriverException:
+            pass
+    return None
+
+
+def wait_for_first(driver, prioritized_ec, timeout, settle_time=0):
+    """
+    Returns the index of the first satisfied condition. Inverted conditions are trivially true before the
+    page has settled, so they may only win after `settle_time`; positive conditions return immediately.
+    Translatable conditions are all checked in one execute_script round-trip per poll.
+    """
+    specs = [to_probe_spec(c) for c in prioritized_ec]
+    use_script = all(s is not None for s in specs)
+    settle_end = time.monotonic() + settle_time
+
+    def probe():
+        allow_invert = time.monotonic() >= settle_end
+        if not use_script:
+            return _check_in_python(driver, prioritized_ec, allow_invert)
+        try:
+            index = driver.execute_script(_PROBE_SCRIPT, specs, allow_invert)
+        except WebDriverException:
+            # page is navigating, try again on the next poll
+            return None
+        return index if index is not None and index >= 0 else None
+
+    return poll_until(probe, max(timeout, settle_time),
+                      lambda: TimeoutException(msg="None of conditions satisfied"))
@@ -21,6 +21,7 @@ class TcJson:
     ENCODING = "encoding"
     EXTENSION = "extension"
     FILES = "files"
+    PATH = "path"
 
 
 class MessageType:
@@ -95,13 +96,31 @@ def __resolve_result(d):
         return ActionResult.SUCCESS
 
 
+class _LazyFileBase64:
+    """
+    Picture referenced by a message, only read from disk when the action log is serialized
+    """
+
+    def __init__(self, path):
+        self.__path = path
+
+    def result(self):
+        with open(self.__path, "rb") as f:
+            return base64.b64encode(f.read()).decode('ascii')
+
+
+def __file_content(file):
+    path = file.get(TcJson.PATH)
+    return _LazyFileBase64(path) if path is not None else file.get(TcJson.CONTENT)
+
+
 def __resolve_screenshot(d, file_dict):
     msg_type = d.get(ATTR_MSG_TYPE)
     pic_name = d.get(ATTR_PIC)
     if msg_type == MessageType.ERROR and pic_name is not None:
         file = file_dict.get(pic_name)
         if file is not None:
-            return file.get(TcJson.CONTENT)
+            return __file_content(file)
     return None
 
 
@@ -113,7 +132,7 @@ def __test_visualization(d, file_dict):
         if vis_name is not None:
             file = file_dict.get(vis_name)
             if file is not None:
-                return file.get(TcJson.CONTENT)
+                return __file_content(file)
     return None
 
 
@@ -121,26 +140,26 @@ def __parse_msg_message(attr_message):
     return attr_message, attr_message
 
 
-def __message2action_log(d, file_dict, screenshots_opt):
-    action_id = __resolve_id(d)
-    action_type, action_value = __parse_msg_message(d.get(ATTR_MSG_MESSAGE))
-    action_time = d.get(ATTR_DATE)
-    duration = 0
-    result = __resolve_result(d)
+def __resolve_message_screenshot(d, result, file_dict, screenshots_opt):
     if screenshots_opt == ScreenshotsOption.DEFAULT:
         if result == ActionResult.FAILURE:
-            screenshot = __resolve_screenshot(d, file_dict)
-        else:
-            screenshot = None
+            return __resolve_screenshot(d, file_dict)
     elif screenshots_opt == ScreenshotsOption.NO_RESIZE_ALL:
         if result == ActionResult.FAILURE:
-            screenshot = __resolve_screenshot(d, file_dict)
+            return __resolve_screenshot(d, file_dict)
         else:
-            screenshot = __test_visualization(d, file_dict)
-    else:
-        screenshot = None
+            return __test_visualization(d, file_dict)
+    return None
+
 
-    return ActionLog(None, action_type, action_value, action_time, duration, result, screenshots=screenshot,
+def __message2action_log(d, action_group, duration, file_dict, screenshots_opt):
+    action_id = __resolve_id(d)
+    action_type, action_value = __parse_msg_message(d.get(ATTR_MSG_MESSAGE))
+    action_time = d.get(ATTR_DATE)
+    result = __resolve_result(d)
+    screenshot = __resolve_message_screenshot(d, result, file_dict, screenshots_opt)
+
+    return ActionLog(action_group, action_type, action_value, action_time, duration, result, screenshots=screenshot,
                      action_id=action_id)
 
 
@@ -156,61 +175,62 @@ def __look_for_ids(d):
 
 
 def __parse_e(test_id, element, file_dict, screenshots_opt, region):
-    msgs = {}
+    return __parse_message_nodes(test_id, element[0], file_dict, screenshots_opt, region)
+
+
+# message numbers are normally a dense 0..n-1 run, which can be placed directly instead of sorted
+def __order_messages(numbered):
+    count = len(numbered)
+    ordered = [None] * count
+    for c, d in numbered:
+        if not 0 <= c < count or ordered[c] is not None:
+            return [d for _, d in sorted(numbered, key=lambda item: item[0])]
+        ordered[c] = d
+    return ordered
+
+
+def __parse_message_nodes(test_id, nodes, file_dict, screenshots_opt, region):
+    numbered = []
     first_action_time = datetime.now()
-    app_id = None
-    feature_id = None
-    for child in element[0]:
+    for child in nodes:
         name = child.attrib[ATTR_NAME]
         if child.tag == ATTR_NODE and ATTR_MESSAGE_PREFIX in name:
             c = int(name[name.index(' ') + 1:])
             d = __node2dict(child)
+            action_time = d.get(ATTR_DATE)
+            first_action_time = action_time if first_action_time > action_time else first_action_time
+            numbered.append((c, d))
 
-            tmp_app_id, tmp_feature_id = __look_for_ids(d)
-            if tmp_app_id is not None or tmp_feature_id is not None:
-                if tmp_feature_id is not None:
-                    feature_id = tmp_feature_id
-                if tmp_app_id is not None:
-                    app_id = tmp_app_id
-
-            msg = __message2action_log(d, file_dict, screenshots_opt)
-            first_action_time = msg.get_action_time() \
-                if first_action_time > msg.get_action_time() else first_action_time
-            msgs[c] = msg
+    # single pass in message order: ids, action group propagation, initiation default and durations
+    app_id = None
+    feature_id = None
+    last_action_group = None
+    recent_action_time = first_action_time
+    logs = []
+    for d in __order_messages(numbered):
+        tmp_app_id, tmp_feature_id = __look_for_ids(d)
+        if tmp_feature_id is not None:
+            feature_id = tmp_feature_id
+        if tmp_app_id is not None:
+            app_id = tmp_app_id
+
+        message = d.get(ATTR_MSG_MESSAGE)
+        if TC_ACTION_GROUP_PREFIX in message:
+            last_action_group = message[len(TC_ACTION_GROUP_PREFIX):]
+        action_group = last_action_group if last_action_group is not None else "initiation"
+
+        action_time = d.get(ATTR_DATE)
+        duration = (action_time - recent_action_time).total_seconds() * 1000
+        recent_action_time = action_time
+        logs.append(__message2action_log(d, action_group, duration, file_dict, screenshots_opt))
 
     tc = TestCase(app_id, feature_id, TEST_ENGINE_TEST_EXECUTE, test_id=test_id, action_time=first_action_time,
                   region=region)
-    resolve_action_group(msgs)
-    resolve_init_action_group(msgs)
-
-    recent_action_time = first_action_time
-    for k, v in sorted(msgs.items()):
-        duration = (v.get_action_time() - recent_action_time).total_seconds() * 1000
-        recent_action_time = v.get_action_time()
-        v.set_duration(duration)
-        tc.append_log(v)
-
+    for log in logs:
+        tc.append_log(log)
     return tc
 
 
-def resolve_action_group(msgs):
-    last_action_group = None
-    for k, v in sorted(msgs.items()):
-        action_group = v.get_action_group()
-        action_value = v.get_value()
-        if action_group is None:
-            if TC_ACTION_GROUP_PREFIX in action_value:
-                last_action_group = action_value[len(TC_ACTION_GROUP_PREFIX):]
-            v.set_action_group(last_action_group)
-
-
-def resolve_init_action_group(msgs):
-    for k, v in sorted(msgs.items()):
-        action_group = v.get_action_group()
-        if action_group is None:
-            v.set_action_group("initiation")
-
-
 def __png2base64jpg(file):
     png = Image.open(file)
     byte_jpg = io.BytesIO()
@@ -237,6 +257,50 @@ def parse_xml(test_id, xml_str, file_dict, screenshots_opt, region):
     return __parse_e(test_id, element, file_dict, screenshots_opt, region)
 
 
+# yields the children of the root's first element, releasing each one once the caller has consumed it
+def __iter_message_nodes(xml_path):
+    depth = 0
+    first_child_seen = False
+    in_first_child = False
+    context = ElementTree.iterparse(xml_path, events=("start", "end"))
+    parent = None
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            if depth == 2 and not first_child_seen:
+                first_child_seen = True
+                in_first_child = True
+                parent = elem
+            continue
+
+        depth -= 1
+        if depth == 2 and in_first_child:
+            yield elem
+            parent.remove(elem)
+        elif depth == 1 and in_first_child:
+            in_first_child = False
+            elem.clear()
+        elif depth == 1:
+            elem.clear()
+
+
+# parses a TestComplete log directory in place: the root xml is streamed and pictures are read lazily by path
+def parse_dir(directory, screenshots_opt, region):
+    file_dict = {}
+    root_file = None
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            file_dict[entry.name] = {TcJson.NAME: entry.name, TcJson.PATH: entry.path}
+            if entry.name.startswith('{') and entry.name.endswith('}'):
+                root_file = entry
+    if root_file is None:
+        return None
+    test_id = str(uuid.UUID(root_file.name))
+    return __parse_message_nodes(test_id, __iter_message_nodes(root_file.path), file_dict, screenshots_opt, region)
+
+
 def parse_json_dir(json_dir, screenshots_opt, region):
     directory = json.loads(json_dir)
     files = directory.get(TcJson.FILES)
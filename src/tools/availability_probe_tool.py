@@ -0,0 +1,33 @@
+import json
+import sys
+import time
+
+from src.test_script.probe_engine import ProbeEngine
+from src.test_script.script_dict import AT_FILE
+
+
+# probes every availability url of am_tests.json at once and shows which ones would still need a browser
+def load_targets(at_file=AT_FILE):
+    with open(at_file) as f:
+        tests = json.load(f)["tests"]
+    return [(link_obj["url"], link_obj.get("title"), link_obj.get("requires_js", False))
+            for service in tests for link_obj in service["urls"]]
+
+
+if __name__ == '__main__':
+    targets = load_targets(sys.argv[1] if len(sys.argv) > 1 else AT_FILE)
+    engine = ProbeEngine()
+    start = time.perf_counter()
+    results = engine.probe_many([url for url, _, _ in targets])
+    elapsed = time.perf_counter() - start
+    engine.close()
+
+    browser_runs = 0
+    for (url, title, requires_js), result in zip(targets, results):
+        needs_browser = requires_js or not result.is_available(title)
+        browser_runs += 1 if needs_browser else 0
+        timing = result.timing()
+        print(f"{'browser' if needs_browser else 'probe'}\t{result.status}\tdns {timing['dns_ms']:.0f}\t"
+              f"tcp {timing['connect_ms']:.0f}\ttls {timing['tls_ms']:.0f}\tttfb {timing['ttfb_ms']:.0f}\t"
+              f"total {timing['total_ms']:.0f} ms\t{url}\t{result.exception or ''}")
+    print(f"{len(targets)} urls probed in {elapsed:.2f} s, {browser_runs} still need a browser")
@@ -3,6 +3,7 @@ import json
 import logging
 import sys
 
+from src.model.blob import is_blob_ref
 from src.database.utils import get_namp_screenshots_data_dir, b642bytes
 from src.model.log.action_log import ActionJson
 from src.model.testcase import TestJson
@@ -16,7 +17,8 @@ def process_line(_line):
         actions = obj[TestJson.ACTIONS]
         for a in actions:
             screenshots = a[ActionJson.SCREENSHOTS]
-            if screenshots is not None:
+            # referenced screenshots were uploaded to the service separately
+            if screenshots is not None and not is_blob_ref(screenshots):
                 action_id = a[ActionJson.ID]
                 screenshot_dir.init_then_get_file_path(action_id, extension=JPEG_EXTENSION).write_bytes(b642bytes(screenshots))
     except json.decoder.JSONDecodeError:
@@ -0,0 +1,60 @@
+import gc
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from uuid import uuid4 as gen_uuid
+
+from src.model.action import ActionResult
+from src.model.log.action_log import ActionLog
+
+DEFAULT_ACTION_LOGS = 1_000_000
+
+
+# ActionLog as it was before slots: instance dict, datetime timestamp and an eagerly generated id
+class DictActionLog(object):
+
+    def __init__(self, action_group, action_type, action_value, action_time, duration, result, exception=None,
+                 screenshots=None, page_source=None, action_id=None):
+        self.__action_id = action_id if action_id is not None else str(gen_uuid())
+        self.__action_group = action_group
+        self.__action_type = action_type
+        self.__action_value = action_value
+        self.__action_time = action_time
+        self.__duration = duration
+        self.__result = result
+        self.__exception = exception
+        self.__screenshots = screenshots
+        self.__page_source = page_source
+
+    def get_id(self):
+        return self.__action_id
+
+
+def build(log_class, n):
+    start = datetime.now()
+    groups = [f"group_{i}" for i in range(50)]
+    logs = [log_class(groups[i % 50], "click", "button", start + timedelta(microseconds=i), 12.5,
+                      ActionResult.SUCCESS) for i in range(n)]
+    # every action is serialized with its id, so the slotted log's lazy id is always generated in the end
+    for log in logs:
+        log.get_id()
+    return logs
+
+
+def measure(name, log_class, n):
+    gc.collect()
+    tracemalloc.start()
+    begin = time.perf_counter()
+    logs = build(log_class, n)
+    elapsed = time.perf_counter() - begin
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name}:\t{n} logs\t{current / 1024 / 1024:.1f} MB\t{current / n:.0f} bytes/log\t{elapsed:.2f} s")
+    del logs
+
+
+if __name__ == '__main__':
+    num_logs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ACTION_LOGS
+    measure("dict ActionLog", DictActionLog, num_logs)
+    measure("slotted ActionLog", ActionLog, num_logs)
@@ -0,0 +1,59 @@
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from src.client.schedule_queue import ScheduleQueue
+
+DEFAULT_HOLDERS = 10_000
+DEFAULT_SPREAD_SECONDS = 10
+PERCENTILES = [50, 90, 99, 99.9, 100]
+
+
+class _SyntheticHolder:
+
+    def __init__(self, next_schedule):
+        self.next_schedule = next_schedule
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def run(num_holders, spread_seconds):
+    schedule_queue = ScheduleQueue()
+    start = datetime.now() + timedelta(seconds=1)
+    # half the holders are known up front, the other half arrive while the dispatcher is waiting
+    upfront = num_holders // 2
+    for _ in range(upfront):
+        schedule_queue.push(_SyntheticHolder(start + timedelta(seconds=random.uniform(0, spread_seconds))))
+
+    def late_producer():
+        for _ in range(num_holders - upfront):
+            offset = random.uniform(0.05, 0.5)
+            schedule_queue.push(_SyntheticHolder(datetime.now() + timedelta(seconds=offset)))
+            time.sleep(spread_seconds / (num_holders - upfront))
+
+    producer = threading.Thread(target=late_producer, daemon=True)
+    producer.start()
+
+    lags_ms = []
+    while len(lags_ms) < num_holders:
+        holder = schedule_queue.pop_due(deadline=time.time() + 1)
+        if holder is not None:
+            lags_ms.append((time.time() - holder.next_schedule.timestamp()) * 1000)
+    producer.join()
+    return sorted(lags_ms)
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_HOLDERS
+    spread = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_SPREAD_SECONDS
+    lags = run(n, spread)
+    print(f"dispatched {len(lags)} holders over ~{spread} seconds")
+    for p in PERCENTILES:
+        print(f"p{p}:\t{percentile(lags, p):.3f} ms")
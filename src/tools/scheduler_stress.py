@@ -0,0 +1,101 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from src.client.scheduler_state import SchedulerState
+from src.client.utils import VmStatistics, VM_REPORT_SIZE
+
+DEFAULT_WORKERS = 64
+DEFAULT_RUNS_PER_WORKER = 5_000
+NUM_FEATURES = 16
+
+
+class _SyntheticTestCase:
+
+    def __init__(self, success):
+        self.action_time = datetime.now()
+        self.__success = success
+
+    def is_success(self):
+        return self.__success
+
+
+# one executor worker's life: the dispatcher's enqueue, then start, report and finish as TestScheduler does
+def worker(state, vm_stats, worker_id, runs):
+    feature_id = f"feature_{worker_id % NUM_FEATURES}"
+    for i in range(runs):
+        state.enqueue()
+        if i % 10 == 0:
+            vm_stats.defer_test()
+        if i % 7 == 0:
+            vm_stats.skip_test(datetime.now())
+            state.finish(feature_id, completed=False)
+            continue
+        state.start(feature_id, datetime.now())
+        vm_stats.record(_SyntheticTestCase(i % 3 != 0), 200)
+        state.finish(feature_id, completed=True)
+
+
+# what gen_report reads, as often as it can while the workers run
+def reporter(state, vm_stats, stop, errors, reports):
+    deferred = 0
+    while not stop.is_set():
+        try:
+            snapshot = state.snapshot()
+            if snapshot.running_queue_size < 0:
+                errors.append(f"negative running queue size {snapshot.running_queue_size}")
+            for feature_id, start_time in snapshot.running_features.items():
+                if feature_id not in snapshot.scheduled_features or start_time > datetime.now():
+                    errors.append(f"unexpected running feature {feature_id} since {start_time}")
+            items = vm_stats.reporting_snapshot()
+            if len(items) > VM_REPORT_SIZE:
+                errors.append(f"{len(items)} reporting items")
+            deferred += vm_stats.num_deferred.reset()
+            reports[0] += 1
+        except Exception as e:
+            errors.append(repr(e))
+    reports[1] = deferred + vm_stats.num_deferred.reset()
+
+
+def run(num_workers, runs_per_worker):
+    state = SchedulerState()
+    vm_stats = VmStatistics()
+    for i in range(NUM_FEATURES):
+        state.add_scheduled(f"feature_{i}")
+    stop = threading.Event()
+    errors = []
+    reports = [0, 0]
+    reporter_thread = threading.Thread(target=reporter, args=(state, vm_stats, stop, errors, reports))
+    reporter_thread.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(worker, state, vm_stats, i, runs_per_worker) for i in range(num_workers)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    stop.set()
+    reporter_thread.join()
+
+    snapshot = state.snapshot()
+    expected_deferred = num_workers * len(range(0, runs_per_worker, 10))
+    if snapshot.running_queue_size != 0:
+        errors.append(f"running queue size {snapshot.running_queue_size} after all tests finished")
+    if snapshot.running_features:
+        errors.append(f"still running: {sorted(snapshot.running_features)}")
+    if reports[1] != expected_deferred:
+        errors.append(f"{reports[1]} deferrals counted, {expected_deferred} expected")
+    return elapsed, reports[0], errors
+
+
+if __name__ == '__main__':
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_WORKERS
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_RUNS_PER_WORKER
+    elapsed, num_reports, errors = run(workers, runs)
+    print(f"{workers} workers x {runs} tests in {elapsed:.2f} s, {num_reports} reports taken meanwhile")
+    for error in errors[:20]:
+        print(f"FAILED: {error}")
+    print("state consistent" if not errors else f"{len(errors)} inconsistencies")
+    sys.exit(1 if errors else 0)
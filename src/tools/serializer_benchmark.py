@@ -0,0 +1,78 @@
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from src.model.action import ActionResult
+from src.model.log.action_log import ActionLog
+from src.model.testcase import TestCase, TestJson
+
+DEFAULT_ACTIONS = 2_000
+SCREENSHOT_BYTES = 48 * 1024
+SCREENSHOT_EVERY = 1
+
+
+def build_test_case(num_actions):
+    start = datetime.now()
+    screenshot = base64.b64encode(os.urandom(SCREENSHOT_BYTES)).decode("ascii")
+    tc = TestCase("benchmark_app", "benchmark_app|selenium|synthetic", "selenium", action_time=start)
+    for i in range(num_actions):
+        tc.append_log(ActionLog(f"group_{i // 20}", "click", f"button_{i}", start + timedelta(seconds=i), 120.5,
+                                ActionResult.SUCCESS,
+                                screenshots=screenshot if i % SCREENSHOT_EVERY == 0 else None))
+    return tc
+
+
+# the dict + json.dumps path to_json used before streaming, overrides patched with a loads/dumps round trip
+def dict_to_json(tc, result=None):
+    content = json.dumps({
+        TestJson.TEST_ID: tc.test_id,
+        TestJson.TEST_ENGINE: tc.test_engine,
+        TestJson.ACTIONS: [log.to_dict_json() for log in tc.logs],
+        TestJson.FEATURE_ID: tc.feature_id,
+        TestJson.APP_ID: tc.app_id,
+        TestJson.EVENT_TIME: tc.action_time.astimezone().isoformat(),
+        TestJson.DURATION: _duration(tc),
+        TestJson.THINK_TIME: tc.get_think_time(),
+        TestJson.RESULT: tc.result,
+        TestJson.REGION: tc.region,
+        TestJson.METADATA: tc.metadata
+    })
+    if result is not None:
+        c = json.loads(content)
+        c[TestJson.RESULT] = result
+        content = json.dumps(c)
+    return content
+
+
+def _duration(tc):
+    last = tc.logs[-1]
+    return (last.get_action_time() - tc.action_time).total_seconds() * 1000 + last.get_duration()
+
+
+# timing and peak memory are measured in separate runs, tracemalloc slows encoding down
+def measure(name, func):
+    start = time.perf_counter()
+    content = func()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name}:\t{len(content) / 1024 / 1024:.1f} MB output\t{elapsed:.2f} s\tpeak {peak / 1024 / 1024:.1f} MB")
+    return content
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_ACTIONS
+    test_case = build_test_case(n)
+    streamed = measure("to_json", lambda: test_case.to_json())
+    dumped = measure("dict + json.dumps", lambda: dict_to_json(test_case))
+    assert streamed == dumped, "streamed output differs from json.dumps"
+    overridden = measure("to_json override", lambda: test_case.to_json(result=ActionResult.FAILURE))
+    patched = measure("loads/dumps override", lambda: dict_to_json(test_case, result=ActionResult.FAILURE))
+    assert overridden == patched, "overridden output differs from the loads/dumps patch"
@@ -0,0 +1,68 @@
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from pathlib import Path
+
+from src.test_script.script_utils import ScreenshotsOption
+from src.testcomplete.tc_parser import parse_dir, parse_json_dir, dir2json, APP_ID_PREFIX, FEATURE_ID_PREFIX, \
+    TC_ACTION_GROUP_PREFIX
+
+DEFAULT_MESSAGES = 50_000
+GROUP_EVERY = 50
+ERROR_EVERY = 1_000
+OLE_START = 45_000.0
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def __message_xml(i):
+    if i == 0:
+        text = f"{APP_ID_PREFIX}benchmark_app"
+    elif i == 1:
+        text = f"{FEATURE_ID_PREFIX}benchmark_app|tc|synthetic"
+    elif i % GROUP_EVERY == 0:
+        text = f"{TC_ACTION_GROUP_PREFIX}group_{i // GROUP_EVERY}"
+    else:
+        text = f"Clicked the 'button_{i}' control"
+    is_error = i % ERROR_EVERY == ERROR_EVERY - 1
+    picture = f'<Prp name="picture" type="S" value="pic_{i}.png"/>' if is_error else ''
+    return (f'<Node name="message {i}">'
+            f'<Prp name="message" type="S" value="{text}"/>'
+            f'<Prp name="type" type="I" value="{3 if is_error else 0}"/>'
+            f'<Prp name="date" type="D" value="{OLE_START + i / SECONDS_PER_DAY}"/>'
+            f'<Prp name="signature" type="S" value="{uuid.uuid4()}"/>'
+            f'{picture}</Node>')
+
+
+def generate_log(directory, num_messages):
+    root_name = "{" + str(uuid.uuid4()).upper() + "}"
+    with open(Path(directory) / root_name, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?><Root><Node name="root">')
+        for i in range(num_messages):
+            f.write(__message_xml(i))
+            if i % ERROR_EVERY == ERROR_EVERY - 1:
+                (Path(directory) / f"pic_{i}.png").write_bytes(bytes(64 * 1024))
+        f.write('</Node></Root>')
+
+
+# timing and peak memory are measured in separate runs, tracemalloc slows parsing down several times
+def measure(name, func):
+    start = time.perf_counter()
+    tc = func()
+    tc.to_json()
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    func().to_json()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name}:\t{len(tc.logs)} actions\t{elapsed:.2f} s\tpeak {peak / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MESSAGES
+    with tempfile.TemporaryDirectory() as log_dir:
+        generate_log(log_dir, n)
+        measure("parse_dir", lambda: parse_dir(log_dir, ScreenshotsOption.DEFAULT, "benchmark"))
+        measure("parse_json_dir", lambda: parse_json_dir(dir2json(log_dir), ScreenshotsOption.DEFAULT, "benchmark"))
@@ -0,0 +1,100 @@
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+from src.db_backend.write_buffer import WriteBehindBuffer, MAX_INSERT_ATTEMPTS, SPILL_SUFFIX, \
+    DEAD_LETTER_DIR_NAME, STOPPED_REASON, TMP_SUFFIX
+
+
+class FakeBigQueryClient:
+    """
+    insert_rows_json as bigquery answers it: rows marked `poison` are invalid and stop every other row
+    of the request, rows are deduplicated by their insert id. Errors don't come in row order. `down`
+    fails requests, `ambiguous` fails them after the rows were inserted.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.requests = 0
+        self.down = False
+        self.ambiguous = False
+
+    def insert_rows_json(self, table_id, rows, row_ids=None):
+        self.requests += 1
+        if self.down:
+            raise ConnectionError("service unavailable")
+        row_ids = row_ids if row_ids is not None else [None] * len(rows)
+        poison = [i for i, row in enumerate(rows) if row.get("poison")]
+        if poison:
+            return [{"index": i, "errors": [{"reason": "invalid", "message": f"n={rows[i]['n']}"} if i in poison
+                                            else {"reason": STOPPED_REASON}]}
+                    for i in reversed(range(len(rows)))]
+        table = self.tables.setdefault(table_id, {})
+        for row_id, row in zip(row_ids, rows):
+            table[row_id if row_id is not None else object()] = row
+        if self.ambiguous:
+            raise TimeoutError("inserted, but the answer was lost")
+        return []
+
+
+def rows(n, start=0, **extra):
+    return [dict({"n": i}, **extra) for i in range(start, start + n)]
+
+
+def spilled_files(spill_dir):
+    return list(Path(spill_dir).glob(f"*{SPILL_SUFFIX}"))
+
+
+def run():
+    errors = []
+    client = FakeBigQueryClient()
+    spill_dir = tempfile.mkdtemp()
+    # flushed and replayed by hand only
+    buffer = WriteBehindBuffer(lambda table, batch, row_ids: client.insert_rows_json(table, batch, row_ids=row_ids),
+                               spill_dir, max_batch_rows=10, flush_interval=3600, replay_interval=3600)
+
+    def check(name, condition):
+        print(f"{'ok' if condition else 'FAILED'}\t{name}")
+        if not condition:
+            errors.append(name)
+
+    buffer.add("tests", rows(25))
+    buffer.flush()
+    check("rows are inserted in batches", len(client.tables["tests"]) == 25 and client.requests == 3)
+
+    client.down = True
+    buffer.add("tests", rows(5, 100))
+    buffer.flush()
+    check("failed requests are spilled", len(spilled_files(spill_dir)) == 1)
+    client.down = False
+    buffer.replay_spilled()
+    check("spilled rows are replayed", len(client.tables["tests"]) == 30 and not spilled_files(spill_dir))
+
+    client.ambiguous = True
+    buffer.add("tests", rows(5, 200))
+    buffer.flush()
+    client.ambiguous = False
+    buffer.replay_spilled()
+    check("replays after ambiguous failures are deduplicated", len(client.tables["tests"]) == 35)
+
+    buffer.add("tests", rows(4, 300) + rows(2, 400, poison=True))
+    buffer.flush()
+    check("rows stopped by a poison row are inserted without it", len(client.tables["tests"]) == 39)
+    for _ in range(MAX_INSERT_ATTEMPTS):
+        buffer.replay_spilled()
+    dead_letters = list((Path(spill_dir) / DEAD_LETTER_DIR_NAME).glob(f"*{SPILL_SUFFIX}"))
+    dead_rows = [json.loads(line) for path in dead_letters for line in path.read_text().splitlines()]
+    check("poison rows end in the dead letter directory",
+          not spilled_files(spill_dir) and sorted(r["row"]["n"] for r in dead_rows) == [400, 401])
+    check("dead letters keep their own errors",
+          all(r["errors"][0]["message"] == f"n={r['row']['n']}" for r in dead_rows))
+    check("no partially written files left", not list(Path(spill_dir).rglob(f"*{TMP_SUFFIX}")))
+
+    buffer.close()
+    check("nothing left buffered", buffer.buffered_rows() == 0)
+    return errors
+
+
+if __name__ == '__main__':
+    sys.exit(1 if run() else 0)